@@ -1,5 +1,27 @@
+import asyncrunner
 import discover
+import discoverycache
+import graphbank
+import io
+import jobqueue
+import jobrunner
+import numpy
+import os
+import pandas
+import pcalg
+import powersearch
+import process_simdata
+import resourcemodel
+import resultstore
+import sequential
+import shlex
+import slurmarray
+import sys
+import tempfile
+import time
 import unittest
+import unittest.mock
+import workerpool
 import picause
 
 
@@ -73,6 +95,90 @@ class TestPicause(unittest.TestCase):
         result3 = picause.confusion_matrix(6, tg3, dg3)
         self.assertEqual(result3, (5, 1, 1, 8))
 
+    def test_graph_conversions(self):
+        g = picause.Graph.from_adjacencystr(self.graphstr, 10)
+        self.assertEqual(len(g), 10)
+        self.assertEqual(g.sources.dtype, numpy.int32)
+        self.assertTrue(g.has_edge(5, 4))
+        self.assertFalse(g.has_edge(4, 5))
+        self.assertTrue(g.is_adjacent(4, 5))
+        self.assertEqual(g.to_adjacencystr(), self.graphstr)
+        self.assertEqual(g.to_arrowstr(), picause.adjacencystr2arrowstr(self.graphstr))
+        self.assertEqual(g.to_pairlist(), picause.adjacencystr2pairlist(self.graphstr))
+        self.assertEqual(picause.Graph.from_arrowstr(g.to_arrowstr(), 10), g)
+        self.assertEqual(picause.Graph.from_pairlist(g.to_pairlist(), 10), g)
+
+        dg = picause.Graph.from_arrowstr("x_1 --> x_2, x_3 --- x_2, x_4 <-> x_1")
+        self.assertEqual(dg.num_nodes, 4)
+        self.assertEqual(dg.edge_kind(2, 1), picause.UNDIRECTED)
+        self.assertEqual(dg.to_adjacencystr(directed=False), "0302;")
+
+        sem = picause.StructuralEquationDagModel(E=g, seed=self.seed)
+        self.assertEqual(sem.V, g.get_names())
+        self.assertEqual(sem.get_graph(), g)
+
+    def test_graph_confusion_matrices(self):
+        names = ['A', 'B', 'C', 'D', 'E', 'F']
+        cases = [("A --> B, C --> B, C --> D", "A --> B, C --> B, C --- D"),
+                 ("A --> B, A --> C", "B --> A, A --- C"),
+                 ("A --> B, B --> C, D --> B, B --> E, D --> F, E --> F",
+                  "A --> B, D --> B, B --> E, D --- E, D --- F, E --- F")]
+        for tg, dg in cases:
+            tgraph = picause.Graph.from_arrowstr(tg, names=names)
+            dgraph = picause.Graph.from_arrowstr(dg, names=names)
+            self.assertEqual(picause.oriented_confusion_matrix(tgraph, dgraph),
+                             picause.oriented_confusion_matrix(tg, dg))
+            self.assertEqual(picause.confusion_matrix(6, tgraph, dgraph),
+                             picause.confusion_matrix(6, picause.arrowstr2pairlist(tg),
+                                                      picause.arrowstr2pairlist(dg)))
+
+    def test_batch_confusion_matrix(self):
+        names = ['A', 'B', 'C', 'D', 'E', 'F']
+        tg = "A --> B, B --> C, D --> B, B --> E, D --> F, E --> F"
+        dgs = ["A --> B, C --> B, C --- D", "B --> A, A --- C",
+               "A --> B, D --> B, B --> E, D --- E, D --- F, E --- F", ""]
+        directed, undirected = picause.graphs2masks(
+            [picause.Graph.from_arrowstr(dg, names=names) for dg in dgs], 6)
+        results = picause.batch_confusion_matrix(
+            picause.Graph.from_arrowstr(tg, names=names), directed, undirected)
+        for k, dg in enumerate(dgs):
+            skeletal = picause.confusion_matrix(6, picause.arrowstr2pairlist(tg),
+                                                picause.arrowstr2pairlist(dg))
+            oriented = picause.oriented_confusion_matrix(tg, dg)
+            self.assertEqual(skeletal, tuple(results['skeletal_' + c][k]
+                                             for c in ['TP', 'FP', 'FN', 'TN']))
+            for c, v in oriented.items():
+                self.assertEqual(v, results[c][k])
+
+    def test_read_causal_output(self):
+        output = ("PC (Fri, October 27, 2023)\n\nGraph Nodes:\nx_1;x_2;x_3;x_4;x_5\n\n"
+                  "Graph Edges:\n1. x_1 --> x_2\n2. x_3 --- x_2\n3. x_4 <-> x_5\n"
+                  "4. x_5 o-> x_1\n5. x_2 --> x_5\n\nGraph Attributes:\nScore: -1.0\n")
+        edges = list(picause.iter_causal_output(io.StringIO(output)))
+        self.assertEqual(edges, [(0, 1, picause.DIRECTED), (2, 1, picause.UNDIRECTED),
+                                 (3, 4, picause.BIDIRECTED),
+                                 (4, 0, picause.PARTIALLY_DIRECTED),
+                                 (1, 4, picause.DIRECTED)])
+        graph = picause.read_causal_output(io.StringIO(output))
+        self.assertEqual(graph.num_nodes, 5)
+        self.assertEqual(graph.select(picause.DIRECTED).to_arrowstr(),
+                         "x_1 --> x_2, x_2 --> x_5")
+
+        written = io.StringIO()
+        picause.write_causal_output(written, graph)
+        self.assertEqual(picause.read_causal_output(io.StringIO(written.getvalue())), graph)
+
+        # a run that died after its header has no graph, not an empty one
+        header = output[:output.index('Graph Edges:')]
+        with self.assertRaises(ValueError):
+            picause.read_causal_output(io.StringIO(header))
+        with self.assertRaises(ValueError):
+            list(picause.iter_causal_output(io.StringIO(header)))
+        # and a causal-cmd call that exits with an error raises
+        with unittest.mock.patch.object(picause, 'discover_command', return_value='exit 3'):
+            with self.assertRaises(RuntimeError):
+                picause.discover('data.csv', 'results')
+
     def test_adjacencystr2arrowstr(self):
         s = picause.adjacencystr2arrowstr(self.graphstr)
         self.assertTrue(s[-1].isdigit())
@@ -87,6 +193,534 @@ class TestPicause(unittest.TestCase):
         data = sem.generate_data(102400)
         self.assertTrue(data.at[13352, 'x_1'] - 1.8489197455815802 < 0.001)
 
+    def test_generate_data_outputs(self):
+        pl = picause.adjacencystr2pairlist(self.graphstr)
+        df = picause.StructuralEquationDagModel(num_var=10, E=pl,
+                                                seed=self.seed).generate_data(500)
+        arr = picause.StructuralEquationDagModel(num_var=10, E=pl,
+                                                 seed=self.seed).generate_data(500, output='array')
+        arr32 = picause.StructuralEquationDagModel(num_var=10, E=pl,
+                                                   seed=self.seed).generate_data(500, output='array',
+                                                                                 dtype=numpy.float32)
+        self.assertEqual(list(df.columns), ['x_{}'.format(i) for i in range(1, 11)])
+        self.assertEqual(arr.shape, (500, 10))
+        self.assertTrue(numpy.array_equal(df.values, arr))
+        self.assertEqual(arr32.dtype, numpy.float32)
+        self.assertTrue(numpy.allclose(arr32, arr, atol=1e-5))
+        with self.assertRaises(ValueError):
+            picause.StructuralEquationDagModel(num_var=10, E=pl).generate_data(10, output='foo')
+
+    def test_iter_data(self):
+        pl = picause.adjacencystr2pairlist(self.graphstr)
+        sem = picause.StructuralEquationDagModel(num_var=10, E=pl, seed=self.seed)
+        full = picause.StructuralEquationDagModel(num_var=10, E=pl,
+                                                  seed=self.seed).generate_data(1000)
+        for chunk_size in [1, 64, 1000]:
+            blocks = list(sem.iter_data(1000, chunk_size=chunk_size, output='array'))
+            self.assertEqual(len(blocks), -(-1000 // chunk_size))
+            self.assertTrue(numpy.array_equal(numpy.concatenate(blocks), full.values))
+        prefix = list(sem.iter_data(1000, chunk_size=128, num_rows=300))
+        self.assertEqual(prefix[-1].index[-1], 299)
+        self.assertTrue(numpy.array_equal(pandas.concat(prefix).values, full.values[:300]))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sem.write_data(tmpdir + '/data.csv', 1000, chunk_size=64, num_rows=300)
+            full[:300].to_csv(tmpdir + '/expected.csv', index=False)
+            with open(tmpdir + '/data.csv') as f, open(tmpdir + '/expected.csv') as g:
+                self.assertEqual(f.read(), g.read())
+            sem.write_data(tmpdir + '/data.npy', 1000, chunk_size=64)
+            self.assertTrue(numpy.array_equal(numpy.load(tmpdir + '/data.npy'), full.values))
+
+    def test_philox_data(self):
+        pl = picause.adjacencystr2pairlist(self.graphstr)
+        sem = picause.StructuralEquationDagModel(num_var=10, E=pl, seed=self.seed,
+                                                 data_rng='philox')
+        n = 3 * picause.PHILOX_BLOCK + 100
+        full = sem.generate_data(n, output='array')
+        # any rows on their own, in any order, on any number of workers
+        start, stop = picause.PHILOX_BLOCK - 7, 2 * picause.PHILOX_BLOCK + 13
+        for workers in [1, 3]:
+            rows = sem.generate_rows(start, stop, workers=workers)
+            self.assertTrue(numpy.array_equal(rows, full[start:stop]))
+        pieces = [(2000, n), (0, 2000)]
+        self.assertTrue(numpy.array_equal(
+            numpy.concatenate([sem.generate_rows(a, b) for a, b in pieces][::-1]), full))
+        # every size is a prefix of the same data, and streams the same way
+        self.assertTrue(numpy.array_equal(sem.generate_data(500, output='array'), full[:500]))
+        blocks = list(sem.iter_data(n, chunk_size=1000, num_rows=2500, workers=2))
+        self.assertEqual(blocks[-1].index[-1], 2499)
+        self.assertTrue(numpy.array_equal(pandas.concat(blocks).values, full[:2500]))
+        self.assertLess(numpy.abs(numpy.cov(full, rowvar=False) - sem.make_cov_array()).max(),
+                        0.1)
+        self.assertFalse(numpy.array_equal(
+            full, picause.StructuralEquationDagModel(num_var=10, E=pl, seed=self.seed + 1,
+                                                     data_rng='philox').generate_data(
+                n, output='array')))
+        with self.assertRaises(ValueError):
+            picause.StructuralEquationDagModel(num_var=10, E=pl, seed=self.seed).generate_rows(0, 10)
+
+    def test_closed_form_covariance(self):
+        for num_var, num_edges, beta in [(10, 10, 0.3), (20, 40, 0.3), (20, 40, 0.7)]:
+            sem = picause.StructuralEquationDagModel(num_var=num_var,
+                                                     num_edges=num_edges,
+                                                     seed=self.seed, beta=beta)
+            loop_cov = sem.make_cov_matrix().loc[sem.V, sem.V].values
+            self.assertTrue(numpy.allclose(sem.make_cov_array(), loop_cov))
+            sem.make_residuals(sem.make_cov_matrix())
+            loop_residuals = numpy.array([sem.residual[v] for v in sem.V])
+            self.assertTrue(numpy.allclose(sem.make_residual_array(), loop_residuals))
+            self.assertEqual(sem.test_residual_overflow(), min(loop_residuals) < 0)
+
+    def test_iter_covariances(self):
+        sem = picause.StructuralEquationDagModel(num_var=8, num_edges=8, seed=self.seed)
+        sizes = [1000, 50, 333]
+        results = list(sem.iter_covariances(1000, sizes, chunk_size=64))
+        data = sem.generate_data(1000, output='array')
+        self.assertEqual([n for n, _ in results], sorted(sizes))
+        for n, cov in results:
+            self.assertTrue(numpy.allclose(cov, numpy.cov(data[:n], rowvar=False)))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            picause.write_covariance(tmpdir + '/data.cov', cov, n, sem.V)
+            cov2, n2, names = picause.read_covariance(tmpdir + '/data.cov')
+        self.assertTrue(numpy.array_equal(cov2, cov))
+        self.assertEqual((n2, names), (n, sem.V))
+
+    def test_random_dag_edges(self):
+        rng = numpy.random.default_rng(self.seed)
+        sources, targets, attempts = picause.random_dag_edges(1000, 5000, rng, max_indegree=9)
+        self.assertEqual(len(set(zip(sources.tolist(), targets.tolist()))), 5000)
+        self.assertTrue((sources < targets).all())
+        self.assertLessEqual(numpy.bincount(targets).max(), 9)
+        self.assertGreaterEqual(attempts, 5000)
+        # the densest graph the cap allows
+        sources, targets, _ = picause.random_dag_edges(10, 45, rng)
+        self.assertEqual(sorted(zip(sources.tolist(), targets.tolist())),
+                         sorted((i, j) for j in range(10) for i in range(j)))
+        with self.assertRaises(ValueError):
+            picause.random_dag_edges(10, 40, rng, max_indegree=3)
+
+        sem = picause.StructuralEquationDagModel(num_var=30, num_edges=60, seed=self.seed)
+        again = picause.StructuralEquationDagModel(num_var=30, num_edges=60, seed=self.seed)
+        self.assertEqual(sem.E, again.E)
+        self.assertEqual(sem.graph_attempts, again.graph_attempts)
+
+    def test_topological_order(self):
+        pl = picause.adjacencystr2pairlist(self.graphstr)
+        sem = picause.StructuralEquationDagModel(num_var=10, E=pl, seed=self.seed)
+        order = sem.get_topological_order()
+        for u, v in pl:
+            self.assertLess(order.index(u), order.index(v))
+        self.assertEqual(sem.get_topological_order(as_string=True), " < ".join(order))
+        self.assertEqual(sem._topological_order, order)
+
+        sem.set_E([('x_2', 'x_1')])
+        self.assertIsNone(sem._topological_order)
+        order = sem.get_topological_order()
+        self.assertLess(order.index('x_2'), order.index('x_1'))
+
+        with self.assertRaises(ValueError):
+            picause.topological_order_indices([[1], [0]])
+
+
+class TestPcalg(unittest.TestCase):
+    def setUp(self):
+        self.seed = 977351692186939434046756
+        self.sem = picause.StructuralEquationDagModel(
+            num_var=4, E=[('x_1', 'x_3'), ('x_2', 'x_3'), ('x_3', 'x_4')],
+            seed=self.seed, beta=0.5)
+
+    def test_pc_orients_collider(self):
+        data = self.sem.generate_data(5000, output='array')
+        graph = pcalg.pc(numpy.cov(data, rowvar=False), 5000, alpha=0.01)
+        self.assertEqual(graph.to_arrowstr(), "x_1 --> x_3, x_2 --> x_3, x_3 --> x_4")
+
+        chain = picause.StructuralEquationDagModel(num_var=3, E=[('x_1', 'x_2'), ('x_2', 'x_3')],
+                                                   seed=self.seed, beta=0.5)
+        data = chain.generate_data(5000, output='array')
+        graph = pcalg.pc(numpy.cov(data, rowvar=False), 5000, alpha=0.01)
+        self.assertEqual(graph.to_arrowstr(), "x_1 --- x_2, x_2 --- x_3")
+
+    def test_skeleton_batches(self):
+        sem = picause.StructuralEquationDagModel(num_var=20, num_edges=30, seed=self.seed,
+                                                 beta=0.3)
+        corr = pcalg.correlation_matrix(numpy.cov(sem.generate_data(200, output='array'),
+                                                  rowvar=False))
+        adjacency, sepsets = pcalg.pc_skeleton(corr, 200, 0.01)
+        for batch_size in [1, 7]:
+            batched, batched_sepsets = pcalg.pc_skeleton(corr, 200, 0.01, batch_size=batch_size)
+            self.assertTrue((batched == adjacency).all())
+            self.assertEqual(batched_sepsets, sepsets)
+
+    def test_numpy_backend(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.sem.write_data(tmpdir + '/data.csv', 5000)
+            results = picause.discovery_results(self.sem, tmpdir + '/data.csv', meta=0.01,
+                                                write=False, output_directory=tmpdir,
+                                                backend=pcalg.NumpyPCBackend())
+            self.assertEqual(results, "x_1 --> x_3, x_2 --> x_3, x_3 --> x_4")
+            graph = discover.read_discovered_graph(tmpdir + '/results.txt', 4)
+            self.assertEqual(graph.to_arrowstr(), results)
+
+            cov = numpy.cov(self.sem.generate_data(5000, output='array'), rowvar=False)
+            picause.write_covariance(tmpdir + '/data.cov', cov, 5000, self.sem.V)
+            covresults = picause.discovery_results(self.sem, tmpdir + '/data.cov', meta=0.01,
+                                                   write=False, output_directory=tmpdir,
+                                                   backend=pcalg.NumpyPCBackend(),
+                                                   data_type='covariance')
+            self.assertEqual(covresults, results)
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.sem = picause.StructuralEquationDagModel(E=[('x_1', 'x_3'), ('x_2', 'x_3'),
+                                                         ('x_3', 'x_4')],
+                                                      num_var=4, seed=7, beta=0.5)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.datafile = self.tmpdir.name + '/data.csv'
+        self.sem.write_data(self.datafile, 5000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_numpy_workers(self):
+        command = workerpool.worker_command('numpy')
+        with workerpool.WorkerPoolBackend(command, num_workers=2,
+                                          prefs_root=self.tmpdir.name) as pool:
+            results = [picause.discovery_results(self.sem, self.datafile, meta=0.01,
+                                                 write=False, output_directory=self.tmpdir.name,
+                                                 output_prefix='results{}'.format(i),
+                                                 backend=pool)
+                       for i in range(3)]
+            self.assertEqual(pool.check_health(), 0)
+        self.assertEqual(results, ["x_1 --> x_3, x_2 --> x_3, x_3 --> x_4"] * 3)
+
+    def test_worker_restarts(self):
+        command = workerpool.worker_command('fake', fail_after=1)
+        with workerpool.WorkerPoolBackend(command, num_workers=1,
+                                          prefs_root=self.tmpdir.name) as pool:
+            for _ in range(3):
+                graph = pool.run(self.datafile, output_directory=self.tmpdir.name)
+                self.assertEqual(len(graph.sources), 0)
+            self.assertEqual(pool.restarts, 2)
+
+        command = workerpool.worker_command('fake', delay=5)
+        with workerpool.WorkerPoolBackend(command, num_workers=1, timeout=0.5, max_restarts=0,
+                                          prefs_root=self.tmpdir.name) as pool:
+            with self.assertRaises(workerpool.WorkerError):
+                pool.run(self.datafile, output_directory=self.tmpdir.name)
+
+
+class TestAsyncRunner(unittest.TestCase):
+    def test_outcomes(self):
+        python = shlex.quote(sys.executable)
+        commands = [python + " -c 'print(1)'",
+                    python + " -c 'import sys; sys.stderr.write(\"boom\"); sys.exit(3)'",
+                    "sh -c 'echo partial; sleep 30'"]
+        ok, failed, timeout = asyncrunner.run_commands(commands, 3, timeout=1)
+        self.assertEqual((ok.outcome, ok.returncode, ok.stdout), ('ok', 0, '1\n'))
+        self.assertEqual((failed.outcome, failed.returncode, failed.stderr),
+                         ('failed', 3, 'boom'))
+        self.assertEqual((timeout.outcome, timeout.stdout), ('timeout', 'partial\n'))
+        self.assertLess(timeout.runtime, 10)
+
+
+class TestGraphBank(unittest.TestCase):
+    def test_implied_residuals(self):
+        sems = [picause.StructuralEquationDagModel(num_var=12, num_edges=20, seed=seed, beta=0.4)
+                for seed in range(5)]
+        residuals = picause.implied_residuals([sem.get_weight_matrix() for sem in sems])
+        for sem, row in zip(sems, residuals):
+            self.assertTrue(numpy.allclose(row, sem.make_residual_array()))
+
+    def test_build_bank(self):
+        configs = [(10, 15, 0.5), (8, 12, 0.3)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bank = graphbank.build_bank(tmpdir + '/bank.npz', configs, 20, seed=3,
+                                        batch_size=16)
+            parallel = graphbank.build_bank(tmpdir + '/parallel.npz', configs, 20, seed=3,
+                                            batch_size=16, workers=2)
+            self.assertTrue(all(numpy.array_equal(bank.arrays[k], parallel.arrays[k])
+                                for k in bank.arrays))
+        self.assertEqual(bank.configs(), {(8, 12, 0.3): 20, (10, 15, 0.5): 20})
+        self.assertNotIn((10, 15, 0.5, 21), bank)
+
+        graph, seed = bank.get(10, 15, 0.5, 7)
+        sem = picause.StructuralEquationDagModel(E=graph, seed=seed, beta=0.5)
+        self.assertGreaterEqual(sem.make_residual_array().min(), 0.1)
+        sources, targets = graphbank.candidate_edges(10, 15, seed,
+                                                     graphbank.indegree_bound(0.5))
+        self.assertEqual(graph, picause.Graph(10, sources, targets))
+
+        row = bank.to_frame().iloc[0]
+        args = discover.graphrow2args(row)
+        self.assertEqual((args.nodes, args.r, args.graphnum), (8, 0.3, 1))
+        self.assertEqual(picause.Graph.from_adjacencystr(args.graph, 8), bank.get(8, 12, 0.3, 1)[0])
+
+
+class TestProcessSimdata(unittest.TestCase):
+    def results(self, n=600):
+        rng = numpy.random.default_rng(0)
+        df = pandas.DataFrame({'nodes': 10, 'edges': 10, 'r': 0.3,
+                               'samples': rng.choice([50, 100], n),
+                               'metaparameter': rng.choice([0.01, 2], n),
+                               'algorithm': rng.choice(['pc', 'fges'], n),
+                               'runtime': rng.random(n)})
+        for c in ['oriented_TP', 'oriented_FP', 'oriented_FN',
+                  'skeletal_TP', 'skeletal_FP', 'skeletal_FN', 'skeletal_TN']:
+            df[c] = rng.integers(0, 10, n)
+        df.loc[::7, 'oriented_TP'] = numpy.nan
+        return df
+
+    def test_summarize(self):
+        n = 600
+        df = self.results(n)
+        summary = process_simdata.summarize(df, bootstrap=200)
+        self.assertEqual(len(summary), 8)
+        self.assertEqual(summary.nruns.sum(), n)
+
+        metrics = process_simdata.add_metrics(df)
+        for _, row in summary.iterrows():
+            runs = metrics[(metrics.samples == row.samples)
+                           & (metrics.metaparameter == row.metaparameter)
+                           & (metrics.algorithm == row.algorithm)]
+            self.assertEqual(row.nruns, len(runs))
+            values = runs.oriented_precision.dropna().sort_values().to_numpy()
+            self.assertAlmostEqual(row.mean_oriented_precision, values.mean(), places=3)
+            self.assertEqual(row.low_oriented_precision,
+                             round(values[int(numpy.floor(0.025 * (len(values) - 1)))], 3))
+            self.assertLessEqual(row.mean_oriented_precision_ci_low, row.mean_oriented_precision)
+            self.assertGreaterEqual(row.mean_oriented_precision_ci_high,
+                                    row.mean_oriented_precision)
+
+    def test_streamed_summary(self):
+        df = self.results()
+        summary = process_simdata.summarize(df, bootstrap=0)
+        expected = summary.drop(columns=[c for c in summary if c.endswith('_ci_low')
+                                         or c.endswith('_ci_high')])
+
+        # partials of chunks that share every group, merged in any order
+        chunks = [df.iloc[0:250], df.iloc[250:251], df.iloc[251:600:2], df.iloc[252:600:2]]
+        partials = []
+        for chunk in chunks:
+            partial = process_simdata.PartialSummary()
+            partial.add(chunk)
+            partials.append(partial)
+        forward = process_simdata.PartialSummary()
+        for partial in partials:
+            forward.merge(partial)
+        pandas.testing.assert_frame_equal(forward.table(), expected, check_dtype=False)
+        backward = partials[3]
+        for partial in partials[2::-1]:
+            backward.merge(partial)
+        pandas.testing.assert_frame_equal(backward.table(), expected, check_dtype=False)
+
+        # streamed in chunks from store shards, in two processes, merged
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = resultstore.ResultsStore(tmpdir)
+            for job in range(3):
+                store.append(df.iloc[job::3], job_id=job)
+            partial = process_simdata.summarize_files(store.shards(), chunksize=70, workers=2)
+            streamed = partial.table()
+        pandas.testing.assert_frame_equal(streamed, expected, check_dtype=False)
+
+
+class TestPowerSearch(unittest.TestCase):
+    def test_power_search(self):
+        sensitivity = lambda n: 1 - numpy.exp(-n / 700)
+        result = powersearch.power_search(sensitivity, 0.8, tolerance=0.05)
+        needed = -700 * numpy.log(0.2)
+        self.assertTrue(result.lower < needed <= result.samples)
+        self.assertLessEqual(result.samples / result.lower, 1.05)
+        self.assertLess(len(result.evaluations), 12)
+        self.assertEqual(len({n for n, _ in result.evaluations}), len(result.evaluations))
+
+        self.assertEqual(powersearch.power_search(sensitivity, 0.01).samples, 50)
+        unreachable = powersearch.power_search(sensitivity, 1.5, max_samples=10000)
+        self.assertEqual((unreachable.samples, unreachable.lower), (None, 10000))
+
+    def test_replicate_evaluator(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bank = graphbank.build_bank(tmpdir + '/bank.npz', [(8, 10, 0.3)], 3, seed=1)
+            replicates = powersearch.bank_replicates(bank, 8, 10, 0.3, 3, backend='numpy')
+            evaluator = powersearch.ReplicateEvaluator(replicates, 'adjacency_sensitivity',
+                                                       dirname=tmpdir, max_samples=4000)
+            low, high = evaluator(50), evaluator(4000)
+            evaluator.close()
+        self.assertLess(low, high)
+        self.assertEqual([len(runs) for runs in evaluator.results], [3, 3])
+
+
+class TestResultsStore(unittest.TestCase):
+    def job_results(self, job):
+        return pandas.DataFrame({'nodes': [10, 10, 20], 'edges': [10, 10, 40],
+                                 'r': [0.1, 0.1, 0.3], 'samples': [50, 100, 50],
+                                 'skeletal_TP': [job, job + 1, job + 2]})
+
+    def test_append_read_compact(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = resultstore.ResultsStore(tmpdir)
+            for job in range(4):
+                store.append(self.job_results(job), job_id=job)
+            store.append(self.job_results(3), job_id=3)
+            expected = pandas.concat([self.job_results(job) for job in range(4)])
+            key = ['nodes', 'samples', 'skeletal_TP']
+
+            def check(table):
+                pandas.testing.assert_frame_equal(
+                    table.sort_values(key).reset_index(drop=True),
+                    expected.sort_values(key).reset_index(drop=True))
+
+            self.assertEqual(len(store.shards()), 8)
+            check(store.read())
+            self.assertEqual(len(store.read(nodes=20)), 4)
+            self.assertEqual(list(store.read(columns=['samples'], r=0.1).columns), ['samples'])
+
+            self.assertEqual(store.compact(), 6)
+            self.assertEqual(len(store.shards()), 2)
+            check(store.read())
+
+            # a compaction interrupted after writing its merged shard
+            store.append(self.job_results(4), job_id=4)
+            expected = pandas.concat([expected, self.job_results(4)])
+            dirname = store.partition_dir((20, 40, 0.3))
+            shards = sorted(os.listdir(dirname))
+            with open(dirname + '/compacted-0.csv.gz.sources', 'w') as f:
+                f.write("\n".join(shards))
+            store.read(nodes=20).to_csv(dirname + '/compacted-0.csv.gz', index=False,
+                                        compression='gzip')
+            check(store.read())
+            store.compact()
+            check(store.read())
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_claim_and_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jobs = pandas.DataFrame({'vars': [10] * 5, 'r': [0.1] * 5,
+                                     'graphnum': range(1, 6), 'graphstr': ['A,B;'] * 5,
+                                     'seed': ['977351692186939434046756'] * 5,
+                                     'Status': ['Completed', 'Unstarted', 'Pending',
+                                                'Unstarted', 'Unstarted']})
+            jobs.to_csv(tmpdir + '/jobstatus.csv.gz', index=False, compression='gzip')
+            with jobqueue.JobQueue(tmpdir + '/jobs.sqlite') as queue:
+                queue.import_csv(tmpdir + '/jobstatus.csv.gz')
+                self.assertEqual(queue.count(jobqueue.UNSTARTED), 3)
+
+                claimed = queue.claim(2)
+                self.assertEqual([job['id'] for job in claimed], [1, 3])
+                self.assertEqual(claimed[0]['seed'], '977351692186939434046756')
+                self.assertEqual(queue.count(jobqueue.PENDING), 3)
+                # a second runner cannot claim the same jobs
+                with jobqueue.JobQueue(tmpdir + '/jobs.sqlite') as other:
+                    self.assertEqual([job['id'] for job in other.claim(5)], [4])
+                self.assertEqual(queue.claim(5), [])
+
+                queue.set_status([1, 2], jobqueue.COMPLETED)
+                queue.release([3])
+                self.assertEqual(list(queue.to_frame().Status),
+                                 ['Completed', 'Completed', 'Completed', 'Unstarted', 'Pending'])
+
+    def test_stop_and_claim_by_replicate(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jobs = pandas.DataFrame({'vars': [10, 10, 20, 20], 'edges': [10, 10, 20, 20],
+                                     'r': 0.3, 'graphnum': [1, 2, 1, 2],
+                                     'graphstr': 'A,B;', 'seed': '1'})
+            with jobqueue.JobQueue(tmpdir + '/jobs.sqlite') as queue:
+                queue.import_frame(jobs)
+                self.assertEqual([job['id'] for job in queue.claim(2, by_replicate=True)],
+                                 [0, 2])
+                self.assertEqual(queue.stop(10, 10, 0.3), 1)
+                self.assertEqual(queue.count(jobqueue.STOPPED), 1)
+                self.assertEqual([job['id'] for job in queue.claim(5)], [3])
+
+                # status files whose edges are blank for some jobs
+                queue.import_frame(jobs.assign(edges=[10, numpy.nan, 20, 20]))
+                self.assertEqual([job['edges'] for job in queue.claim(2)], [10, None])
+
+
+class TestSequential(unittest.TestCase):
+    def test_sequential_stopping(self):
+        rng = numpy.random.default_rng(0)
+        frames = []
+        # two configurations, one of them far noisier than the other
+        for nodes, spread in [(10, 1), (20, 50)]:
+            n = 60
+            tp = rng.integers(40, 40 + spread, n)
+            frames.append(pandas.DataFrame({
+                'nodes': nodes, 'edges': nodes, 'r': 0.3, 'samples': 100,
+                'metaparameter': 0.01, 'algorithm': 'pc', 'oriented_TP': tp,
+                'oriented_FP': rng.integers(0, 2, n), 'oriented_FN': 100 - tp,
+                'skeletal_TP': tp, 'skeletal_FP': 0, 'skeletal_FN': 100 - tp,
+                'skeletal_TN': 0}))
+        results = pandas.concat(frames, ignore_index=True)
+        rule = sequential.StoppingRule(width=0.05, min_replicates=20)
+        self.assertEqual(rule.settled(results), [(10, 10, 0.3)])
+        self.assertEqual(rule.settled(results.iloc[::4]), [])
+        self.assertEqual(rule.settled(pandas.DataFrame(columns=sequential.COLUMNS)), [])
+
+        # runs that failed count for nothing, however many there are
+        failing = frames[0].copy()
+        failing['outcome'] = ['ok'] + ['failed'] * (len(failing) - 1)
+        failing.loc[1:, ['oriented_TP', 'oriented_FP', 'oriented_FN']] = numpy.nan
+        self.assertEqual(rule.settled(failing), [])
+        # a precision undefined in every successful run holds nothing back
+        nothing_found = frames[0].assign(outcome='ok', oriented_TP=0, oriented_FP=0)
+        self.assertEqual(rule.settled(nothing_found), [(10, 10, 0.3)])
+
+
+class TestResourceModel(unittest.TestCase):
+    def test_fit_and_pack(self):
+        rng = numpy.random.default_rng(0)
+        nodes = rng.choice([10, 20, 40, 100], 400)
+        samples = rng.choice([50, 400, 3200, 25600], 400)
+        results = pandas.DataFrame({'nodes': nodes, 'edges': 2 * nodes, 'samples': samples,
+                                    'algorithm': 'pc', 'outcome': 'ok',
+                                    'runtime': 0.01 * nodes * numpy.sqrt(samples)
+                                    * rng.lognormal(0, 0.2, 400),
+                                    'maxrss_mb': 200 + nodes})
+        model = resourcemodel.ResourceModel(quantile=0.95, safety=1.0).fit(results)
+        predicted = model.predict_runtime(nodes, 2 * nodes, samples, 'pc')
+        self.assertAlmostEqual(numpy.mean(results.runtime <= predicted), 0.95, delta=0.03)
+        self.assertTrue((model.predict_memory(nodes, 2 * nodes) >= 200 + nodes - 1e-6).all())
+        # algorithms without results get the defaults
+        self.assertEqual(model.predict_runtime(10, 20, 50, 'fges')[0], 1200)
+
+        seconds = rng.uniform(0, 1000, 200).tolist() + [5000]
+        bins = resourcemodel.pack(seconds, capacity=3600)
+        self.assertEqual(sorted(i for b in bins for i in b), list(range(201)))
+        loads = sorted(sum(seconds[i] for i in b) for b in bins)
+        self.assertEqual(loads[-1], 5000)
+        self.assertTrue(all(load <= 3600 for load in loads[:-1]))
+        self.assertLess(len(bins), (sum(seconds) - 5000) / 3600 + 3)
+        self.assertEqual(resourcemodel.slurm_time(3601), '1:01:00')
+        self.assertEqual(resourcemodel.slurm_mem(1000), '1024m')
+
+
+class TestSlurmArray(unittest.TestCase):
+    def test_submit_array(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sbatch = slurmarray.install_fake(tmpdir + '/bin')
+            out = tmpdir + '/out.txt'
+            commands = ['echo {} >> {}'.format(i, out) for i in range(5)]
+            submitted = slurmarray.submit_array(tmpdir + '/manifest.jsonl', commands,
+                                                per_task=2, job_name='test', time=10,
+                                                mem='1g', max_array_size=2, sbatch=sbatch,
+                                                output_dir=tmpdir)
+            self.assertEqual([(n, job_id) for _, n, job_id in submitted], [(2, 1), (1, 2)])
+            self.assertEqual(slurmarray.read_task(submitted[0][0], 1), commands[2:4])
+            scripts = [s['script'] for s in slurmarray.read_submissions(tmpdir + '/bin')]
+            self.assertIn('#SBATCH --array=0-1\n', scripts[0])
+            self.assertIn('#SBATCH --array=0-0\n', scripts[1])
+            self.assertFalse(os.path.exists(out))
+
+            # the fake sbatch can also run the array tasks
+            with unittest.mock.patch.dict(os.environ, {'FAKE_SBATCH_RUN': '1'}):
+                slurmarray.submit_array(tmpdir + '/manifest.jsonl', commands, per_task=2,
+                                        job_name='test', time=10, mem='1g', sbatch=sbatch,
+                                        output_dir=tmpdir)
+            with open(out) as f:
+                self.assertEqual(f.read().split(), ['0', '1', '2', '3', '4'])
+
 
 class TestDiscover(unittest.TestCase):
     def setUp(self):
@@ -99,6 +733,184 @@ class TestDiscover(unittest.TestCase):
         results = discover.discover(self.args1)
         self.assertEqual(len(results), 4)
 
+    def test_parallel_sweep(self):
+        args = self.args1
+        args.backend, args.algorithm = 'numpy', 'pc'
+        sem = picause.StructuralEquationDagModel(num_var=args.nodes,
+                                                 E=picause.adjacencystr2pairlist(args.graph),
+                                                 beta=0.3, seed=args.seed)
+        runs = []
+        for workers, executor in [(1, 'thread'), (3, 'thread'), (2, 'process')]:
+            args.workers, args.executor = workers, executor
+            with tempfile.TemporaryDirectory() as tmpdir:
+                runs.append(discover.run_sweep(args, sem, [50, 200, 1000], 1000, tmpdir)
+                            .drop(columns='runtime'))
+                self.assertFalse(any(f.startswith('data_') for f in os.listdir(tmpdir)))
+        self.assertEqual(len(runs[0]), 12)
+        self.assertEqual(list(runs[0].samples), [50] * 4 + [200] * 4 + [1000] * 4)
+        pandas.testing.assert_frame_equal(runs[0], runs[1])
+        pandas.testing.assert_frame_equal(runs[0], runs[2])
+
+    def test_resume_sweep(self):
+        args = self.args1
+        args.backend, args.algorithm, args.workers = 'numpy', 'pc', 1
+        sem = picause.StructuralEquationDagModel(num_var=args.nodes,
+                                                 E=picause.adjacencystr2pairlist(args.graph),
+                                                 beta=0.3, seed=args.seed)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            full = discover.run_sweep(args, sem, [50, 200, 1000], 1000, tmpdir)
+            checkpoint = tmpdir + '/checkpoint.jsonl'
+            with open(checkpoint) as f:
+                lines = f.readlines()
+            self.assertEqual(len(lines), 12)
+            # killed during the sixth run's write
+            with open(checkpoint, 'w') as f:
+                f.writelines(lines[:5] + [lines[5][:20]])
+            with unittest.mock.patch.object(discover, 'discovery_task',
+                                            wraps=discover.discovery_task) as task:
+                resumed = discover.run_sweep(args, sem, [50, 200, 1000], 1000, tmpdir)
+                self.assertEqual(task.call_count, 7)
+            pandas.testing.assert_frame_equal(full.drop(columns='runtime'),
+                                              resumed.drop(columns='runtime'))
+            self.assertEqual(len(discover.read_checkpoint(checkpoint)), 12)
+
+    def test_requeue_resumes(self):
+        args = self.args1
+        args.backend, args.algorithm, args.workers = 'numpy', 'pc', 1
+        sem = picause.StructuralEquationDagModel(num_var=args.nodes,
+                                                 E=picause.adjacencystr2pairlist(args.graph),
+                                                 beta=0.3, seed=args.seed)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            javatopdir = tmpdir + '/JavaDirs/'
+            localdir = javatopdir + 'dir7/'
+            os.makedirs(localdir)
+            with jobqueue.JobQueue(tmpdir + '/jobs.sqlite') as queue:
+                queue.import_frame(pandas.DataFrame(
+                    {'vars': 10, 'edges': 6, 'r': 0.1, 'graphnum': 1,
+                     'graphstr': args.graph, 'seed': str(args.seed)}, index=[7]))
+                self.assertEqual([job['id'] for job in queue.claim(1)], [7])
+                old = time.time() - 7200
+                queue.connection.execute("UPDATE jobs SET updated = ?", (old,))
+                os.utime(localdir, (old, old))
+                # a job whose array task is still waiting in the SLURM queue is left alone
+                self.assertEqual(jobrunner.requeue_stale(queue, javatopdir, 3600), [])
+                # the array task starts, as discover.discover() does, and is
+                # killed during the job's sixth run
+                with open(localdir + 'STARTED', 'w') as f:
+                    f.write("")
+                full = discover.run_sweep(args, sem, [50, 200], 200, localdir)
+                with open(localdir + 'checkpoint.jsonl') as f:
+                    lines = f.readlines()
+                with open(localdir + 'checkpoint.jsonl', 'w') as f:
+                    f.writelines(lines[:5])
+                # a job still writing to its directory is left alone
+                self.assertEqual(jobrunner.requeue_stale(queue, javatopdir, 3600), [])
+                for name in os.listdir(localdir) + ['']:
+                    os.utime(localdir + name, (old, old))
+                self.assertEqual(jobrunner.requeue_stale(queue, javatopdir, 3600), [7])
+                self.assertFalse(os.path.exists(localdir + 'STARTED'))
+                self.assertEqual([job['id'] for job in queue.claim(1)], [7])
+                # nor is its next task, while it waits to start
+                queue.connection.execute("UPDATE jobs SET updated = ?", (old,))
+                os.utime(localdir, (old, old))
+                self.assertEqual(jobrunner.requeue_stale(queue, javatopdir, 3600), [])
+            with unittest.mock.patch.object(discover, 'discovery_task',
+                                            wraps=discover.discovery_task) as task:
+                resumed = discover.run_sweep(args, sem, [50, 200], 200, localdir)
+                self.assertEqual(task.call_count, 3)
+            pandas.testing.assert_frame_equal(full.drop(columns='runtime'),
+                                              resumed.drop(columns='runtime'))
+
+    def test_cached_sweep(self):
+        args = self.args1
+        args.backend, args.algorithm, args.workers = 'numpy', 'pc', 1
+        sem = picause.StructuralEquationDagModel(num_var=args.nodes,
+                                                 E=picause.adjacencystr2pairlist(args.graph),
+                                                 beta=0.3, seed=args.seed)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            args.cache = tmpdir + '/cache'
+            os.makedirs(tmpdir + '/job1')
+            first = discover.run_sweep(args, sem, [50, 200], 200, tmpdir + '/job1')
+            # a rerun in a new directory, and under the async executor, finds
+            # every search in the cache and runs none
+            for job, executor in [('job2', 'thread'), ('job3', 'async')]:
+                args.executor = executor
+                os.makedirs(tmpdir + '/' + job)
+                with unittest.mock.patch.object(pcalg.NumpyPCBackend, 'run') as run:
+                    again = discover.run_sweep(args, sem, [50, 200], 200, tmpdir + '/' + job)
+                    self.assertEqual(run.call_count, 0)
+                pandas.testing.assert_frame_equal(first, again)
+            with discoverycache.DiscoveryCache(args.cache) as cache:
+                self.assertEqual(cache.stats()['hits'], 16)
+                self.assertEqual(cache.stats()['misses'], 8)
+                self.assertEqual(len(cache), 8)
+                # the least recently used entries go first
+                keys = [k for k, in cache.connection.execute(
+                    "SELECT key FROM entries ORDER BY used")]
+                cache.get(keys[0])
+                cache.evict(cache.size() - 1)
+                self.assertIsNotNone(cache.get(keys[0]))
+                self.assertIsNone(cache.get(keys[1]))
+                self.assertFalse(os.path.exists(cache.path(keys[1])))
+
+            # a search that died after writing its header is recorded as
+            # failed and not cached, so every rerun searches again
+            def truncated(datafile, output_directory, output_prefix, **kwargs):
+                outfile = "{}/{}.txt".format(output_directory, output_prefix)
+                with open(outfile, 'w') as f:
+                    f.write("PC\n\nGraph Nodes:\nx_1;x_2\n")
+                return picause.read_causal_output(outfile)
+            args.executor = 'thread'
+            with discoverycache.DiscoveryCache(args.cache) as cache:
+                entries = len(cache)
+            for job in ['job4', 'job5']:
+                os.makedirs(tmpdir + '/' + job)
+                with unittest.mock.patch.object(pcalg.NumpyPCBackend, 'run',
+                                                side_effect=truncated) as run:
+                    failed = discover.run_sweep(args, sem, [100], 100, tmpdir + '/' + job)
+                    self.assertEqual(run.call_count, 4)
+                self.assertEqual(list(failed.outcome), ['failed'] * 4)
+                self.assertTrue(failed.oriented_TP.isna().all())
+            with discoverycache.DiscoveryCache(args.cache) as cache:
+                self.assertEqual(len(cache), entries)
+
+    def test_async_sweep(self):
+        args = self.args1
+        args.backend, args.algorithm, args.meta = 'numpy', 'pc', 0.01
+        sem = picause.StructuralEquationDagModel(num_var=args.nodes,
+                                                 E=picause.adjacencystr2pairlist(args.graph),
+                                                 beta=0.3, seed=args.seed)
+        runs = []
+        for executor, timeout in [('thread', None), ('async', None), ('async', 0.01)]:
+            args.workers, args.executor, args.timeout = 2, executor, timeout
+            with tempfile.TemporaryDirectory() as tmpdir:
+                runs.append(discover.run_sweep(args, sem, [100, 1000], 1000, tmpdir)
+                            .drop(columns='runtime'))
+        pandas.testing.assert_frame_equal(runs[0], runs[1])
+        self.assertEqual(list(runs[2].outcome), ['timeout', 'timeout'])
+        self.assertTrue(runs[2].skeletal_TP.isna().all())
+        # only the async executor can kill a run
+        args.executor = 'thread'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(ValueError):
+                discover.run_sweep(args, sem, [100, 1000], 1000, tmpdir)
+
+        # a search that exits cleanly with only a header is recorded as
+        # failed and not cached, without stopping the sweep
+        def header_only(datafile, output_directory, output_prefix, **kwargs):
+            outfile = "{}/{}.txt".format(output_directory, output_prefix)
+            return "printf 'PC\\n\\nGraph Nodes:\\nx_1;x_2\\n' > {}".format(shlex.quote(outfile))
+        args.executor, args.timeout = 'async', None
+        with tempfile.TemporaryDirectory() as tmpdir:
+            args.cache = tmpdir + '/cache'
+            with unittest.mock.patch.object(pcalg.NumpyPCBackend, 'command',
+                                            side_effect=header_only):
+                failed = discover.run_sweep(args, sem, [100, 1000], 1000, tmpdir)
+            self.assertEqual(list(failed.outcome), ['failed', 'failed'])
+            self.assertTrue(failed.skeletal_TP.isna().all())
+            with discoverycache.DiscoveryCache(args.cache) as cache:
+                self.assertEqual(len(cache), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,106 @@
+"""
+asyncrunner:
+runs many discovery commands at once with asyncio, each under a time
+limit.
+
+Unlike os.popen, every run's exit status, stdout and stderr are kept,
+and a run that outlives its timeout is killed, together with any
+processes it started (such as the JVM under a shell), and reported as
+a 'timeout' rather than holding up the rest of the job.
+"""
+
+import asyncio
+import contextlib
+import os
+import signal
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class CommandResult:
+    """ The outcome of one command: 'ok', 'failed' (a nonzero exit
+    status) or 'timeout' (killed after the time limit) """
+    command: str
+    outcome: str
+    returncode: int
+    stdout: str
+    stderr: str
+    runtime: float
+
+
+def _kill(process):
+    """ kills process and the rest of its process group """
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def run_command(command, timeout=None, limit=None):
+    """
+    runs the shell command, killing it after timeout seconds.
+
+    parameters:
+    ----------
+        command: the shell command
+        timeout: seconds the command may run for; None for no limit
+        limit: an optional asyncio.Semaphore to hold while it runs
+
+    returns:
+    -------
+        a CommandResult
+    """
+    async with limit if limit is not None else contextlib.nullcontext():
+        begin_time = time.monotonic()
+        process = await asyncio.create_subprocess_shell(
+            command, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        # read the pipes alongside, so that output written before a
+        # timeout is kept
+        stdout = asyncio.ensure_future(process.stdout.read())
+        stderr = asyncio.ensure_future(process.stderr.read())
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+            outcome = 'ok' if process.returncode == 0 else 'failed'
+        except asyncio.TimeoutError:
+            _kill(process)
+            await process.wait()
+            outcome = 'timeout'
+        return CommandResult(command, outcome, process.returncode,
+                             (await stdout).decode(errors='replace'),
+                             (await stderr).decode(errors='replace'),
+                             time.monotonic() - begin_time)
+
+
+async def _run_commands(commands, max_concurrent, timeout, callback):
+    limit = asyncio.Semaphore(max_concurrent)
+
+    async def run(i, command):
+        result = await run_command(command, timeout, limit)
+        if callback is not None:
+            callback(i, result)
+        return result
+
+    return await asyncio.gather(*(run(i, c) for i, c in enumerate(commands)))
+
+
+def run_commands(commands, max_concurrent=4, timeout=None, callback=None):
+    """
+    runs the shell commands, at most max_concurrent at a time, each
+    killed if it runs longer than timeout seconds.
+
+    parameters:
+    ----------
+        callback: an optional function called as callback(i, result) as
+            soon as command i finishes, e.g. to save its result
+
+    returns:
+    -------
+        a list of CommandResults, in the order of commands
+    """
+    return asyncio.run(_run_commands(list(commands), max(1, max_concurrent), timeout,
+                                     callback))
@@ -0,0 +1,213 @@
+"""
+benchmarks:
+timings for the performance-sensitive parts of the pipeline.
+Run as a script, e.g.
+
+    python benchmarks.py parser --edges 1000
+    python benchmarks.py pool --calls 20 --engine numpy
+    python benchmarks.py store --jobs 2000
+    python benchmarks.py queue --jobs 20000 --calls 1000
+    python benchmarks.py data --nodes 100 --edges 100 --workers 4
+"""
+
+import argparse
+import jobqueue
+import numpy
+import os
+import pandas
+import picause
+import resultstore
+import tempfile
+import timeit
+import workerpool
+
+
+def random_causal_output(fname, num_nodes, num_edges, seed=0):
+    """ writes a causal-cmd style output file holding a random graph of
+    num_edges edges, a tenth of them undirected """
+    rng = numpy.random.default_rng(seed)
+    pairs = numpy.array([(u, v) for u in range(num_nodes)
+                         for v in range(u + 1, num_nodes)])
+    pairs = pairs[rng.choice(len(pairs), num_edges, replace=False)]
+    graph = picause.Graph(num_nodes, pairs[:, 0], pairs[:, 1])
+    graph.kinds[::10] = picause.UNDIRECTED
+    picause.write_causal_output(fname, graph)
+    return graph
+
+
+def readlines_parser(fname):
+    """ the readlines parser formerly used by picause.discovery_results """
+    with open(fname, 'r') as f:
+        results = f.readlines()
+    results_s = ""
+    for r in results[results.index('Graph Edges:\n') + 1:]:
+        if '-->' not in r:
+            continue
+        results_s += r.split(". ")[1][:-1] + ', '
+    return picause.arrowstr2pairlist(results_s[:-2])
+
+
+def read_split_parser(fname):
+    """ the whole-file parser formerly used by discover.causal_output_to_arrowstr """
+    with open(fname) as f:
+        dgf = f.read()
+    dg_edge_index = dgf.split('\n').index('Graph Edges:')
+    dg_raw = dgf.split('\n')[dg_edge_index + 1:]
+    dg_less_raw = [x.split('.')[1].strip() for x in dg_raw if ' --' in x]
+    return picause.arrowstr2pairlist(', '.join(dg_less_raw))
+
+
+def bench_parser(num_nodes=100, num_edges=1000, number=200):
+    """ times the causal-cmd output parsers on a num_edges edge file """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'results.txt')
+        random_causal_output(fname, num_nodes, num_edges)
+        parsers = {'readlines + split (old discovery_results)': readlines_parser,
+                   'read + split (old causal_output_to_arrowstr)': read_split_parser,
+                   'read + split, then Graph.from_pairlist':
+                       lambda f: picause.Graph.from_pairlist(read_split_parser(f)),
+                   'iter_causal_output': lambda f: list(picause.iter_causal_output(f)),
+                   'read_causal_output': picause.read_causal_output}
+        print("{} edges, {} nodes, best of 5 x {} calls".format(num_edges, num_nodes, number))
+        for name, parser in parsers.items():
+            t = min(timeit.repeat(lambda: parser(fname), number=number, repeat=5))
+            print("\t{:<50}{:8.3f} ms/call".format(name, 1000 * t / number))
+
+
+def bench_pool(calls=20, num_workers=2, engine='fake'):
+    """ times discovery calls on a fresh stand-in worker per call against
+    a pool of warm workers; this measures the worker's own (Python)
+    start, not a JVM's, which the stand-in causal-cmd engine still pays
+    on every call """
+    sem = picause.StructuralEquationDagModel(num_var=20, num_edges=20, seed=0)
+    command = workerpool.worker_command(engine)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        datafile = os.path.join(tmpdir, 'data.csv')
+        sem.write_data(datafile, 1000)
+        begin = timeit.default_timer()
+        for _ in range(calls):
+            with workerpool.WorkerPoolBackend(command, 1, prefs_root=tmpdir) as pool:
+                pool.run(datafile, output_directory=tmpdir)
+        cold = timeit.default_timer() - begin
+        with workerpool.WorkerPoolBackend(command, num_workers, prefs_root=tmpdir) as pool:
+            pool.check_health()
+            begin = timeit.default_timer()
+            for _ in range(calls):
+                pool.run(datafile, output_directory=tmpdir)
+            warm = timeit.default_timer() - begin
+    print("{} calls, {} engine".format(calls, engine))
+    print("\t{:<50}{:8.1f} ms/call".format('new worker per call', 1000 * cold / calls))
+    print("\t{:<50}{:8.1f} ms/call".format('warm pool', 1000 * warm / calls))
+
+
+def bench_store(jobs=2000, rows=48):
+    """ times collating jobs into a results store, against rewriting one
+    growing results file, as jobrunner.py used to """
+    results = pandas.DataFrame({'nodes': 20, 'edges': 40, 'r': 0.3,
+                                'samples': numpy.arange(rows),
+                                'skeletal_TP': numpy.arange(rows)})
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = resultstore.ResultsStore(os.path.join(tmpdir, 'store'))
+        times = []
+        for job in range(jobs):
+            begin = timeit.default_timer()
+            store.append(results, job_id=job)
+            times.append(timeit.default_timer() - begin)
+        fname = os.path.join(tmpdir, 'results.csv.gz')
+        rewrite = []
+        for job in range(jobs):
+            begin = timeit.default_timer()
+            if job == 0:
+                combined = results
+            else:
+                combined = pandas.concat([pandas.read_csv(fname, compression='gzip'), results])
+            combined.to_csv(fname, index=False, compression='gzip')
+            rewrite.append(timeit.default_timer() - begin)
+    print("{} jobs of {} rows, ms per job".format(jobs, rows))
+    for name, t in [('results store', times), ('whole-file rewrite', rewrite)]:
+        print("\t{:<30}first 100: {:8.2f}   last 100: {:8.2f}".format(
+            name, 1000 * numpy.mean(t[:100]), 1000 * numpy.mean(t[-100:])))
+
+
+def bench_queue(jobs=20000, claims=1000, csv_claims=20):
+    """ times starting and completing claims jobs out of a table of jobs
+    with the job queue, against the status csv jobrunner.py used to
+    rewrite on every change (timed over csv_claims jobs only) """
+    table = pandas.DataFrame({'vars': 20, 'edges': 40, 'r': 0.3,
+                              'graphnum': numpy.arange(jobs),
+                              'graphstr': 'X1,X2;X2,X3;', 'seed': numpy.arange(jobs),
+                              'Status': 'Unstarted'})
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'jobstatus.csv.gz')
+        table.to_csv(fname, index=False, compression='gzip')
+        with jobqueue.JobQueue(os.path.join(tmpdir, 'jobs.sqlite')) as queue:
+            begin = timeit.default_timer()
+            queue.import_csv(fname)
+            imported = timeit.default_timer() - begin
+            begin = timeit.default_timer()
+            claimed = queue.claim(claims)
+            claim = timeit.default_timer() - begin
+            begin = timeit.default_timer()
+            for job in claimed:
+                queue.set_status([job['id']], jobqueue.COMPLETED)
+            complete = timeit.default_timer() - begin
+
+        begin = timeit.default_timer()
+        df = pandas.read_csv(fname)
+        for _ in range(csv_claims):
+            jobidx = df[df.Status == "Unstarted"].index.min()
+            df.at[jobidx, 'Status'] = 'Pending'
+            df.to_csv(fname, index=False, compression='gzip')
+        csv_claim = (timeit.default_timer() - begin) / csv_claims
+    print("{} jobs: import {:.1f} ms".format(jobs, 1000 * imported))
+    print("\tjob queue: claim {} at once {:.1f} ms, complete one at a time {:.3f} ms each".format(
+        claims, 1000 * claim, 1000 * complete / claims))
+    print("\tstatus csv: {:.1f} ms per job claimed, {:.1f} s for {}".format(
+        1000 * csv_claim, csv_claim * claims, claims))
+
+
+def bench_data(num_nodes=100, num_edges=100, rows=102400, workers=4, seed=0):
+    """ times generating rows of data from one sequential stream, against
+    Philox substreams on 1 and on workers threads, and regenerating only
+    the last half of them, which the sequential stream cannot do """
+    E = picause.StructuralEquationDagModel(num_var=num_nodes, num_edges=num_edges,
+                                           seed=seed).E
+    timings = []
+    for data_rng, threads in [('sequential', 1), ('philox', 1), ('philox', workers)]:
+        sem = picause.StructuralEquationDagModel(num_var=num_nodes, E=E, seed=seed,
+                                                 beta=0.1, data_rng=data_rng)
+        begin = timeit.default_timer()
+        for _ in sem.iter_data(rows, chunk_size=16384, output='array', workers=threads):
+            pass
+        timings.append((data_rng, threads, timeit.default_timer() - begin))
+    begin = timeit.default_timer()
+    sem.generate_rows(rows // 2, rows, workers=workers)
+    half = timeit.default_timer() - begin
+    print("{} rows of {} variables:".format(rows, num_nodes))
+    for data_rng, threads, seconds in timings:
+        print("\t{} on {} thread(s): {:.3f} s".format(data_rng, threads, seconds))
+    print("\tphilox, last {} rows only, on {} thread(s): {:.3f} s".format(
+        rows - rows // 2, workers, half))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=['parser', 'pool', 'store', 'queue',
+                                              'data'])
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--edges", type=int, default=1000)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--engine", choices=['fake', 'numpy'], default='fake')
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    if args.benchmark == 'parser':
+        bench_parser(args.nodes, args.edges)
+    elif args.benchmark == 'pool':
+        bench_pool(args.calls, engine=args.engine)
+    elif args.benchmark == 'store':
+        bench_store(args.jobs)
+    elif args.benchmark == 'queue':
+        bench_queue(args.jobs, args.calls)
+    elif args.benchmark == 'data':
+        bench_data(args.nodes, args.edges, workers=args.workers)
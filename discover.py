@@ -1,8 +1,15 @@
 import argparse
+import asyncrunner
+import concurrent.futures
+import discoverycache
+import graphbank
+import json
 import os
 import pandas
+import pcalg
 import platform
 import picause
+import resource
 import time
 from dataclasses import dataclass
 
@@ -21,14 +28,30 @@ class argsClass:
     samples: int = 0
     meta: float = -1.0
     algorithm: str = ''
+    backend: str = 'causal-cmd'
+    data_type: str = 'covariance'
+    workers: int = 1
+    executor: str = 'thread'
+    timeout: float = None
+    cache: str = None
+    cache_mb: int = 1024
+    data_rng: str = 'sequential'
 
 
 def args2argsClass(args=None):
     if args is None:
         args = process_args()
 
+    if args.bank is not None:
+        graph, args.seed = graphbank.GraphBank(args.bank).get(
+            args.nodes, args.edges, args.r, args.graphnum)
+        args.graphstr = graph.to_adjacencystr()
     return argsClass(args.nodes, args.r, args.graphnum, args.graphstr,
-                     args.seed, args.index, args.verbose)
+                     args.seed, args.index, args.verbose,
+                     backend=args.backend, data_type=args.data_type,
+                     workers=args.workers, executor=args.executor,
+                     timeout=args.timeout, cache=args.cache, cache_mb=args.cache_mb,
+                     data_rng=args.data_rng)
 
 
 def process_args():
@@ -38,11 +61,45 @@ def process_args():
     parser.add_argument("nodes", help="Number of Nodes", type=int)
     parser.add_argument("r", help="Independent Error", type=float)
     parser.add_argument("graphnum", help="ID number of graph", type=int)
-    parser.add_argument("graphstr", help="Graph String", type=str)
-    parser.add_argument("seed", help="Random Seed", type=int)
+    parser.add_argument("graphstr", help="Graph String ('-' with --bank)", type=str)
+    parser.add_argument("seed", help="Random Seed (ignored with --bank)", type=int)
     parser.add_argument("index", help='Index of Graph', type=int)
     parser.add_argument("-v", '--verbose', action="store_true")
+    parser.add_argument("--backend", help="Discovery backend for pc",
+                        choices=['causal-cmd', 'numpy'],
+                        default='causal-cmd')
+    parser.add_argument("--data-type", help="Pass discovery the data itself "
+                        "or only its covariance matrix",
+                        choices=['covariance', 'continuous'],
+                        default='covariance')
+    parser.add_argument("--workers", help="Number of discovery runs at once; "
+                        "defaults to SLURM_CPUS_PER_TASK, or else 1", type=int,
+                        default=int(os.environ.get('SLURM_CPUS_PER_TASK', 1)))
+    parser.add_argument("--executor", help="Run parallel discoveries in "
+                        "threads, in processes, or as subprocesses under asyncio",
+                        choices=['thread', 'process', 'async'], default='thread')
+    parser.add_argument("--timeout", help="Seconds before a discovery run is "
+                        "killed and recorded as a timeout; needs --executor "
+                        "async", type=float,
+                        default=None)
+    parser.add_argument("--data-rng", help="Draw the data from one sequential "
+                        "stream, or from counter-based Philox substreams that are "
+                        "generated a block at a time on --workers threads",
+                        choices=['sequential', 'philox'], default='sequential')
+    parser.add_argument("--cache", help="Reuse the results of searches already "
+                        "run on the same data from this cache directory "
+                        "(see discoverycache.py)", default=None)
+    parser.add_argument("--cache-mb", help="Size the cache is kept under, in MB",
+                        type=int, default=1024)
+    parser.add_argument("--bank", help="Take the graph and seed from this "
+                        "graph bank (see graphbank.py)", default=None)
+    parser.add_argument("--edges", help="Number of edges, to find the graph "
+                        "in the bank", type=int, default=None)
     args = parser.parse_args()
+    if args.bank is not None and args.edges is None:
+        parser.error("--bank needs --edges")
+    if args.timeout is not None and args.executor != 'async':
+        parser.error("--timeout needs --executor async")
     if args.verbose:
         print(args)
     return args
@@ -55,55 +112,76 @@ def row2args(row):
                      samples=row.samples, algorithm=row.algorithm)
 
 
-def graphrow2args(row):
-    """ Creates an argsClass for a row in a truegraph dataframe.
+def graphrow2args(row, index=0):
+    """ Creates an argsClass for a row in a truegraph dataframe,
+    such as GraphBank.to_frame() returns, to run in directory dir<index>.
     Used mostly for unit testing """
-    return argsClass(nodes=row.vars, r=row.r, graphnum=row.graphnum,
-                     graph=row.graphstr, seed=int(row.seed))
+    return argsClass(nodes=int(row.vars), r=float(row.r), graphnum=int(row.graphnum),
+                     graph=row.graphstr, seed=int(row.seed), index=index)
+
+
+def make_backend(name):
+    """ returns the discovery backend called name:
+    'causal-cmd' runs every algorithm through the causal-cmd jar,
+    'numpy' runs pc in-process (see pcalg) and the others through causal-cmd.
+    workerpool.WorkerPoolBackend is not offered, as its only worker
+    starts a JVM per search just as causal-cmd does
+    """
+    if name == 'causal-cmd':
+        return picause.CausalCmdBackend()
+    if name == 'numpy':
+        return pcalg.NumpyPCBackend()
+    raise ValueError("unknown discovery backend: {}".format(name))
 
 
 def causal_output_to_arrowstr(fname):
     """ reads output from causal-cmd,
     extracts the discovered graph info, and returns it as an arrow string"""
-    with open(fname) as f:
-        dgf = f.read()
-    dg_edge_index = dgf.split('\n').index('Graph Edges:')
-    dg_raw = dgf.split('\n')[dg_edge_index + 1:]
-    dg_less_raw = [x.split('.')[1].strip() for x in dg_raw if ' --' in x]
-    discovered_graph = ', '.join(dg_less_raw)
+    return read_discovered_graph(fname).to_arrowstr()
+
+
+def read_discovered_graph(fname, num_nodes=None):
+    """ reads output from causal-cmd and returns the directed and undirected
+    edges of the discovered graph as a picause.Graph """
+    return picause.read_causal_output(fname, num_nodes).select(
+        picause.DIRECTED, picause.UNDIRECTED)
 
-    return discovered_graph
+
+# the sample sizes every generated graph is run at, smallest first
+SAMPLE_SIZES = [50, 100, 200, 400, 800, 1600, 3200, 6400,
+                12800, 25600, 51200, 102400]
+
+# the columns evaluate_discovery() adds to a results row from the
+# discovered graph
+SCORE_COLUMNS = ['oriented_TP', 'oriented_FP', 'oriented_FN',
+                 'skeletal_TP', 'skeletal_FP', 'skeletal_FN', 'skeletal_TN',
+                 'discovered_directed_edges', 'discovered_undirected_edges']
 
 
 def evaluate_discovery(discovery_file, args):
 
-    truegraph_pl = picause.adjacencystr2pairlist(args.graph)
-    truegraph_as = picause.adjacencystr2arrowstr(args.graph)
+    truegraph = picause.Graph.from_adjacencystr(args.graph, args.nodes)
 
-    discovered_graph = causal_output_to_arrowstr(discovery_file)
+    dg = read_discovered_graph(discovery_file, args.nodes)
     if args.verbose:
-        print('discovered graph:\n', discovered_graph)
-    dg_pl = picause.arrowstr2pairlist(discovered_graph)
+        print('discovered graph:\n', dg.to_arrowstr())
 
     #   create the results directory
     results = dict()
     results['truegraphid'] = [args.graphnum]
     results['nodes'] = [args.nodes]
-    results['edges'] = [len(truegraph_pl)]
+    results['edges'] = [len(truegraph)]
     results['r'] = [args.r]
 
     # +-----------------------------------------------+
     # |assess the discovered graph and save results |
     # +-----------------------------------------------+
 
-    skeletal_matrix = picause.confusion_matrix(args.nodes,
-                                               truegraph_pl,
-                                               dg_pl)
+    skeletal_matrix = picause.confusion_matrix(args.nodes, truegraph, dg)
     if args.verbose:
         print('skeletal matrix:\n', skeletal_matrix)
 
-    oriented_matrix = picause.oriented_confusion_matrix(truegraph_as,
-                                                        discovered_graph,
+    oriented_matrix = picause.oriented_confusion_matrix(truegraph, dg,
                                                         verbose=args.verbose)
     for k, v in oriented_matrix.items():
         results[k] = v
@@ -113,19 +191,417 @@ def evaluate_discovery(discovery_file, args):
     results['skeletal_FN'] = [skeletal_matrix[2]]
     results['skeletal_TN'] = [skeletal_matrix[3]]
 
-    results['discovered_directed_edges'] = \
-        picause.arrowstr2adjacencystr(discovered_graph, directed=True)
+    results['discovered_directed_edges'] = dg.to_adjacencystr(directed=True)
     results['discovered_undirected_edges'] = \
-        picause.arrowstr2adjacencystr(discovered_graph, directed=False)
+        dg.to_adjacencystr(directed=False)
 
 #   if args.verbose: print(pandas.DataFrame(results))
 
     return pandas.DataFrame(results)
 
 
+def sample_datafiles(SEM, sample_sizes, numrows, dirname,
+                     data_type='covariance', workers=1):
+    """
+    writes the data for each sample size, a prefix of the numrows-row
+    dataset generated from SEM, to its own file in dirname,
+    data_<samples>.csv or data_<samples>.cov.
+
+    data_type 'continuous' streams the rows themselves to csv.
+    data_type 'covariance' extends running sums over the growing prefix
+    and writes only the p x p covariance matrix and n.
+    workers threads generate the data of a model with data_rng 'philox'.
+
+    yields:
+    ------
+        (samples, datafile) once each file is written
+    """
+    if data_type == 'covariance':
+        for samples, cov in SEM.iter_covariances(numrows, sample_sizes, workers=workers):
+            datafile = "{}/data_{}.cov".format(dirname, samples)
+            picause.write_covariance(datafile, cov, samples, SEM.V)
+            yield samples, datafile
+    else:
+        for samples in sample_sizes:
+            datafile = "{}/data_{}.csv".format(dirname, samples)
+            SEM.write_data(datafile, num_data_points=numrows, num_rows=samples,
+                           workers=workers)
+            yield samples, datafile
+
+
+def discovery_task(args, task, dirname, backend):
+    """
+    runs one discovery of the sweep and scores it.
+
+    Each task has its own prefs directory, dirname/task<k>, and output
+    file, dirname/results<k>.txt, so that tasks can run side by side.
+    A search that fails (a non-zero exit, or output with no graph) is
+    recorded with outcome 'failed', and is never added to the cache.
+
+    parameters:
+    ----------
+        args: the argsClass of the job
+        task: (k, samples, datafile, algorithm, meta)
+        dirname: the job directory
+        backend: a discovery backend, or the name of one for make_backend
+
+    returns:
+    -------
+        the one-row results DataFrame of the run
+    """
+    k, samples, datafile, algorithm, meta = task
+    if isinstance(backend, str):
+        backend = make_backend(backend)
+    taskdir, output_prefix = task_paths(task, dirname)
+    cache = open_cache(args)
+    try:
+        if cache is not None:
+            key, run_results = cached_task(args, task, dirname, cache,
+                                           discoverycache.backend_version(backend))
+            if run_results is not None:
+                return run_results
+
+        begin_time = time.time()
+        try:
+            graph = picause.discovery_results(sem=None,
+                                              datafile=datafile,
+                                              jdir=taskdir,
+                                              meta=meta,
+                                              write=False,
+                                              algorithm=algorithm,
+                                              output_directory=dirname,
+                                              output_prefix=output_prefix,
+                                              backend=backend,
+                                              as_graph=True,
+                                              data_type=args.data_type)
+            outcome = 'ok'
+        except (OSError, RuntimeError, ValueError) as error:
+            # a search that exited with an error or left no graph
+            print("task {} failed: {}".format(k, error))
+            outcome = 'failed'
+        runtime = time.time() - begin_time
+        # only searches known to have finished are cached
+        if cache is not None and outcome == 'ok':
+            cache.put(key, graph, runtime)
+    finally:
+        if cache is not None:
+            cache.close()
+    if args.verbose and outcome == 'ok':
+        print("Causal output\t\n", graph.select(picause.DIRECTED).to_arrowstr(), "\n")
+    return task_results(args, task, dirname, runtime, outcome)
+
+
+def open_cache(args):
+    """ the job's discovery cache (see discoverycache.py), or None """
+    if args.cache is None:
+        return None
+    return discoverycache.DiscoveryCache(args.cache, max_bytes=args.cache_mb * 2 ** 20)
+
+
+def cached_task(args, task, dirname, cache, version):
+    """
+    scores a task from the discovery cache, if its search is there,
+    writing the cached graph to the task's output file and giving the
+    run the runtime of the search that was cached.
+
+    returns:
+    -------
+        the task's cache key, and its one-row results DataFrame, or
+        None if the search is not cached
+    """
+    k, samples, datafile, algorithm, meta = task
+    key = cache.key(datafile, algorithm, meta, args.data_type, version)
+    hit = cache.get(key)
+    if hit is None:
+        return key, None
+    graph, runtime = hit
+    picause.write_causal_output("{}/results{}.txt".format(dirname, k), graph)
+    return key, task_results(args, task, dirname, runtime)
+
+
+def task_paths(task, dirname):
+    """ creates the prefs directory of a task, and returns it with the
+    prefix of the task's output file in dirname """
+    taskdir = "{}/task{}".format(dirname, task[0])
+    os.makedirs(taskdir + "/.systemPrefs", exist_ok=True)
+    return taskdir, "results{}".format(task[0])
+
+
+def task_results(args, task, dirname, runtime, outcome='ok'):
+    """
+    scores the output of a finished discovery task.
+
+    A task whose outcome is not 'ok' ('failed' or 'timeout') gets a row
+    holding only the graph, the task parameters and the outcome.
+
+    returns:
+    -------
+        the one-row results DataFrame of the run
+    """
+    k, samples, datafile, algorithm, meta = task
+    if outcome == 'ok':
+        run_results = evaluate_discovery("{}/results{}.txt".format(dirname, k), args)
+    else:
+        truegraph = picause.Graph.from_adjacencystr(args.graph, args.nodes)
+        run_results = pandas.DataFrame({'truegraphid': [args.graphnum],
+                                        'nodes': [args.nodes],
+                                        'edges': [len(truegraph)],
+                                        'r': [args.r]})
+        for column in SCORE_COLUMNS:
+            run_results[column] = [None]
+    run_results['runtime'] = ["{:.2f}".format(runtime)]
+    run_results['metaparameter'] = [meta]
+    run_results['samples'] = [samples]
+    run_results['algorithm'] = [algorithm]
+    run_results['outcome'] = [outcome]
+    if args.verbose:
+        print(pandas.DataFrame(run_results))
+    return run_results
+
+
+def async_sweep(args, tasks, dirname, backend, checkpoint=None):
+    """
+    runs the tasks as separate processes with asyncrunner, args.workers
+    at a time, each killed after args.timeout seconds.
+    The stderr of every run that fails or times out is printed, and the
+    results of each run are appended to the checkpoint file, if given,
+    as soon as it finishes.
+
+    returns:
+    -------
+        the list of one-row results DataFrames, in the order of tasks
+    """
+    if not hasattr(backend, 'command'):
+        raise ValueError("the {} backend cannot run under the async executor"
+                         .format(args.backend))
+    results_list = [None] * len(tasks)
+    cache = open_cache(args)
+    version = discoverycache.backend_version(backend)
+    # searches found in the cache are scored at once, the rest are run
+    commands, indices, keys = [], [], []
+    for i, task in enumerate(tasks):
+        k, samples, datafile, algorithm, meta = task
+        if cache is not None:
+            key, results_list[i] = cached_task(args, task, dirname, cache, version)
+            if results_list[i] is not None:
+                if checkpoint is not None:
+                    append_checkpoint(checkpoint, results_list[i])
+                continue
+            keys.append(key)
+        taskdir, output_prefix = task_paths(task, dirname)
+        commands.append(backend.command(datafile, algorithm=algorithm, meta=meta,
+                                        jdir=taskdir, output_directory=dirname,
+                                        output_prefix=output_prefix,
+                                        data_type=args.data_type))
+        indices.append(i)
+
+    def finished(j, result):
+        i = indices[j]
+        task = tasks[i]
+        outcome = result.outcome
+        if outcome == 'ok':
+            try:
+                graph = picause.read_causal_output("{}/results{}.txt".format(dirname, task[0]))
+                results_list[i] = task_results(args, task, dirname, result.runtime, outcome)
+            except (OSError, ValueError) as error:
+                # a search that exited cleanly but left no graph
+                print("task {} failed: {}".format(task[0], error))
+                outcome = 'failed'
+        if outcome != 'ok':
+            print("task {} {} (exit status {}):\n{}\n{}".format(
+                task[0], outcome, result.returncode, result.command, result.stderr))
+            results_list[i] = task_results(args, task, dirname, result.runtime, outcome)
+        if checkpoint is not None:
+            append_checkpoint(checkpoint, results_list[i])
+        # only searches known to have finished are cached
+        if cache is not None and outcome == 'ok':
+            cache.put(keys[j], graph, result.runtime)
+
+    try:
+        asyncrunner.run_commands(commands, args.workers, args.timeout, callback=finished)
+    finally:
+        if cache is not None:
+            cache.close()
+    return results_list
+
+
+def run_key(samples, algorithm, meta):
+    """ the key identifying a run of the sweep in a job """
+    return int(samples), str(algorithm), float(meta)
+
+
+def task_key(task):
+    """ the run_key of a (k, samples, datafile, algorithm, meta) task """
+    k, samples, datafile, algorithm, meta = task
+    return run_key(samples, algorithm, meta)
+
+
+def append_checkpoint(fname, run_results):
+    """
+    appends the one-row results DataFrame of a finished run to the
+    checkpoint file fname, as a line of JSON, and syncs it to disk, so
+    that the run survives the job being killed
+    """
+    line = run_results.to_json(orient='records', lines=True).rstrip('\n') + '\n'
+    with open(fname, 'a+b') as f:
+        # a line cut short by a kill is left on its own, not run into this one
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                line = '\n' + line
+        f.write(line.encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_checkpoint(fname):
+    """
+    reads the runs recorded in the checkpoint file fname, skipping a
+    last line cut short by the job being killed.
+
+    returns:
+    -------
+        a dict from run_key to the one-row results DataFrame of the run
+    """
+    done = dict()
+    if not os.path.isfile(fname):
+        return done
+    with open(fname) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            run_results = pandas.DataFrame([record])
+            done[run_key(record['samples'], record['algorithm'],
+                         record['metaparameter'])] = run_results
+    return done
+
+
+def sweep_tasks(datafiles, args):
+    """
+    lists the (k, samples, datafile, algorithm, meta) discovery tasks of a
+    job, for each (samples, datafile) pair of datafiles, in the order
+    their results are reported
+    """
+    k = 0
+    for samples, datafile in datafiles:
+        algorithms = ['pc', 'fges', 'grasp']
+        if args.algorithm != "":
+            algorithms = [args.algorithm]
+        for algorithm in algorithms:
+            metas = [0.001, 0.01, .05, 0.1]
+            if args.meta >= 0:
+                metas = [args.meta]
+            elif algorithm != 'pc':
+                metas = [2]
+            for meta in metas:
+                yield k, samples, datafile, algorithm, meta
+                k += 1
+
+
+def run_sweep(args, SEM, sample_sizes, numrows, dirname):
+    """
+    runs the (samples x algorithm x meta) discovery sweep of a job in
+    dirname, args.workers runs at a time, in threads, processes or as
+    asyncio-managed subprocesses (see async_sweep) as args.executor says.
+
+    Every finished run is appended to dirname/checkpoint.jsonl at once,
+    and runs found there are not run again, so a job that was killed
+    picks up where it stopped; the data, being drawn from the seed, is
+    only regenerated for the sample sizes with runs left to do.
+
+    The data for every sample size is written first when running in
+    parallel, and as it is needed otherwise.
+    Results come back in the same order however many workers run them.
+    Only the async executor can kill a run, so args.timeout needs it.
+
+    parameters:
+    ----------
+        args: the argsClass of the job
+        SEM: the StructuralEquationDagModel generating the data
+        sample_sizes: the sample sizes to test, in increasing order
+        numrows: the size of the dataset the samples are prefixes of
+        dirname: the job directory
+
+    returns:
+    -------
+        a DataFrame with a results row per discovery
+    """
+    if args.timeout is not None and args.executor != 'async':
+        raise ValueError("a timeout needs the async executor")
+    checkpoint = dirname + '/checkpoint.jsonl'
+    done = read_checkpoint(checkpoint)
+    keys = [run_key(samples, algorithm, meta) for _, samples, _, algorithm, meta
+            in sweep_tasks([(samples, None) for samples in sample_sizes], args)]
+    if args.verbose and len(done) > 0:
+        print("resuming: {} of {} runs already done".format(
+            sum(key in done for key in keys), len(keys)))
+
+    def todo(datafiles):
+        return [task for task in sweep_tasks(datafiles, args)
+                if task_key(task) not in done]
+
+    remaining = sorted({key[0] for key in keys if key not in done})
+    datafiles = []
+    if len(remaining) > 0:
+        datafiles = sample_datafiles(SEM, remaining, numrows, dirname, args.data_type,
+                                     args.workers)
+
+    backend = None
+    if args.workers <= 1 and args.executor != 'async':
+        # run each task as its data file is written, and remove the file
+        # once the tasks of its sample size are done
+        backend = make_backend(args.backend)
+        for samples, datafile in datafiles:
+            for task in todo([(samples, datafile)]):
+                run_results = discovery_task(args, task, dirname, backend)
+                append_checkpoint(checkpoint, run_results)
+                done[task_key(task)] = run_results
+            os.remove(datafile)
+    elif len(remaining) > 0:
+        # every data file is written up front, as tasks of all sample
+        # sizes may be running at once
+        datafiles = list(datafiles)
+        tasks = todo(datafiles)
+        if args.executor == 'async':
+            backend = make_backend(args.backend)
+            results_list = async_sweep(args, tasks, dirname, backend, checkpoint)
+            for task, run_results in zip(tasks, results_list):
+                done[task_key(task)] = run_results
+        else:
+            if args.executor == 'process':
+                backend = args.backend
+                executor = concurrent.futures.ProcessPoolExecutor(args.workers)
+            else:
+                backend = make_backend(args.backend)
+                executor = concurrent.futures.ThreadPoolExecutor(args.workers)
+            with executor:
+                futures = {executor.submit(discovery_task, args, task, dirname, backend): task
+                           for task in tasks}
+                # checkpoint the runs in the order they finish
+                for future in concurrent.futures.as_completed(futures):
+                    task = futures[future]
+                    append_checkpoint(checkpoint, future.result())
+                    done[task_key(task)] = future.result()
+        for _, datafile in datafiles:
+            os.remove(datafile)
+    if hasattr(backend, 'close'):
+        backend.close()
+    return pandas.concat([done[key] for key in keys], ignore_index=True)
+
+
+def peak_memory_mb():
+    """ the peak resident memory of this process plus that of its largest
+    finished child (such as a causal-cmd JVM), in MB; a bound on what
+    the job needed when its discoveries run one at a time """
+    usage = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+             + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return usage / 1024
+
+
 def discover(args):
-    sample_sizes = [50, 100, 200, 400, 800, 1600, 3200, 6400]
-    sample_sizes += [12800, 25600, 51200, 102400]
+    sample_sizes = list(SAMPLE_SIZES)
     if args.samples > 0:
         sample_sizes = [args.samples]
     numrows = max(sample_sizes)
@@ -141,9 +617,10 @@ def discover(args):
     jvm_dirname = basedir + "JavaDirs/dir{}".format(args.index)
     systemprefsdir = jvm_dirname + "/.systemPrefs"
     os.makedirs(systemprefsdir, exist_ok=True)
-    discovery_prefix = 'results'
-    # determine filename of output of causal-cmd
-    discovery_file = jvm_dirname + '/' + discovery_prefix + '.txt'
+    # signal that the job's array task has started, so that jobrunner.py
+    # never mistakes a task still queued for one that died
+    with open(jvm_dirname + '/STARTED', 'w') as f:
+        f.write("")
 
     # |   Set Truegraph
     edges = picause.adjacencystr2pairlist(args.graph)
@@ -153,55 +630,21 @@ def discover(args):
                                              E=edges,
                                              beta=args.r,
                                              make_model=True,
-                                             seed=args.seed)
+                                             seed=args.seed,
+                                             data_rng=args.data_rng)
     if args.verbose:
         print(SEM)
 
-    # Have the SEM class generate data from a given seed
-    data = SEM.generate_data(num_data_points=numrows)
+    # Have the SEM class generate data from a given seed.
+    # Each sample size is a prefix of the same numrows-row dataset.
     if args.verbose:
-        print(data.head())
-    results_list = list()
-
-    for samples in sample_sizes:
-
-        datafile = jvm_dirname + '/data.csv'
-        data[:samples].to_csv(datafile, index=False)
-        algorithms = ['pc', 'fges', 'grasp']
-        if args.algorithm != "":
-            algorithms = [args.algorithm]
-        for algorithm in algorithms:
-            metas = [0.001, 0.01, .05, 0.1]
-            if args.meta >= 0:
-                metas = [args.meta]
-            elif algorithm != 'pc':
-                metas = [2]
-            for meta in metas:
-                begin_time = time.time()
-                causal_output = picause.discovery_results(sem=SEM,
-                                                          datafile=datafile,
-                                                          jdir=jvm_dirname,
-                                                          meta=meta,
-                                                          write=False,
-                                                          algorithm=algorithm,
-                                                          output_directory=jvm_dirname,
-                                                          output_prefix=discovery_prefix)
-                if args.verbose:
-                    print("Causal output\t\n", causal_output, "\n")
-                runtime = time.time() - begin_time
-                run_results = evaluate_discovery(discovery_file, args)
-                run_results['runtime'] = ["{:.2f}".format(runtime)]
-                run_results['metaparameter'] = [meta]
-                run_results['samples'] = [samples]
-                run_results['algorithm'] = [algorithm]
-                if args.verbose:
-                    print(pandas.DataFrame(run_results))
-                results_list.append(run_results)
-    results = pandas.concat(results_list, ignore_index=True)
+        print(next(SEM.iter_data(num_data_points=numrows, chunk_size=5)))
+    results = run_sweep(args, SEM, sample_sizes, numrows, jvm_dirname)
+    # the job's memory high-water mark, for sizing later jobs (see resourcemodel.py)
+    results['maxrss_mb'] = round(peak_memory_mb(), 1)
     results.to_csv(jvm_dirname + '/results.gz.csv',
                    index=False,
                    compression='gzip')
-    os.remove(jvm_dirname + '/data.csv')
 
     # Create filename to signal that entire job completed successfully
     with open(jvm_dirname + '/COMPLETE', 'w') as f:
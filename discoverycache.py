@@ -0,0 +1,212 @@
+"""
+discoverycache:
+a content-addressed on-disk cache of discovery results, so that a
+search already run on the same data (a job restarted, older results
+retested, a power search revisiting a size) costs no JVM time.
+
+A search is keyed by the SHA-256 of its data file's bytes together with
+its algorithm, metaparameter, data type and the backend's version (for
+causal-cmd, the jar), so the key changes whenever anything that decides
+the discovered graph does, including the graph, seed and sample size
+the data was generated from.  Each entry is the discovered graph's
+edges and the search's runtime, in root/<key[:2]>/<key>.npz; a SQLite
+index, root/index.sqlite, records each entry's size and last use, and
+the hit and miss counts.  Once the entries pass max_bytes, the least
+recently used are evicted.
+
+Run as a script to see or empty a cache, e.g.
+
+    python discoverycache.py stats cache/
+    python discoverycache.py clear cache/
+"""
+
+import argparse
+import hashlib
+import json
+import numpy
+import os
+import picause
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER,
+    runtime REAL,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def backend_version(backend):
+    """ what identifies the searches of a backend: its version, if it
+    has one, and otherwise its class name """
+    return str(getattr(backend, 'version', type(backend).__name__))
+
+
+class DiscoveryCache:
+    """
+    The cache in the directory root, created if missing.
+
+    parameters:
+    ----------
+        root: the cache directory
+        max_bytes: the size the entries are kept under
+        timeout: seconds to wait for another process's write lock
+    """
+
+    def __init__(self, root, max_bytes=2 ** 30, timeout=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'),
+                                          timeout=timeout, isolation_level=None)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def key(self, datafile, algorithm, meta, data_type, version):
+        """ the key of a search of datafile, hashed from its bytes and
+        the search's parameters """
+        digest = hashlib.sha256()
+        with open(datafile, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(json.dumps([str(algorithm), float(meta), str(data_type),
+                                  str(version)]).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        """ the file holding the entry key """
+        return os.path.join(self.root, key[:2], key + '.npz')
+
+    def _count(self, name):
+        self.connection.execute("INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) "
+                                "DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key):
+        """
+        looks up a search, counting a hit or a miss.
+
+        returns:
+        -------
+            the discovered picause.Graph and the search's runtime in
+            seconds, or None if the search is not cached
+        """
+        row = self.connection.execute("SELECT runtime FROM entries WHERE key = ?",
+                                      (key,)).fetchone()
+        graph = None
+        if row is not None:
+            try:
+                with numpy.load(self.path(key)) as entry:
+                    names = entry['names'].tolist() if 'names' in entry.files else None
+                    graph = picause.Graph(int(entry['num_nodes']), entry['sources'],
+                                          entry['targets'], entry['kinds'], names)
+            except (OSError, ValueError, KeyError):
+                # evicted by another process, or unreadable: run it again
+                pass
+        if graph is None:
+            self._count('misses')
+            return None
+        self.connection.execute("UPDATE entries SET used = ? WHERE key = ?",
+                                (time.time(), key))
+        self._count('hits')
+        return graph, row[0]
+
+    def put(self, key, graph, runtime):
+        """ stores the discovered graph and runtime of a search, then
+        evicts the least recently used entries past max_bytes """
+        fname = self.path(key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        arrays = dict(num_nodes=graph.num_nodes, sources=graph.sources,
+                      targets=graph.targets, kinds=graph.kinds)
+        if graph.names is not None:
+            arrays['names'] = numpy.array(graph.names)
+        # written under a name of its own, so that concurrent puts of the
+        # same search never see each other's partial files
+        tmpname = "{}.{}-{}.tmp".format(fname, os.getpid(), threading.get_ident())
+        with open(tmpname, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.replace(tmpname, fname)
+        self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                (key, os.path.getsize(fname), float(runtime), time.time()))
+        self.evict()
+
+    def size(self):
+        """ the bytes held by the entries """
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """
+        removes the least recently used entries until the rest hold at
+        most max_bytes, by default the cache's own.
+
+        returns:
+        -------
+            the number of entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        excess = self.size() - max_bytes
+        removed = 0
+        if excess <= 0:
+            return removed
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            victims = []
+            for key, size in cursor.execute("SELECT key, size FROM entries ORDER BY used"):
+                if excess <= 0:
+                    break
+                victims.append(key)
+                excess -= size
+            cursor.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in victims])
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        for key in victims:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            removed += 1
+        return removed
+
+    def stats(self):
+        """ the cache's hits, misses, entries and bytes, as a dict """
+        counters = dict(self.connection.execute("SELECT name, value FROM counters"))
+        return {'hits': counters.get('hits', 0), 'misses': counters.get('misses', 0),
+                'entries': len(self), 'bytes': self.size()}
+
+    def clear(self):
+        """ removes every entry and resets the counters """
+        self.evict(0)
+        self.connection.execute("DELETE FROM counters")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="shows or empties a discovery cache")
+    parser.add_argument("command", choices=['stats', 'clear'])
+    parser.add_argument("root")
+    args = parser.parse_args()
+    with DiscoveryCache(args.root) as cache:
+        if args.command == 'clear':
+            cache.clear()
+        print(json.dumps(cache.stats()))
@@ -0,0 +1,283 @@
+"""
+graphbank:
+builds and reads banks of generating graphs.
+
+A bank holds, for each (nodes, edges, r) configuration, a number of
+random DAGs whose unit-variance models leave every variable at least
+min_residual of independent error variance, each with the seed it was
+drawn from.  Candidates are drawn from seeds derived from the bank's
+seed, screened a batch at a time with picause.implied_residuals, and
+the batches spread over worker processes; the accepted graphs are the
+first count candidates that pass, so the bank is the same for any
+number of workers.
+
+Candidates are drawn with random_dag_edges under the tighter of
+max_indegree and indegree_bound(r), which only rules out graphs that
+could not pass; with a cap of 9 a candidate's graph is the one
+StructuralEquationDagModel(num_var=nodes, num_edges=edges, seed=seed)
+draws.  The seed is also the seed its data is drawn with.
+
+The bank file is a single .npz of flat arrays: one row per graph
+(nodes, edges, r, graphnum, seed, candidates) sorted by configuration and
+graphnum, and every graph's edges concatenated in sources/targets, with
+offsets[i]:offsets[i + 1] the edges of graph i.
+
+Run as a script, e.g.
+
+    python graphbank.py bank.npz --nodes 10 20 --densities 1 2 --rs 0.1 0.5 --count 500 --workers 8
+"""
+
+import argparse
+import concurrent.futures
+import numpy
+import pandas
+import picause
+
+
+def candidate_seeds(seed, nodes, edges, r, start, stop):
+    """
+    the seeds of candidate graphs start to stop - 1 of a configuration.
+    They are drawn from the bank's seed in fixed blocks of 64, so a
+    candidate's seed does not depend on how the candidates are batched.
+    """
+    seeds = []
+    for block in range(start // 64, -(-stop // 64)):
+        entropy = [seed, nodes, edges, int(round(r * 1e6)), block]
+        state = numpy.random.SeedSequence(entropy).generate_state(64, numpy.uint64) >> 1
+        seeds.extend(state.tolist())
+    offset = (start // 64) * 64
+    return seeds[start - offset:stop - offset]
+
+
+def candidate_edges(nodes, edges, seed, max_indegree=9):
+    """
+    draws the graph StructuralEquationDagModel(num_var=nodes,
+    num_edges=edges, seed=seed) would, without building the model.
+
+    returns:
+    -------
+        sources, targets: int arrays of 0-based node indices
+    """
+    rng = numpy.random.default_rng(seed)
+    order = rng.permutation(nodes)
+    sources, targets, _ = picause.random_dag_edges(nodes, edges, rng, max_indegree)
+    return order[sources], order[targets]
+
+
+def screen_batch(nodes, edges, r, seeds, min_residual=0.1, max_indegree=9):
+    """
+    draws the candidate graph of each seed, and tests all of them at once
+    for a residual variance of at least min_residual at every node when
+    every edge has weight r.
+
+    returns:
+    -------
+        a list of (seed, sources, targets) for the accepted candidates,
+        in the order of seeds
+    """
+    graphs = [candidate_edges(nodes, edges, s, max_indegree) for s in seeds]
+    B = numpy.zeros((len(seeds), nodes, nodes))
+    for k, (sources, targets) in enumerate(graphs):
+        B[k, sources, targets] = r
+    with numpy.errstate(all='ignore'):
+        accepted = (picause.implied_residuals(B) >= min_residual).all(axis=1)
+    return [(s, sources, targets) for s, (sources, targets), ok
+            in zip(seeds, graphs, accepted) if ok]
+
+
+def indegree_bound(r, min_residual=0.1, max_indegree=9):
+    """
+    the most parents a node can have and keep min_residual of its
+    variance when every edge has weight r: with positive weights no
+    covariance is negative, so d parents leave at most 1 - d r^2.
+    Drawing candidates under this cap only skips graphs that would fail.
+    """
+    if r == 0:
+        return max_indegree
+    return min(max_indegree, int((1 - min_residual) / (r * r) + 1e-9))
+
+
+def _screen_range(nodes, edges, r, seed, start, stop, min_residual, max_indegree):
+    """ screens candidates start to stop - 1; run in a worker process """
+    seeds = candidate_seeds(seed, nodes, edges, r, start, stop)
+    return [(s, sources, targets, start + seeds.index(s) + 1) for s, sources, targets
+            in screen_batch(nodes, edges, r, seeds, min_residual, max_indegree)]
+
+
+def find_graphs(nodes, edges, r, count, seed=0, batch_size=64, min_residual=0.1,
+                max_indegree=9, max_candidates=100000, executor=None, wave=1):
+    """
+    screens candidate graphs of one configuration, in batches, until
+    count are accepted or max_candidates have been tried.
+
+    parameters:
+    ----------
+        nodes, edges, r: the configuration
+        count: the number of graphs wanted
+        seed: the seed of the bank
+        batch_size: the number of candidates screened at once
+        min_residual: the smallest acceptable residual variance
+        max_indegree: the largest number of parents a node may have;
+            lowered to indegree_bound(r, min_residual) if that is smaller
+        max_candidates: the most candidates to try
+        executor: an optional concurrent.futures executor to screen
+            batches on
+        wave: the number of batches handed to the executor at a time
+
+    returns:
+    -------
+        a list of (seed, sources, targets, candidates) for the accepted
+        graphs, candidates being the number of candidates tried up to
+        and including it (there may be fewer than count of them)
+    """
+    accepted = []
+    max_indegree = indegree_bound(r, min_residual, max_indegree)
+    for start in range(0, max_candidates, batch_size * wave):
+        ranges = [(k, min(k + batch_size, max_candidates))
+                  for k in range(start, min(start + batch_size * wave, max_candidates),
+                                 batch_size)]
+        args = [(nodes, edges, r, seed, begin, end, min_residual, max_indegree)
+                for begin, end in ranges]
+        if executor is None:
+            results = [_screen_range(*a) for a in args]
+        else:
+            results = [f.result() for f in [executor.submit(_screen_range, *a) for a in args]]
+        for result in results:
+            accepted.extend(result)
+        if len(accepted) >= count:
+            break
+    return accepted[:count]
+
+
+def build_bank(fname, configs, count, seed=0, workers=1, batch_size=64,
+               min_residual=0.1, max_indegree=9, max_candidates=100000,
+               verbose=False):
+    """
+    finds count graphs for every (nodes, edges, r) in configs, and
+    writes them to the bank file fname.
+    A configuration for which fewer are found within max_candidates
+    keeps those it found.
+
+    returns:
+    -------
+        the GraphBank written
+    """
+    executor = None
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+    columns = {c: [] for c in ['nodes', 'edges', 'r', 'graphnum', 'seed', 'candidates']}
+    sources, targets = [], []
+    try:
+        for nodes, edges, r in sorted(configs):
+            found = find_graphs(nodes, edges, r, count, seed, batch_size,
+                                min_residual, max_indegree, max_candidates,
+                                executor, workers)
+            if verbose:
+                print("{} nodes, {} edges, r {}: {} graphs".format(nodes, edges, r,
+                                                                    len(found)))
+            for graphnum, (s, u, v, candidates) in enumerate(found, start=1):
+                for c, x in zip(columns, [nodes, edges, r, graphnum, s, candidates]):
+                    columns[c].append(x)
+                sources.append(u)
+                targets.append(v)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    lengths = [len(u) for u in sources]
+    numpy.savez_compressed(
+        fname,
+        nodes=numpy.array(columns['nodes'], dtype=numpy.int32),
+        edges=numpy.array(columns['edges'], dtype=numpy.int32),
+        r=numpy.array(columns['r'], dtype=float),
+        graphnum=numpy.array(columns['graphnum'], dtype=numpy.int32),
+        seed=numpy.array(columns['seed'], dtype=numpy.int64),
+        candidates=numpy.array(columns['candidates'], dtype=numpy.int64),
+        offsets=numpy.concatenate([[0], numpy.cumsum(lengths, dtype=numpy.int64)]),
+        sources=numpy.concatenate(sources + [[]]).astype(numpy.int16),
+        targets=numpy.concatenate(targets + [[]]).astype(numpy.int16))
+    return GraphBank(fname)
+
+
+class GraphBank:
+    """
+    A bank file written by build_bank, loaded for lookups.
+
+    parameters:
+    ----------
+        fname: the bank file
+    """
+
+    def __init__(self, fname):
+        with numpy.load(fname) as bank:
+            self.arrays = {k: bank[k] for k in bank.files}
+        self._index = {(int(n), int(e), float(r), int(g)): i for i, (n, e, r, g)
+                       in enumerate(zip(self.arrays['nodes'], self.arrays['edges'],
+                                        self.arrays['r'], self.arrays['graphnum']))}
+
+    def __len__(self):
+        return len(self.arrays['graphnum'])
+
+    def __contains__(self, key):
+        """ whether the bank has the graph (nodes, edges, r, graphnum) """
+        nodes, edges, r, graphnum = key
+        return (int(nodes), int(edges), float(r), int(graphnum)) in self._index
+
+    def configs(self):
+        """ the (nodes, edges, r) configurations in the bank, with how
+        many graphs each has """
+        counts = dict()
+        for n, e, r in zip(self.arrays['nodes'].tolist(), self.arrays['edges'].tolist(),
+                           self.arrays['r'].tolist()):
+            counts[(n, e, r)] = counts.get((n, e, r), 0) + 1
+        return counts
+
+    def get(self, nodes, edges, r, graphnum):
+        """
+        returns:
+        -------
+            the graph numbered graphnum of the configuration, as a
+            picause.Graph, and its seed
+        """
+        i = self._index[(int(nodes), int(edges), float(r), int(graphnum))]
+        begin, end = self.arrays['offsets'][i], self.arrays['offsets'][i + 1]
+        graph = picause.Graph(int(nodes), self.arrays['sources'][begin:end],
+                              self.arrays['targets'][begin:end])
+        return graph, int(self.arrays['seed'][i])
+
+    def to_frame(self):
+        """
+        the bank as a truegraph table, with a row per graph giving vars,
+        edges, r, graphnum, graphstr (an adjacency string) and seed, as
+        read by discover.graphrow2args and jobrunner.py
+        """
+        graphstrs = [self.get(n, e, r, g)[0].to_adjacencystr() for n, e, r, g
+                     in zip(self.arrays['nodes'], self.arrays['edges'],
+                            self.arrays['r'], self.arrays['graphnum'])]
+        return pandas.DataFrame({'vars': self.arrays['nodes'],
+                                 'edges': self.arrays['edges'],
+                                 'r': self.arrays['r'],
+                                 'graphnum': self.arrays['graphnum'],
+                                 'graphstr': graphstrs,
+                                 'seed': self.arrays['seed']})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="builds a bank of generating graphs")
+    parser.add_argument("bankfile")
+    parser.add_argument("--nodes", type=int, nargs='+', default=[10, 20, 40, 100])
+    parser.add_argument("--densities", type=float, nargs='+', default=[1, 1.5, 2])
+    parser.add_argument("--rs", type=float, nargs='+', default=[0.1, 0.3, 0.5])
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--min-residual", type=float, default=0.1)
+    parser.add_argument("--max-candidates", type=int, default=100000)
+    args = parser.parse_args()
+    configs = [(n, int(n * d), r) for n in args.nodes for d in args.densities
+               for r in args.rs]
+    build_bank(args.bankfile, configs, args.count, seed=args.seed,
+               workers=args.workers, batch_size=args.batch_size,
+               min_residual=args.min_residual, max_candidates=args.max_candidates,
+               verbose=True)
@@ -0,0 +1,200 @@
+"""
+jobqueue:
+a SQLite store of simulation jobs and their status, for jobrunner.py.
+
+Each job is a row (id, vars, edges, r, graphnum, graphstr, seed,
+status), the id being the job's directory number; status is one of
+'Unstarted', 'Pending' and 'Completed', as in the old jobstatus.csv.gz,
+or 'Stopped' for jobs of a configuration that needs no more replicates
+(see sequential.py), and is indexed, so finding work never scans the
+table.  Jobs are claimed a batch at a time inside one write transaction,
+so two jobrunners can never start the same job, and every status change
+is a single small transaction rather than a rewrite of the whole table.
+
+Run as a script to import an existing status file, e.g.
+
+    python jobqueue.py jobs.sqlite jobstatus.csv.gz
+"""
+
+import argparse
+import pandas
+import sqlite3
+import time
+
+UNSTARTED = 'Unstarted'
+PENDING = 'Pending'
+COMPLETED = 'Completed'
+STOPPED = 'Stopped'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    vars INTEGER,
+    edges INTEGER,
+    r REAL,
+    graphnum INTEGER,
+    graphstr TEXT,
+    seed TEXT,
+    status TEXT NOT NULL DEFAULT 'Unstarted',
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_replicate ON jobs (status, graphnum, id);
+"""
+
+def _seed_text(seed):
+    """ seeds can be wider than 64 bits, so they are kept as text """
+    if isinstance(seed, float):
+        seed = int(seed)
+    return str(seed)
+
+
+class JobQueue:
+    """
+    The job table in the SQLite file fname, created if missing.
+
+    parameters:
+    ----------
+        fname: the database file
+        timeout: seconds to wait for another process's write lock
+    """
+
+    def __init__(self, fname, timeout=60):
+        self.connection = sqlite3.connect(fname, timeout=timeout,
+                                          isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def _executemany(self, sql, rows):
+        """ runs sql once for each of rows, as one write transaction """
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany(sql, rows)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def import_frame(self, df):
+        """
+        adds the jobs of a jobstatus DataFrame, with columns vars, r,
+        graphnum, graphstr, seed, optionally edges and Status, using its
+        index as the job ids; jobs already present are replaced.
+        """
+        now = time.time()
+        rows = []
+        for job_id, row in zip(df.index.tolist(), df.to_dict('records')):
+            rows.append((int(job_id),
+                         int(row['vars']),
+                         None if pandas.isna(row.get('edges')) else int(row['edges']),
+                         float(row['r']),
+                         int(row['graphnum']),
+                         row['graphstr'],
+                         _seed_text(row['seed']),
+                         row.get('Status', UNSTARTED),
+                         now))
+        self._executemany("INSERT OR REPLACE INTO jobs (id, vars, edges, r, graphnum, "
+                          "graphstr, seed, status, updated) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def import_csv(self, fname):
+        """ adds the jobs of a jobstatus csv, such as jobstatus.csv.gz """
+        self.import_frame(pandas.read_csv(fname, dtype={'seed': str}))
+
+    def count(self, status=None):
+        """ the number of jobs, or of jobs with the given status """
+        if status is None:
+            return len(self)
+        return self.connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?",
+                                       (status,)).fetchone()[0]
+
+    def claim(self, k, by_replicate=False):
+        """
+        marks the (up to) k unstarted jobs with the lowest ids Pending,
+        in one transaction, and returns them.  With by_replicate, the
+        jobs with the lowest graphnum come first, so that every
+        configuration gets its next replicate before any gets two.
+
+        returns:
+        -------
+            a list of sqlite3.Row, with the columns of the job table
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            order = "graphnum, id" if by_replicate else "id"
+            jobs = cursor.execute("SELECT * FROM jobs WHERE status = ? ORDER BY {} LIMIT ?"
+                                  .format(order), (UNSTARTED, k)).fetchall()
+            cursor.executemany("UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                               [(PENDING, time.time(), job['id']) for job in jobs])
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return jobs
+
+    def set_status(self, job_ids, status):
+        """ gives every job in job_ids the status, in one transaction """
+        now = time.time()
+        self._executemany("UPDATE jobs SET status = ?, updated = ? WHERE id = ?",
+                          [(status, now, int(i)) for i in job_ids])
+
+    def stale(self, age):
+        """ the jobs that have been Pending for more than age seconds,
+        as sqlite3.Rows """
+        return self.connection.execute(
+            "SELECT * FROM jobs WHERE status = ? AND updated < ? ORDER BY id",
+            (PENDING, time.time() - age)).fetchall()
+
+    def release(self, job_ids):
+        """ returns claimed jobs that were never started to the queue """
+        self.set_status(job_ids, UNSTARTED)
+
+    def stop(self, nodes, edges, r):
+        """
+        marks the unstarted jobs of the configuration Stopped; jobs
+        imported without an edge count are never stopped.
+
+        returns:
+        -------
+            the number of jobs stopped
+        """
+        cursor = self.connection.execute(
+            "UPDATE jobs SET status = ?, updated = ? WHERE status = ? AND vars = ? "
+            "AND edges = ? AND ABS(r - ?) < 1e-9",
+            (STOPPED, time.time(), UNSTARTED, int(nodes), int(edges), float(r)))
+        return cursor.rowcount
+
+    def get(self, job_id):
+        """ the job with the given id, as a sqlite3.Row, or None """
+        return self.connection.execute("SELECT * FROM jobs WHERE id = ?",
+                                       (int(job_id),)).fetchone()
+
+    def to_frame(self):
+        """ the job table as a jobstatus DataFrame, indexed by job id """
+        df = pandas.read_sql_query("SELECT * FROM jobs ORDER BY id", self.connection,
+                                   index_col='id')
+        return df.rename(columns={'status': 'Status'}).drop(columns='updated')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="imports a jobstatus csv into a job queue")
+    parser.add_argument("database")
+    parser.add_argument("csv")
+    args = parser.parse_args()
+    with JobQueue(args.database) as queue:
+        queue.import_csv(args.csv)
+        print("{} jobs, {} unstarted".format(len(queue), queue.count(UNSTARTED)))
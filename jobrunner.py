@@ -1,34 +1,106 @@
+import discover
+import graphbank
+import jobqueue
 import os
 import pandas
+import picause
+import resourcemodel
+import resultstore
+import sequential
+import shlex
+import slurmarray
 from shutil import rmtree
 import time
 
 
+def last_activity(dirname):
+    """ the latest modification time of dirname or any file in it,
+    or 0 if it does not exist """
+    if not os.path.isdir(dirname):
+        return 0
+    return max([os.path.getmtime(dirname)] +
+               [os.path.getmtime(os.path.join(dirname, f)) for f in os.listdir(dirname)])
+
+
+def requeue_stale(jobs, javatopdir, age):
+    """
+    puts back in the queue the jobs whose array task died (killed, out
+    of time or out of memory) before finishing: Pending for more than
+    age seconds, with a STARTED file but no COMPLETE file, and nothing
+    written in their directory for as long.  A job whose task is still
+    waiting in the SLURM queue has no STARTED file, however long it
+    waits.  The directories are kept, so that the next run of each job
+    resumes from its checkpoint.jsonl (see discover.py), but their
+    STARTED files are removed, so that the wait of the job's next task
+    is not taken for a death either.
+
+    returns:
+    -------
+        the ids of the jobs put back
+    """
+    stale = []
+    for row in jobs.stale(age):
+        localdir = javatopdir + 'dir{}/'.format(row['id'])
+        if os.path.exists(localdir + 'COMPLETE') or not os.path.exists(localdir + 'STARTED'):
+            continue
+        if last_activity(localdir) <= time.time() - age:
+            stale.append(row['id'])
+    for job_id in stale:
+        os.remove(javatopdir + 'dir{}/STARTED'.format(job_id))
+    jobs.release(stale)
+    return stale
+
+
 def jobrunner():
     # * define filenames and other constants
     homedir = '/home/erichk/will4379/'
     simdir = homedir + 'SimDec22Summary/'
-    jobstatus = simdir + 'jobstatus.csv.gz'
+    jobstatus = simdir + 'jobstatus.csv.gz' # imported into the job queue once
+    jobdb = simdir + 'jobs.sqlite' # see jobqueue.py
+    graphbankfile = simdir + 'graphbank.npz' # see graphbank.py
     javatopdir = homedir + 'JavaDirs/'
-    resultsfile = 'results7.csv.gz'
+    # append-only results store (see resultstore.py); export it to one
+    # file with: python resultstore.py export <resultsdir> results.csv.gz
+    resultsdir = simdir + 'results/'
+    manifestdir = simdir + 'manifests/' # job array manifests, see slurmarray.py
     start_time = time.time()
     max_jobs = 1000
+    cpus_per_task = 1 # discover.py runs this many discoveries at once
+    task_hours = 10 # hours of predicted work packed into each array task
+    job_overhead = 300 # seconds per job of data generation and scoring
     max_collate_time = 1800 # time in seconds to work on collating
-    max_jobstart_time = 2100 # time in seconds at which no more jobs will be created
+    stale_hours = 48 # a started job with no activity for this long has died
+    # stop scheduling a configuration's replicates once the 95% intervals of
+    # these metrics are narrower than stop_width in all of its groups, each
+    # with min_replicates runs (see sequential.py); None runs every replicate
+    stop_width = 0.05
+    stop_metrics = ['oriented_sensitivity', 'oriented_precision']
+    min_replicates = 20
+
+    results = resultstore.ResultsStore(resultsdir)
 
-    # * load job dataframe
-    jobs = pandas.read_csv(jobstatus)
+    # * open the job queue, filling it on the first run from the old
+    # status file or else the graph bank
+    jobs = jobqueue.JobQueue(jobdb)
+    if len(jobs) == 0:
+        if os.path.isfile(jobstatus):
+            # with edge counts, so that configurations can be stopped
+            truegraphs = pandas.read_csv(jobstatus, dtype={'seed': str})
+            truegraphs['edges'] = [len(picause.adjacencystr2pairlist(graphstr))
+                                   for graphstr in truegraphs.graphstr]
+            jobs.import_frame(truegraphs)
+        elif os.path.isfile(graphbankfile):
+            jobs.import_frame(graphbank.GraphBank(graphbankfile).to_frame())
 
     if "JavaDirs" not in os.listdir(homedir):
         os.mkdir(javatopdir)
 
-    num_jobs_remaining = len(jobs[jobs.Status == "Unstarted"])
+    num_jobs_remaining = jobs.count(jobqueue.UNSTARTED)
     num_jobs_untabulated = len(os.listdir(javatopdir))
 
     # * Schedule a new copy of self if necessary
     if num_jobs_remaining > 0 or num_jobs_untabulated > 0:
-        s = "sbatch << EOF\n"
-        s += "#!/bin/bash -l\n "
+        s = "#!/bin/bash -l\n"
         s += "#SBATCH -A erichk\n"
         s += "#SBATCH --begin=now+1hour\n"
         s += "#SBATCH --time=45:00\n"
@@ -39,9 +111,8 @@ def jobrunner():
         s += "#SBATCH --job-name=jobrunner\n"
         s += "#SBATCH --output=slurmoutput/jobrunner.txt\n"
         s += "python3 jobrunner.py\n"
-        s += "EOF\n"
 
-        _ = os.popen(s).read()
+        slurmarray.submit(s)
 
     # * Examine existing job directories, collate them if they contain finished jobs.
     for javadir in os.listdir(javatopdir):
@@ -50,59 +121,65 @@ def jobrunner():
         localdir = javatopdir + javadir + '/'
         dirnum = int(javadir[3:])
         if 'COMPLETE' in os.listdir(localdir):
-            # read in results and save them with exisiting results
-            newresults = pandas.read_csv(localdir + 'results.gz.csv', compression='gzip')
-            if resultsfile not in os.listdir(simdir): 
-                newresults.to_csv(simdir + resultsfile, index=False,
-                                  compression='gzip')
-            else:
-                results = pandas.read_csv(simdir + resultsfile, compression='gzip')
-                combined_results = pandas.concat([results, newresults], ignore_index=True)
-                combined_results.to_csv(simdir + resultsfile, index=False,
-                                        compression='gzip')
-
-            # update job dataframe to show job has finished
-            jobs.at[dirnum, 'Status'] = "Completed"
-            jobs.to_csv(jobstatus, index=False, compression='gzip')
+            # add the results to the store as a shard of their own
+            results.append_file(localdir + 'results.gz.csv', job_id=dirnum)
+
+            # mark the job as finished
+            jobs.set_status([dirnum], jobqueue.COMPLETED)
             # wipe directory (or add to wipe list)
             rmtree(localdir)
 
+    # * Put back jobs whose array task died, to resume from their checkpoints
+    requeue_stale(jobs, javatopdir, stale_hours * 3600)
+
+    # * Stop configurations with enough replicates
+    if stop_width is not None:
+        rule = sequential.StoppingRule(stop_metrics, stop_width, min_replicates=min_replicates)
+        for nodes, edges, r in rule.settled(results.read(columns=sequential.COLUMNS)):
+            jobs.stop(nodes, edges, r)
+
     # * Create new jobs, if necessary
-    num_todo = min(max_jobs, num_jobs_remaining)
-    for i in range(num_todo):
-        if time.time() - start_time > max_jobstart_time:
-            break
-        # choose an unstarted job
-        jobidx = jobs[jobs.Status == "Unstarted"].index.min()
-        # create java directory
+    # claim the next unstarted jobs, marking them 'pending', in one go; with
+    # stopping, a replicate at a time across the configurations still running
+    claimed = jobs.claim(max_jobs, by_replicate=stop_width is not None)
+    # size the jobs with a model fitted to the results so far (see resourcemodel.py)
+    model = resourcemodel.ResourceModel().fit(results.read(columns=resourcemodel.COLUMNS))
+    runs = [(samples, algorithm) for _, samples, _, algorithm, _ in discover.sweep_tasks(
+        [(n, None) for n in discover.SAMPLE_SIZES], discover.argsClass(0, 0, 0, '', 0, 0))]
+    commands, seconds, memory, created = [], [], [], []
+    for row in claimed:
+        jobidx = row['id']
+        # create java directory, or keep that of a job being resumed
         localdir = javatopdir + 'dir{}/'.format(jobidx)
-        os.mkdir(localdir)
-        # mark job as 'pending'
-        jobs.at[jobidx, 'Status'] = 'Pending'
-        # save job dataframe
-        jobs.to_csv(jobstatus, index=False, compression='gzip')
-        # create job to run graph
-        row = jobs.loc[jobidx]
-        bash_graphstr = row.graphstr.replace(';', '\;')
-        s = "sbatch << EOF\n"
-        s += "#!/bin/bash -l\n "
-        s += "#SBATCH -A erichk\n"
-        s += "#SBATCH --time=10:00:00\n"
-        s += "#SBATCH --mem=4g\n"
-        s += "#SBATCH --ntasks=1\n"
-        s += "#SBATCH --mail-type=NONE\n"
-        s += "#SBATCH --error={}slurm.err\n".format(localdir)
-        s += "#SBATCH --job-name=job{}\n".format(jobidx)
-        s += "#SBATCH --output={}joboutput.txt\n".format(localdir)
-        s += 'python3 discover.py {} {} {} {} {} {}\n'.format(row.vars,
-                                                              row.r,
-                                                              row.graphnum,
-                                                              bash_graphstr,
-                                                              row.seed,
-                                                              jobidx)
-        s += "EOF\n"
-
-        _ = os.popen(s).read()
+        if not os.path.isdir(localdir):
+            os.mkdir(localdir)
+            created.append(localdir)
+        # the command running the job's graph, logging to its directory
+        commands.append('python3 discover.py {} {} {} {} {} {} > {} 2> {}'.format(
+            row['vars'], row['r'], row['graphnum'], shlex.quote(row['graphstr']),
+            row['seed'], jobidx, shlex.quote(localdir + 'joboutput.txt'),
+            shlex.quote(localdir + 'slurm.err')))
+        num_edges = len(picause.adjacencystr2pairlist(row['graphstr']))
+        seconds.append(job_overhead + model.job_runtime(row['vars'], num_edges, runs,
+                                                        workers=cpus_per_task))
+        memory.append(model.predict_memory(row['vars'], num_edges)[0])
+
+    # submit them all as job arrays (see slurmarray.py), packed and
+    # limited by their predicted runtime and memory
+    if len(commands) > 0:
+        try:
+            slurmarray.submit_sized(manifestdir + 'jobs-{}.jsonl'.format(int(start_time)),
+                                    commands, seconds, memory, capacity=task_hours * 3600,
+                                    job_name='job', cpus_per_task=cpus_per_task,
+                                    account='erichk')
+        except Exception:
+            # put the jobs back for the next run
+            jobs.release([row['id'] for row in claimed])
+            for localdir in created:
+                rmtree(localdir, ignore_errors=True)
+            raise
+
+    jobs.close()
 
 
 
@@ -0,0 +1,315 @@
+"""
+pcalg:
+an in-process NumPy implementation of the PC algorithm.
+
+The independence tests are Fisher z tests of partial correlations,
+computed from the sample covariance matrix, so a search needs only the
+p x p covariance and the sample size.  NumpyPCBackend wraps it as a
+discovery backend for picause.discovery_results, as an alternative to
+starting a JVM for every causal-cmd call.
+
+Run as a script, it runs PC on one file, e.g.
+
+    python pcalg.py data.csv --alpha 0.01 --out dir1 --prefix results
+"""
+
+import argparse
+import itertools
+import numpy
+import os
+import pandas
+import picause
+import shlex
+import sys
+from statistics import NormalDist
+
+
+def correlation_matrix(cov):
+    """ rescales a covariance matrix to a correlation matrix """
+    cov = numpy.asarray(cov, dtype=float)
+    sd = numpy.sqrt(numpy.diag(cov))
+    return cov / numpy.outer(sd, sd)
+
+
+def partial_correlations(corr, tests):
+    """
+    computes the partial correlation of i and j given S for every row
+    (i, j, S...) of tests, from the inverses of the correlation
+    submatrices over {i, j} + S, in one batched call.
+
+    parameters:
+    ----------
+        corr: a (p x p) correlation matrix
+        tests: an (m x (d + 2)) integer array of test rows, all with
+            conditioning sets of the same size d
+    """
+    tests = numpy.asarray(tests)
+    if tests.shape[1] == 2:
+        return corr[tests[:, 0], tests[:, 1]]
+    sub = corr[tests[:, :, None], tests[:, None, :]]
+    try:
+        precision = numpy.linalg.inv(sub)
+    except numpy.linalg.LinAlgError:
+        precision = numpy.linalg.pinv(sub)
+    return -precision[:, 0, 1] / numpy.sqrt(precision[:, 0, 0] * precision[:, 1, 1])
+
+
+def fisher_z_independent(corr, n, tests, alpha):
+    """
+    runs the Fisher z test of i _||_ j | S for every row (i, j, S...) of
+    tests, returning a boolean array that is True where independence is
+    not rejected at level alpha.
+    As in Tetrad, a test with n - |S| - 3 <= 0 never judges independence.
+    """
+    tests = numpy.asarray(tests)
+    depth = tests.shape[1] - 2
+    r = numpy.clip(partial_correlations(corr, tests), -1 + 1e-12, 1 - 1e-12)
+    critical = NormalDist().inv_cdf(1 - alpha / 2)
+    with numpy.errstate(invalid='ignore'):
+        z = numpy.sqrt(n - depth - 3) * numpy.abs(numpy.arctanh(r))
+    return z < critical
+
+
+def pc_skeleton(corr, n, alpha, max_depth=-1, batch_size=100000):
+    """
+    the PC-stable adjacency search.
+
+    At each depth d the adjacencies are frozen, every adjacent pair
+    x, y is tested against each size-d subset of adj(x) - {y} and then of
+    adj(y) - {x}, the tests of the depth being generated and evaluated
+    batch_size at a time, so that memory is bounded however many there
+    are, and each pair found independent is removed with the first
+    subset that separated it.
+
+    parameters:
+    ----------
+        corr: a (p x p) correlation matrix
+        n: the sample size
+        alpha: the significance level of the tests
+        max_depth: the largest conditioning set to try; -1 for no limit
+        batch_size: the number of tests evaluated per numpy call
+
+    returns:
+    -------
+        adjacency: a (p x p) symmetric boolean matrix
+        sepsets: a dictionary mapping each removed pair (i, j), i < j,
+            to its separating set
+    """
+    p = len(corr)
+    adjacency = ~numpy.eye(p, dtype=bool)
+    sepsets = dict()
+    depth = 0
+    while max_depth < 0 or depth <= max_depth:
+        neighbors = [numpy.flatnonzero(adjacency[i]).tolist() for i in range(p)]
+        if all(len(nb) - 1 < depth for nb in neighbors):
+            break
+        pairs = list(zip(*numpy.nonzero(numpy.triu(adjacency, 1))))
+        separating = dict()
+
+        def depth_tests():
+            # the tests of the depth, generated as they are evaluated; a
+            # pair already separated gets no more
+            for pair, (i, j) in enumerate(pairs):
+                for x, y in ((i, j), (j, i)):
+                    if pair in separating:
+                        break
+                    others = [k for k in neighbors[x] if k != y]
+                    for S in itertools.combinations(others, depth):
+                        yield pair, (i, j) + S
+                    if depth == 0:
+                        break
+
+        tests = depth_tests()
+        batch = list(itertools.islice(tests, batch_size))
+        if len(batch) == 0:
+            break
+        while len(batch) > 0:
+            rows = numpy.array([test for _, test in batch], dtype=numpy.int64)
+            for k in numpy.flatnonzero(fisher_z_independent(corr, n, rows, alpha)).tolist():
+                pair, test = batch[k]
+                if pair not in separating:
+                    separating[pair] = test[2:]
+            batch = list(itertools.islice(tests, batch_size))
+        for pair, S in separating.items():
+            i, j = pairs[pair]
+            adjacency[i, j] = adjacency[j, i] = False
+            sepsets[(int(i), int(j))] = set(S)
+        depth += 1
+    return adjacency, sepsets
+
+
+def orient(adjacency, sepsets):
+    """
+    orients a PC skeleton: unshielded colliders first, then Meek's rules
+    R1-R3 until nothing changes.
+
+    A collider i --> k <-- j is only oriented when neither edge already
+    points the other way, so earlier colliders take priority and no edge
+    ends up oriented both ways.
+
+    returns:
+    -------
+        a (p x p) boolean matrix with D[i, j] True for each edge i --> j;
+        adjacent pairs oriented neither way are undirected.
+    """
+    p = len(adjacency)
+    directed = numpy.zeros((p, p), dtype=bool)
+    for k in range(p):
+        for i, j in itertools.combinations(numpy.flatnonzero(adjacency[k]).tolist(), 2):
+            if adjacency[i, j] or k in sepsets.get((min(i, j), max(i, j)), ()):
+                continue
+            if not directed[k, i] and not directed[k, j]:
+                directed[i, k] = directed[j, k] = True
+
+    def undirected_row(b):
+        return adjacency[b] & ~directed[b] & ~directed[:, b]
+
+    nodes = numpy.arange(p)
+    changed = True
+    while changed:
+        changed = False
+        for b, c in zip(*numpy.nonzero(adjacency & ~directed & ~directed.T)):
+            if directed[b, c] or directed[c, b]:
+                continue
+            # R1: a --> b --- c, with a and c nonadjacent
+            orientable = numpy.any(directed[:, b] & ~adjacency[:, c] & (nodes != c))
+            # R2: b --> a --> c, with b --- c
+            if not orientable:
+                orientable = numpy.any(directed[b] & directed[:, c])
+            # R3: b --- a1 --> c and b --- a2 --> c, with a1 and a2 nonadjacent
+            if not orientable:
+                candidates = numpy.flatnonzero(undirected_row(b) & directed[:, c])
+                orientable = any(not adjacency[a1, a2] for a1, a2
+                                 in itertools.combinations(candidates.tolist(), 2))
+            if orientable:
+                directed[b, c] = True
+                changed = True
+    return directed
+
+
+def pc(cov, n, alpha=0.05, names=None, max_depth=-1):
+    """
+    runs the PC algorithm on a covariance (or correlation) matrix.
+
+    parameters:
+    ----------
+        cov: the (p x p) sample covariance matrix
+        n: the number of samples it was computed from
+        alpha: the significance level of the Fisher z tests
+        names: optional list of the node names of the returned Graph
+        max_depth: the largest conditioning set to try; -1 for no limit
+
+    returns:
+    -------
+        the discovered pattern as a picause.Graph of directed
+        and undirected edges
+    """
+    corr = correlation_matrix(cov)
+    adjacency, sepsets = pc_skeleton(corr, n, alpha, max_depth)
+    directed = orient(adjacency, sepsets)
+
+    sources, targets, kinds = [], [], []
+    for i, j in zip(*numpy.nonzero(numpy.triu(adjacency, 1))):
+        if directed[j, i]:
+            i, j = j, i
+        sources.append(i)
+        targets.append(j)
+        kinds.append(picause.DIRECTED if directed[i, j] else picause.UNDIRECTED)
+    if names is not None and \
+            list(names) == ["x_{}".format(i) for i in range(1, len(corr) + 1)]:
+        names = None
+    return picause.Graph(len(corr), sources, targets, kinds, names)
+
+
+class NumpyPCBackend:
+    """
+    A discovery backend that runs the PC algorithm in-process.
+
+    The data file is read once and reduced to its covariance matrix, or a
+    covariance file is read directly; the discovered graph is written to
+    output_directory/output_prefix.txt in causal-cmd's output layout, so
+    that downstream evaluation is unchanged.
+    Algorithms other than pc are passed to the fallback backend.
+
+    parameters:
+    ----------
+        fallback: the backend for other algorithms.
+            Defaults to picause.CausalCmdBackend().
+        max_depth: the largest conditioning set PC tries; -1 for no limit
+    """
+
+    def __init__(self, fallback=None, max_depth=-1):
+        if fallback is None:
+            fallback = picause.CausalCmdBackend()
+        self.fallback = fallback
+        self.max_depth = max_depth
+
+    @property
+    def version(self):
+        """ identifies the searches this backend runs (see discoverycache.py) """
+        return "pcalg max_depth={}; {}".format(self.max_depth,
+                                               getattr(self.fallback, 'version', ''))
+
+    def run(self, datafile, algorithm='pc', meta=0.1, jdir=None,
+            output_directory=None, output_prefix='results',
+            data_type='continuous'):
+        """
+        runs the discovery algorithm on datafile, and returns the
+        discovered graph as a Graph. See picause.discover() for the
+        parameters; meta is PC's alpha.
+        """
+        if algorithm != 'pc':
+            return self.fallback.run(datafile, algorithm=algorithm, meta=meta,
+                                     jdir=jdir,
+                                     output_directory=output_directory,
+                                     output_prefix=output_prefix,
+                                     data_type=data_type)
+        if data_type == 'covariance':
+            cov, n, names = picause.read_covariance(datafile)
+        else:
+            data = pandas.read_csv(datafile)
+            cov = numpy.cov(data.to_numpy(), rowvar=False)
+            n, names = len(data), list(data.columns)
+        graph = pc(cov, n, alpha=meta, names=names, max_depth=self.max_depth)
+        outfile = "{}/{}.txt".format(output_directory, output_prefix)
+        header = "PC (in-process NumPy backend)\nalpha: {}".format(meta)
+        picause.write_causal_output(outfile, graph, header=header)
+        return graph
+
+    def command(self, datafile, algorithm='pc', meta=0.1, jdir=None,
+                output_directory=None, output_prefix='results',
+                data_type='continuous'):
+        """
+        returns a shell command doing what run() does, by running this
+        module as a script; other algorithms get the fallback's command
+        """
+        if algorithm != 'pc':
+            return self.fallback.command(datafile, algorithm=algorithm, meta=meta,
+                                         jdir=jdir,
+                                         output_directory=output_directory,
+                                         output_prefix=output_prefix,
+                                         data_type=data_type)
+        if output_directory is None:
+            output_directory = '.'
+        return " ".join(shlex.quote(str(a)) for a in [
+            sys.executable, os.path.abspath(__file__), datafile,
+            '--alpha', meta, '--data-type', data_type,
+            '--max-depth', self.max_depth, '--out', output_directory,
+            '--prefix', output_prefix])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="runs PC on a data or covariance "
+                                     "file, writing causal-cmd style output")
+    parser.add_argument("dataset")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--data-type", choices=['continuous', 'covariance'],
+                        default='continuous')
+    parser.add_argument("--max-depth", type=int, default=-1)
+    parser.add_argument("--out", default=".")
+    parser.add_argument("--prefix", default="results")
+    args = parser.parse_args()
+    NumpyPCBackend(max_depth=args.max_depth).run(args.dataset, meta=args.alpha,
+                                                 output_directory=args.out,
+                                                 output_prefix=args.prefix,
+                                                 data_type=args.data_type)
@@ -2,11 +2,13 @@
 picause:
 """
 
+import array
+import concurrent.futures
+import itertools
 import math
 import numpy
 import os
 import pandas
-import random
 import sys
 import textwrap
 
@@ -181,8 +183,430 @@ def pairlist2arrowstr(E, human_readable=False):
         return s[:-1]
 
 
+# endpoint kinds of the edges in a Graph, indexed by their Tetrad symbol
+EDGE_KINDS = ['-->', '---', '<->', 'o->', 'o-o']
+DIRECTED, UNDIRECTED, BIDIRECTED, PARTIALLY_DIRECTED, NONDIRECTED = range(5)
+
+
+class Graph:
+    """
+    A compact, integer-indexed graph.
+
+    Edges are stored as parallel arrays: sources and targets hold 0-based
+    node indices (int32), and kinds holds each edge's endpoint kind
+    (int8, an index into EDGE_KINDS).  An edge u --- v is stored once,
+    in the orientation it was given.
+
+    Nodes are named x_1 ... x_n unless a list of names is given,
+    so node index i is called "x_{i+1}".
+
+    parameters:
+    ----------
+        num_nodes: the number of nodes in the graph
+        sources: the source index of each edge
+        targets: the target index of each edge
+        kinds: the endpoint kind of each edge. Defaults to all DIRECTED
+        names: optional list of node names
+    """
+
+    def __init__(self, num_nodes, sources=None, targets=None, kinds=None,
+                 names=None):
+        if sources is None:
+            sources = []
+        if targets is None:
+            targets = []
+        self.num_nodes = num_nodes
+        self.sources = numpy.asarray(sources, dtype=numpy.int32)
+        self.targets = numpy.asarray(targets, dtype=numpy.int32)
+        if kinds is None:
+            kinds = numpy.full(len(self.sources), DIRECTED)
+        self.kinds = numpy.asarray(kinds, dtype=numpy.int8)
+        if not len(self.sources) == len(self.targets) == len(self.kinds):
+            raise ValueError('sources, targets and kinds must have equal length')
+        if names is not None and len(names) != num_nodes:
+            raise ValueError('names must have num_nodes entries')
+        self.names = names
+        self._index = None
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __repr__(self):
+        return "Graph({} nodes, {} edges)".format(self.num_nodes, len(self))
+
+    def __eq__(self, other):
+        if not isinstance(other, Graph):
+            return NotImplemented
+        return (self.num_nodes == other.num_nodes
+                and self.get_names() == other.get_names()
+                and self.edge_set() == other.edge_set())
+
+    # --- node names -----------------------------------------------------
+
+    def get_names(self):
+        if self.names is None:
+            return ["x_{}".format(i) for i in range(1, self.num_nodes + 1)]
+        return list(self.names)
+
+    def node_name(self, i):
+        if self.names is None:
+            return "x_{}".format(i + 1)
+        return self.names[i]
+
+    def node_index(self, name):
+        if self.names is None:
+            return int(name[2:]) - 1
+        if self._index is None:
+            self._index = {v: i for i, v in enumerate(self.names)}
+        return self._index[name]
+
+    # --- edge lookup ----------------------------------------------------
+
+    def edge_keys(self, skeleton=False, num_nodes=None):
+        """
+        encodes each edge u, v as the integer u * num_nodes + v.
+        If skeleton is True, the smaller index is always used for u,
+        so both orientations of an adjacency share a key.
+        num_nodes defaults to self.num_nodes; pass a common value when
+        comparing keys between graphs.
+        """
+        if num_nodes is None:
+            num_nodes = self.num_nodes
+        u = self.sources.astype(numpy.int64)
+        v = self.targets.astype(numpy.int64)
+        if skeleton:
+            u, v = numpy.minimum(u, v), numpy.maximum(u, v)
+        return u * num_nodes + v
+
+    def edge_set(self):
+        """ returns the set of (source, target, kind) index triples """
+        return set(zip(self.sources.tolist(), self.targets.tolist(),
+                       self.kinds.tolist()))
+
+    def edge_kind(self, u, v):
+        """
+        returns the kind of the edge stored from index u to index v,
+        or None if there is no such edge.
+        Runs in constant time after the first call.
+        """
+        if self._lookup is None:
+            self._lookup = dict(zip(self.edge_keys().tolist(),
+                                    self.kinds.tolist()))
+        return self._lookup.get(u * self.num_nodes + v)
+
+    def has_edge(self, u, v, kind=None):
+        """ whether an edge from index u to index v (of the given kind) exists """
+        found = self.edge_kind(u, v)
+        return found is not None and (kind is None or found == kind)
+
+    def is_adjacent(self, u, v):
+        """ whether indices u and v are joined by an edge of any kind """
+        return self.has_edge(u, v) or self.has_edge(v, u)
+
+    def select(self, *kinds):
+        """ returns a new Graph holding only the edges of the given kinds """
+        mask = numpy.isin(self.kinds, kinds)
+        return Graph(self.num_nodes, self.sources[mask], self.targets[mask],
+                     self.kinds[mask], self.names)
+
+    def adjacency_matrix(self, kind=None):
+        """
+        returns a (num_nodes x num_nodes) boolean matrix with M[u, v] True
+        for every edge from u to v (of the given kind, if one is given)
+        """
+        M = numpy.zeros((self.num_nodes, self.num_nodes), dtype=bool)
+        mask = slice(None) if kind is None else self.kinds == kind
+        M[self.sources[mask], self.targets[mask]] = True
+        return M
+
+    # --- constructors ---------------------------------------------------
+
+    @classmethod
+    def from_pairlist(cls, E, num_nodes=None, names=None, kind=DIRECTED):
+        """
+        builds a Graph from an edge list of (u, v) name pairs,
+        all of the given kind.
+        If neither num_nodes nor names is given, nodes are assumed to be
+        named x_i, and num_nodes is the largest i found.
+        """
+        graph = cls(0 if names is None else len(names), names=names)
+        sources = [graph.node_index(u) for u, _ in E]
+        targets = [graph.node_index(v) for _, v in E]
+        if num_nodes is None:
+            num_nodes = graph.num_nodes
+            if names is None:
+                num_nodes = max(sources + targets, default=-1) + 1
+        return cls(num_nodes, sources, targets,
+                   numpy.full(len(sources), kind), names)
+
+    @classmethod
+    def from_arrowstr(cls, arrowstr, num_nodes=None, names=None):
+        """
+        builds a Graph from an arrow string, in the form of
+        u1 --> v1, u2 --- v2, ...
+        Any of the endpoint kinds in EDGE_KINDS may appear.
+        """
+        pairs = []
+        kinds = []
+        for edge in arrowstr.split(','):
+            parts = edge.split()
+            if len(parts) != 3:
+                continue
+            u, kind, v = parts
+            pairs.append((u, v))
+            kinds.append(EDGE_KINDS.index(kind))
+        graph = cls.from_pairlist(pairs, num_nodes, names)
+        graph.kinds = numpy.asarray(kinds, dtype=numpy.int8)
+        return graph
+
+    @classmethod
+    def from_adjacencystr(cls, adjacencystr, num_nodes=None, directed=True):
+        """
+        builds a Graph from an adjacency string, in the form xxyyzz;aabbcc...
+        where xx and aa are sources, and yy and zz (etc) are the destinations,
+        as two-hexdigit numbers.
+        directed: whether the edges are directed or undirected
+        """
+        sources = []
+        targets = []
+        for substr in adjacencystr.split(';'):
+            if len(substr) == 0:
+                continue
+            source = int(substr[:2], 16) - 1
+            for k in range(2, len(substr), 2):
+                sources.append(source)
+                targets.append(int(substr[k:k + 2], 16) - 1)
+        if num_nodes is None:
+            num_nodes = max(sources + targets, default=-1) + 1
+        kind = DIRECTED if directed else UNDIRECTED
+        return cls(num_nodes, sources, targets, numpy.full(len(sources), kind))
+
+    # --- exporters ------------------------------------------------------
+
+    def to_pairlist(self):
+        """ returns the edges as a list of (u, v) name pairs """
+        return [(self.node_name(u), self.node_name(v))
+                for u, v in zip(self.sources.tolist(), self.targets.tolist())]
+
+    def to_arrowstr(self):
+        """ returns the edges as an arrow string, u1 --> v1, u2 --- v2, ... """
+        return ", ".join("{} {} {}".format(self.node_name(u), EDGE_KINDS[k],
+                                           self.node_name(v))
+                         for u, v, k in zip(self.sources.tolist(),
+                                            self.targets.tolist(),
+                                            self.kinds.tolist()))
+
+    def to_adjacencystr(self, directed=True):
+        """
+        returns the directed (or the undirected) edges as an
+        adjacency string, grouping targets under their source
+        in order of first appearance, as arrowstr2adjacencystr does.
+        """
+        kind = DIRECTED if directed else UNDIRECTED
+        d = dict()
+        for u, v, k in zip(self.sources.tolist(), self.targets.tolist(),
+                           self.kinds.tolist()):
+            if k == kind:
+                d.setdefault(u, []).append(v)
+        s = ""
+        for u, vs in d.items():
+            s += "{:02X}".format(u + 1)
+            s += "".join("{:02X}".format(v + 1) for v in vs)
+            s += ';'
+        return s
+
+
+def _common_graphs(a, b):
+    """
+    converts a pair of graphs, at least one of them a Graph,
+    into Graphs sharing the node names of the first Graph given.
+    Arrow strings and pair lists are converted; Graphs with other node
+    names are re-indexed by name.
+
+    returns:
+    -------
+        the two Graphs, and a node count large enough to encode
+        the edge keys of both
+    """
+    ref = a if isinstance(a, Graph) else b
+    graphs = []
+    for g in (a, b):
+        if isinstance(g, str):
+            g = Graph.from_arrowstr(g, ref.num_nodes, ref.names)
+        elif not isinstance(g, Graph):
+            g = Graph.from_pairlist(g, ref.num_nodes, ref.names)
+        elif g.names != ref.names:
+            sources = [ref.node_index(g.node_name(u)) for u in g.sources]
+            targets = [ref.node_index(g.node_name(v)) for v in g.targets]
+            g = Graph(ref.num_nodes, sources, targets, g.kinds, ref.names)
+        graphs.append(g)
+    num_nodes = max([g.num_nodes for g in graphs] +
+                    [int(x.max()) + 1 for g in graphs
+                     for x in (g.sources, g.targets) if len(x) > 0])
+    return graphs[0], graphs[1], num_nodes
+
+
+class _NodeIndex(dict):
+    """ maps node names x_i to index i - 1, parsing each name only once """
+
+    def __missing__(self, name):
+        i = self[name] = int(name[2:]) - 1
+        return i
+
+
+def _open_edge_section(f, names):
+    """
+    advances f past its 'Graph Edges:' line, and returns the name to
+    index and endpoint symbol to kind lookups used to parse the edges;
+    raises ValueError if there is no such line, as in the output of a
+    run that died after writing its header
+    """
+    for line in f:
+        if line.startswith('Graph Edges:'):
+            break
+    else:
+        raise ValueError("causal-cmd output has no 'Graph Edges:' section")
+    if names is None:
+        index = _NodeIndex()
+    else:
+        index = {v: i for i, v in enumerate(names)}
+    return index, {k: i for i, k in enumerate(EDGE_KINDS)}
+
+
+def iter_causal_output(f, names=None):
+    """
+    streams the edges out of a causal-cmd output file.
+
+    Lines are read one at a time: everything up to the 'Graph Edges:'
+    line is skipped, and each following line of the form
+    "12. x_3 --> x_17" is yielded until the first blank line.
+    Nothing else in the file is kept.
+
+    parameters:
+    ----------
+        f: a filename, or an open text file
+        names: optional list of node names. By default nodes are
+            assumed to be named x_i, and x_i is given index i - 1.
+
+    yields:
+    ------
+        (source index, target index, kind) triples, where kind
+        indexes EDGE_KINDS
+    """
+    if isinstance(f, (str, os.PathLike)):
+        with open(f) as fh:
+            yield from iter_causal_output(fh, names)
+        return
+
+    index, kinds = _open_edge_section(f, names)
+    for line in f:
+        parts = line.split()
+        if len(parts) < 4:
+            break
+        kind = kinds.get(parts[2])
+        if kind is not None:
+            yield index[parts[1]], index[parts[3]], kind
+
+
+def read_causal_output(f, num_nodes=None, names=None):
+    """
+    reads the discovered graph from a causal-cmd output file into a Graph.
+    The edges of iter_causal_output are written straight into typed
+    arrays; a file without a 'Graph Edges:' section raises ValueError.
+
+    parameters:
+    ----------
+        f: a filename, or an open text file
+        num_nodes: the number of nodes in the graph. If not given, it is
+            len(names), or else the largest node index found.
+        names: optional list of node names (see iter_causal_output)
+    """
+    sources = array.array('i')
+    targets = array.array('i')
+    edge_kinds = array.array('b')
+    for u, v, kind in iter_causal_output(f, names):
+        sources.append(u)
+        targets.append(v)
+        edge_kinds.append(kind)
+
+    sources = numpy.frombuffer(sources, dtype=numpy.int32)
+    targets = numpy.frombuffer(targets, dtype=numpy.int32)
+    if num_nodes is None:
+        num_nodes = len(names) if names is not None else \
+            int(max(sources.max(initial=-1), targets.max(initial=-1))) + 1
+    return Graph(num_nodes, sources, targets,
+                 numpy.frombuffer(edge_kinds, dtype=numpy.int8), names)
+
+
+def write_causal_output(f, graph, header=""):
+    """
+    writes a Graph in the layout of a causal-cmd output file,
+    so that it can be read by read_causal_output and
+    discover.causal_output_to_arrowstr.
+
+    parameters:
+    ----------
+        f: a filename, or an open text file
+        graph: the Graph to write
+        header: optional text to place before the graph
+    """
+    if isinstance(f, (str, os.PathLike)):
+        with open(f, 'w') as fh:
+            return write_causal_output(fh, graph, header)
+    if len(header) > 0:
+        f.write(header.rstrip('\n') + "\n\n")
+    f.write("Graph Nodes:\n")
+    f.write(";".join(graph.get_names()) + "\n\n")
+    f.write("Graph Edges:\n")
+    for i, (u, v, k) in enumerate(zip(graph.sources.tolist(),
+                                      graph.targets.tolist(),
+                                      graph.kinds.tolist())):
+        f.write("{}. {} {} {}\n".format(i + 1, graph.node_name(u),
+                                        EDGE_KINDS[k], graph.node_name(v)))
+    f.write("\n")
+
+
 def discover(df_filename, o_filename, jdir=None, meta=0.1, algorithm='pc',
-             output_directory=None, jar_dir="", verbose=False):
+             output_directory=None, jar_dir="", verbose=False,
+             data_type='continuous'):
+    """
+    runs the causal-cmd jar, with the command line built by
+    discover_command().
+
+    parameters:
+    ----------
+        see discover_command()
+        verbose: outputs the constructed command-line java call to the screen.
+            useful for development.
+
+    returns:
+    -------
+        any output from the command-line java call; a non-zero exit
+        status (such as a JVM out of memory) raises RuntimeError
+    """
+    java_cmd = discover_command(df_filename, o_filename, jdir=jdir, meta=meta,
+                                algorithm=algorithm,
+                                output_directory=output_directory,
+                                jar_dir=jar_dir, data_type=data_type)
+    if verbose:
+        print(java_cmd)
+    pid = os.popen(java_cmd)
+    java_output = pid.read()
+    status = pid.close()
+    if status is not None:
+        raise RuntimeError("causal-cmd exited with status {}: {}".format(
+            os.waitstatus_to_exitcode(status), java_cmd))
+
+    return java_output
+
+
+CAUSAL_CMD_JAR = 'causal-cmd-1.4.1-SNAPSHOT-jar-with-dependencies.jar'
+
+
+def discover_command(df_filename, o_filename, jdir=None, meta=0.1,
+                     algorithm='pc', output_directory=None, jar_dir="",
+                     data_type='continuous'):
     """
     builds a command-line call to the causal-cmd jar.
 
@@ -210,16 +634,17 @@ def discover(df_filename, o_filename, jdir=None, meta=0.1, algorithm='pc',
             should be saved.
             important when conducting parallel runs.
         jar_dir: the directory in which the jar file can be found.
-        verbose: outputs the constructed command-line java call to the screen.
-            useful for development.
+        data_type: 'continuous' for a comma delimited data file,
+            'covariance' for a covariance file, as written by
+            write_covariance()
 
 
     returns:
     -------
-        any output from the command-line java call
+        the shell command, as a string
     """
 
-    javajar = 'causal-cmd-1.4.1-SNAPSHOT-jar-with-dependencies.jar'
+    javajar = CAUSAL_CMD_JAR
 
     # Create directories to contain JVM settings files
     if jdir is None:
@@ -231,9 +656,14 @@ def discover(df_filename, o_filename, jdir=None, meta=0.1, algorithm='pc',
 
     # Build options to send to causal-cmd
     java_opts = " --algorithm {} ".format(algorithm)
-    java_opts += " --data-type continuous"
-    java_opts += " --dataset {}".format(df_filename)
-    java_opts += " --delimiter comma "
+    if data_type == 'covariance':
+        java_opts += " --data-type covariance"
+        java_opts += " --dataset {}".format(df_filename)
+        java_opts += " --delimiter tab "
+    else:
+        java_opts += " --data-type continuous"
+        java_opts += " --dataset {}".format(df_filename)
+        java_opts += " --delimiter comma "
     java_opts += " --prefix {} ".format(o_filename)
 
     # Add options specific to each algorithm
@@ -256,19 +686,142 @@ def discover(df_filename, o_filename, jdir=None, meta=0.1, algorithm='pc',
     else:
         java_opts += " --out {}".format(output_directory)
 
-    java_cmd = java_base_cmd + java_opts
-    if verbose:
-        print(java_cmd)
-    pid = os.popen(java_cmd)
-    java_output = pid.read()
-    pid.close()
+    return java_base_cmd + java_opts
 
-    return java_output
+
+class RunningCovariance:
+    """
+    Sufficient statistics of a growing dataset: the row count, the mean
+    and the centered cross-product matrix, updated a block of rows at a
+    time with the pairwise (Chan et al.) merge.  Adding dn rows costs
+    O(dn p^2), so the covariance of each of a nested series of prefixes
+    is available without revisiting earlier rows.
+
+    parameters:
+    ----------
+        num_vars: the number of columns p
+    """
+
+    def __init__(self, num_vars):
+        self.n = 0
+        self.mean = numpy.zeros(num_vars)
+        self.cross = numpy.zeros((num_vars, num_vars))
+
+    def update(self, block):
+        """ adds the rows of the (dn x p) array block """
+        block = numpy.asarray(block, dtype=float)
+        dn = len(block)
+        if dn == 0:
+            return
+        block_mean = block.mean(axis=0)
+        centered = block - block_mean
+        delta = block_mean - self.mean
+        total = self.n + dn
+        self.cross += centered.T @ centered
+        self.cross += numpy.outer(delta, delta) * (self.n * dn / total)
+        self.mean += delta * (dn / total)
+        self.n = total
+
+    def covariance(self):
+        """ the unbiased sample covariance matrix of the rows so far """
+        return self.cross / (self.n - 1)
+
+
+def write_covariance(fname, cov, n, names):
+    """
+    writes a covariance matrix in the layout causal-cmd reads with
+    --data-type covariance --delimiter tab: the sample size, then the
+    tab-separated variable names, then the lower triangle of the matrix.
+
+    parameters:
+    ----------
+        fname: the file to write
+        cov: the (p x p) covariance matrix
+        n: the number of samples it was computed from
+        names: the p variable names
+    """
+    with open(fname, 'w') as f:
+        f.write("{}\n".format(n))
+        f.write("\t".join(names) + "\n")
+        for i in range(len(names)):
+            f.write("\t".join(repr(float(x)) for x in cov[i, :i + 1]) + "\n")
+
+
+def read_covariance(fname):
+    """
+    reads a covariance file written by write_covariance.
+
+    returns:
+    -------
+        the covariance matrix, the sample size, and the variable names
+    """
+    with open(fname) as f:
+        n = int(f.readline())
+        names = f.readline().split()
+        cov = numpy.zeros((len(names), len(names)))
+        for i in range(len(names)):
+            cov[i, :i + 1] = [float(x) for x in f.readline().split()]
+    cov = numpy.tril(cov) + numpy.tril(cov, -1).T
+    return cov, n, names
+
+
+class CausalCmdBackend:
+    """
+    A discovery backend that runs each search through the causal-cmd jar,
+    using discover().
+
+    A discovery backend is any object with a run() method taking the
+    arguments below (data_type being 'continuous' or 'covariance'),
+    which leaves the discovered graph in
+    output_directory/output_prefix.txt, in causal-cmd's output layout,
+    and returns it as a Graph.
+    A backend whose searches run as separate processes may also have a
+    command() method, taking the same arguments and returning the shell
+    command that does the search.
+
+    parameters:
+    ----------
+        jar_dir: the directory in which the jar file can be found.
+    """
+
+    # identifies the searches a backend runs, for caching their results
+    # (see discoverycache.py)
+    version = CAUSAL_CMD_JAR
+
+    def __init__(self, jar_dir=""):
+        self.jar_dir = jar_dir
+
+    def run(self, datafile, algorithm='pc', meta=0.1, jdir=None,
+            output_directory=None, output_prefix='results',
+            data_type='continuous'):
+        """
+        runs the discovery algorithm on datafile, and returns the
+        discovered graph as a Graph. See discover() for the parameters.
+        """
+        outfile = "{}/{}.txt".format(output_directory, output_prefix)
+        _ = discover(datafile, output_prefix, jdir=jdir, meta=meta,
+                     algorithm=algorithm, output_directory=output_directory,
+                     jar_dir=self.jar_dir, data_type=data_type)
+        return read_causal_output(outfile)
+
+    def command(self, datafile, algorithm='pc', meta=0.1, jdir=None,
+                output_directory=None, output_prefix='results',
+                data_type='continuous'):
+        """
+        returns the shell command that run() would execute, for running
+        it elsewhere (see asyncrunner); the command leaves the graph in
+        output_directory/output_prefix.txt
+        """
+        return discover_command(datafile, output_prefix, jdir=jdir, meta=meta,
+                                algorithm=algorithm,
+                                output_directory=output_directory,
+                                jar_dir=self.jar_dir, data_type=data_type)
 
 
 def discovery_results(sem, datafile, jdir=None, meta=0.1, dgraphfile="",
                       write=True, algorithm='pc', output_directory=None,
-                      output_prefix=None):
+                      output_prefix=None, backend=None, as_graph=False,
+                      data_type='continuous'):
     """
     runs a causal discovery algorithm on a datafile,
     saves the discovered graph, and returns a the discovered graph in
@@ -288,6 +841,13 @@ def discovery_results(sem, datafile, jdir=None, meta=0.1, dgraphfile="",
         output_directory: the path to the directory where the output file shall
             be placed
         output_prefix: the name of the output file (not including the .txt)
+        backend: the discovery backend to run the algorithm with.
+            Defaults to a CausalCmdBackend; see pcalg.NumpyPCBackend
+            for an in-process alternative.
+        as_graph: return the whole discovered graph as a Graph, rather
+            than an arrow string of its directed edges
+        data_type: 'continuous' if datafile holds observations,
+            'covariance' if it is a covariance file (see write_covariance)
 
     returns:
     --------
@@ -296,24 +856,21 @@ def discovery_results(sem, datafile, jdir=None, meta=0.1, dgraphfile="",
 
     if output_prefix is None:
         output_prefix = "results"
-    outfile = "{}/{}.txt".format(output_directory, output_prefix)
-    print(outfile)
+    if backend is None:
+        backend = CausalCmdBackend()
+    print("{}/{}.txt".format(output_directory, output_prefix))
     # run the discovery algorithm
-    _ = discover(datafile, output_prefix, jdir=jdir, meta=meta,
-                 algorithm=algorithm, output_directory=output_directory)
-    with open(outfile, 'r') as f:
-        results = f.readlines()
-    results_s = ""
-    for r in results[results.index('Graph Edges:\n') + 1:]:
-        if '-->' not in r:
-            continue
-        results_s += r.split(". ")[1][:-1] + ', '
-    results_s = results_s[:-2]
+    graph = backend.run(datafile, algorithm=algorithm, meta=meta, jdir=jdir,
+                        output_directory=output_directory,
+                        output_prefix=output_prefix, data_type=data_type)
+    results_s = graph.select(DIRECTED).to_arrowstr()
     if write:
         with open(dgraphfile, 'w') as f:
             f.write(results_s)
 #   discovered_graph = arrowstr2pairlist(results_s)
 #   return confusion_matrix(len(sem.V), sem.E, discovered_graph)
+    if as_graph:
+        return graph
     return results_s
 
 
@@ -323,9 +880,15 @@ def oriented_confusion_matrix(tg, dg, retval="dict", verbose=False):
     __________
         tg: an arrow string of edges representing the true graph
         dg: a string of edges representing the discovered graph
+            Either may instead be a Graph, in which case the scoring is done
+            on integer edge keys without any string handling.
         retval: which to return, a dictionary of the scores, or the edges
     """
 
+    if retval not in ["tuple", "dict", "edges"]:
+        raise ValueError('retval only takes values {tuple, edges}')
+    if isinstance(tg, Graph) or isinstance(dg, Graph):
+        return _oriented_confusion_graphs(tg, dg, retval, verbose)
     if type(tg) != str:
         raise ValueError('tg must be a string')
     if len(tg) > 0 and "-->" not in tg and "---" not in tg:
@@ -334,8 +897,6 @@ def oriented_confusion_matrix(tg, dg, retval="dict", verbose=False):
         raise ValueError('dg must be an arrow string')
     if type(dg) != str:
         raise ValueError('dg must be a string')
-    if retval not in ["tuple", "dict", "edges"]:
-        raise ValueError('retval only takes values {tuple, edges}')
 
     # make true_edges into a list
     true_edges = set(arrowstr2pairlist(tg))
@@ -388,7 +949,66 @@ def oriented_confusion_matrix(tg, dg, retval="dict", verbose=False):
         return d
 
 
+def _oriented_confusion_graphs(tg, dg, retval="dict", verbose=False):
+    """
+    oriented_confusion_matrix for Graph arguments.
+    Only the --> and --- edges of dg are considered, as with arrow strings.
+    """
+    tg, dg, n = _common_graphs(tg, dg)
+    true_keys = numpy.unique(tg.edge_keys(num_nodes=n))
+    u, v = true_keys // n, true_keys % n
+    reversed_keys = v * n + u
+
+    directed = dg.select(DIRECTED).edge_keys(num_nodes=n)
+    undirected = dg.select(UNDIRECTED).edge_keys(skeleton=True, num_nodes=n)
+
+    tp = numpy.isin(true_keys, directed)
+    fp = ~tp & numpy.isin(reversed_keys, directed)
+    skeleton_keys = numpy.minimum(u, v) * n + numpy.maximum(u, v)
+    fn = fp | (~tp & numpy.isin(skeleton_keys, undirected))
+
+    results = {'oriented_TP': int(tp.sum())}
+    results['oriented_FP'] = int(fp.sum())
+    results['oriented_FN'] = int(fn.sum())
+    if verbose:
+        print("\n-- Oriented Confusion Matrix --")
+        print(results)
+        print("--------------------\n\n")
+
+    if retval == 'tuple' or retval == 'dict':
+        return results
+
+    def names(mask, flip=False):
+        pairs = zip(u[mask].tolist(), v[mask].tolist())
+        if flip:
+            return [(tg.node_name(b), tg.node_name(a)) for a, b in pairs]
+        return [(tg.node_name(a), tg.node_name(b)) for a, b in pairs]
+
+    return {'TP': names(tp), 'FP': names(fp, flip=True), 'FN': names(fn)}
+
+
 def confusion_matrix(num_nodes, true_e, test_e):
+    """
+    scores a discovered graph's adjacencies against the true graph.
+
+    parameters:
+    ----------
+        num_nodes: the number of nodes in the graph
+        true_e: the true edges, as a list of (u, v) pairs or a Graph
+        test_e: the discovered edges, as a list of (u, v) pairs or a Graph
+
+    returns:
+    -------
+        the tuple (TP, FP, FN, TN)
+    """
+    if isinstance(true_e, Graph) or isinstance(test_e, Graph):
+        true_g, test_g, n = _common_graphs(true_e, test_e)
+        found = numpy.intersect1d(true_g.edge_keys(skeleton=True, num_nodes=n),
+                                  test_g.edge_keys(skeleton=True, num_nodes=n))
+        M = [len(found), len(test_g) - len(found), len(true_g) - len(found)]
+        M.append((num_nodes * (num_nodes-1) // 2) - sum(M))
+        return tuple(M)
+
     true_positives = []
 
     M = [0] * 4
@@ -413,6 +1033,92 @@ def confusion_matrix(num_nodes, true_e, test_e):
     return tuple(M)
 
 
+def graphs2masks(graphs, num_nodes):
+    """
+    stacks K discovered Graphs into boolean adjacency tensors,
+    for use with batch_confusion_matrix.
+
+    parameters:
+    ----------
+        graphs: a sequence of K Graphs, all named like the true graph
+        num_nodes: the number of nodes p
+
+    returns:
+    -------
+        directed, undirected: two (K x p x p) boolean arrays, with
+        directed[k, u, v] True for an edge u --> v in graph k, and
+        undirected[k, u, v] True for an edge u --- v in graph k.
+        Edges of other kinds are dropped.
+    """
+    directed = numpy.zeros((len(graphs), num_nodes, num_nodes), dtype=bool)
+    undirected = numpy.zeros_like(directed)
+    for mask, kind in [(directed, DIRECTED), (undirected, UNDIRECTED)]:
+        selected = [g.kinds == kind for g in graphs]
+        k = numpy.repeat(numpy.arange(len(graphs)),
+                         [int(sel.sum()) for sel in selected])
+        u = numpy.concatenate([g.sources[sel] for g, sel in zip(graphs, selected)]
+                              + [numpy.zeros(0, dtype=numpy.int32)])
+        v = numpy.concatenate([g.targets[sel] for g, sel in zip(graphs, selected)]
+                              + [numpy.zeros(0, dtype=numpy.int32)])
+        mask[k, u, v] = True
+    return directed, undirected
+
+
+def batch_confusion_matrix(true_graph, directed, undirected):
+    """
+    scores a stack of K discovered graphs against one true graph
+    in a single vectorized pass.
+
+    The counts match confusion_matrix and oriented_confusion_matrix
+    for each discovered graph, given that no pair of nodes is listed twice
+    as undirected (u --- v and v --- u).
+
+    parameters:
+    ----------
+        true_graph: the generating graph, as a Graph or a
+            (p x p) boolean matrix of its directed edges
+        directed: (K x p x p) boolean tensor of discovered u --> v edges
+        undirected: (K x p x p) boolean tensor of discovered u --- v edges,
+            in either or both orientations
+
+    returns:
+    -------
+        a dictionary of integer arrays of length K, with keys
+        skeletal_TP, skeletal_FP, skeletal_FN, skeletal_TN,
+        oriented_TP, oriented_FP and oriented_FN
+    """
+    directed = numpy.asarray(directed, dtype=bool)
+    undirected = numpy.asarray(undirected, dtype=bool)
+    num_nodes = directed.shape[-1]
+    if isinstance(true_graph, Graph):
+        true_graph = true_graph.adjacency_matrix()
+    T = numpy.asarray(true_graph, dtype=bool)
+    upper = numpy.triu(numpy.ones((num_nodes, num_nodes), dtype=bool), 1)
+
+    directed_t = directed.transpose(0, 2, 1)
+    undirected_sym = undirected | undirected.transpose(0, 2, 1)
+    true_skeleton = (T | T.T) & upper
+    found_skeleton = (directed | directed_t | undirected_sym) & upper
+
+    results = dict()
+    tp = (found_skeleton & true_skeleton).sum(axis=(1, 2))
+    num_found = directed.sum(axis=(1, 2)) + (undirected_sym & upper).sum(axis=(1, 2))
+    results['skeletal_TP'] = tp
+    results['skeletal_FP'] = num_found - tp
+    results['skeletal_FN'] = T.sum() - tp
+    results['skeletal_TN'] = ((num_nodes * (num_nodes - 1) // 2)
+                              - num_found - results['skeletal_FN'])
+
+    oriented_tp = directed & T
+    oriented_fp = ~directed & directed_t & T
+    unoriented = ~directed & ~directed_t & undirected_sym & T
+    results['oriented_TP'] = oriented_tp.sum(axis=(1, 2))
+    results['oriented_FP'] = oriented_fp.sum(axis=(1, 2))
+    results['oriented_FN'] = (results['oriented_FP']
+                              + unoriented.sum(axis=(1, 2)))
+    return results
+
+
 def int2pairlist(i, len_V):
     if len_V == 20:
         M = numpy.array(list(format(bin(i), "0400b")),dtype=numpy.uint8).reshape(20,20)
@@ -427,9 +1133,171 @@ def int2pairlist(i, len_V):
     return E
 
 
+def topological_order_indices(parents):
+    """
+    Kahn's algorithm over integer node indices.
+
+    Ties are broken the way the original pass-based ordering did it:
+    nodes are grouped into passes, where a node joins the first pass in
+    which all of its parents have already been placed, counting parents
+    with a lower index placed earlier in the same pass, and each pass is
+    listed in index order.  Keeping this order keeps the data generated
+    for a given seed unchanged.
+
+    parameters:
+    ----------
+        parents: a list whose i-th entry is a list of the indices
+            of the parents of node i
+
+    returns:
+    -------
+        a list of node indices in topological order
+    """
+    num_nodes = len(parents)
+    children = [[] for _ in range(num_nodes)]
+    indegree = [len(p) for p in parents]
+    for child, node_parents in enumerate(parents):
+        for parent in node_parents:
+            children[parent].append(child)
+
+    passnum = [0] * num_nodes
+    ready = [v for v in range(num_nodes) if indegree[v] == 0]
+    num_placed = 0
+    while len(ready) > 0:
+        u = ready.pop()
+        num_placed += 1
+        for v in children[u]:
+            passnum[v] = max(passnum[v], passnum[u] + (u > v))
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                ready.append(v)
+    if num_placed < num_nodes:
+        raise ValueError('graph contains a cycle')
+
+    buckets = [[] for _ in range(max(passnum, default=0) + 1)]
+    for v in range(num_nodes):
+        buckets[passnum[v]].append(v)
+    return [v for bucket in buckets for v in bucket]
+
+
+def random_dag_edges(num_nodes, num_edges, rng, max_indegree=9):
+    """
+    draws num_edges distinct edges i --> j, i < j, over num_nodes nodes,
+    none of which has more than max_indegree parents.
+
+    Candidate edges are drawn by index into the p(p - 1)/2 forward pairs
+    with rng, a batch at a time, and a candidate is skipped if it was
+    already drawn or its target is already full, so the cap holds by
+    construction and the expected cost is O(num_edges) as long as the
+    graph is not close to the most edges the cap allows.
+    Unlike rejecting whole graphs, this does not make every valid graph
+    equally likely; graphs where a few targets fill up are favoured
+    slightly.
+
+    parameters:
+    ----------
+        num_nodes: the number of nodes p
+        num_edges: the number of edges to draw
+        rng: a numpy.random.Generator
+        max_indegree: the largest number of parents a node may have
+
+    returns:
+    -------
+        sources, targets: int arrays of the edges, in the order drawn
+        attempts: the number of candidate edges drawn
+    """
+    num_pairs = num_nodes * (num_nodes - 1) // 2
+    capacity = sum(min(j, max_indegree) for j in range(num_nodes))
+    if num_edges > capacity:
+        raise ValueError("{} nodes with at most {} parents each allow at most {} edges"
+                         .format(num_nodes, max_indegree, capacity))
+
+    indegree = [0] * num_nodes
+    taken = set()
+    sources, targets = [], []
+    attempts = 0
+    while len(sources) < num_edges:
+        needed = num_edges - len(sources)
+        k = rng.integers(0, num_pairs, size=needed + needed // 4 + 16)
+        # the pairs with target j hold the indices j(j - 1)/2 ... j(j + 1)/2 - 1
+        j = ((1 + numpy.sqrt(1 + 8 * k.astype(float))) / 2).astype(numpy.int64)
+        j -= (j * (j - 1) // 2 > k)
+        j += ((j + 1) * j // 2 <= k)
+        i = k - j * (j - 1) // 2
+        for k_, i_, j_ in zip(k.tolist(), i.tolist(), j.tolist()):
+            attempts += 1
+            if k_ in taken or indegree[j_] >= max_indegree:
+                continue
+            taken.add(k_)
+            indegree[j_] += 1
+            sources.append(i_)
+            targets.append(j_)
+            if len(sources) == num_edges:
+                break
+    return numpy.array(sources, dtype=int), numpy.array(targets, dtype=int), attempts
+
+
+def implied_residuals(B):
+    """
+    computes, for a stack of weighted adjacency matrices at once, the
+    residual variance 1 - b^T Sigma b of every variable of the
+    unit-variance model each one implies; the batched form of
+    StructuralEquationDagModel.make_residual_array().
+
+    parameters:
+    ----------
+        B: a (K x p x p) array, B[k, i, j] being the coefficient of the
+            edge i --> j in the k-th model
+
+    returns:
+    -------
+        a (K x p) array of residual variances. A model that is not
+        realizable with unit variances has a negative (or nan) entry.
+    """
+    B = numpy.asarray(B, dtype=float)
+    identity = numpy.broadcast_to(numpy.identity(B.shape[-1]), B.shape)
+    T = numpy.linalg.solve(identity - B, identity)
+    omega = numpy.linalg.solve(numpy.swapaxes(T * T, -1, -2),
+                               numpy.ones(B.shape[:-1])[..., None])[..., 0]
+    Sigma = (numpy.swapaxes(T, -1, -2) * omega[..., None, :]) @ T
+    return 1 - ((Sigma @ B) * B).sum(axis=-2)
+
+
+# rows per block of the 'philox' data streams; part of what defines the
+# data, so changing it changes every philox dataset
+PHILOX_BLOCK = 4096
+
+
+class _PhiloxNoise:
+    """
+    The noise of one variable in one row block, drawn from its own
+    Philox substream: the key comes from the model's seed, and the
+    counter from the variable's column and the block, so that no two
+    (variable, block) pairs share draws.  Stands in for a Generator in
+    StructuralEquationDagModel._fill_rows, filling out with the draws
+    from offset on.
+    """
+
+    def __init__(self, key, column, block, offset=0):
+        self.key = key
+        self.column = column
+        self.block = block
+        self.offset = offset
+
+    def standard_normal(self, out):
+        bit_generator = numpy.random.Philox(key=self.key,
+                                            counter=[0, 0, self.block, self.column])
+        draws = numpy.random.Generator(bit_generator).standard_normal(self.offset + len(out))
+        out[:] = draws[self.offset:]
+
+
 class Model:
     def __init__(self, num_var=None, V=None, E=None,
                  seed=None, num_edges=None):
+        if isinstance(E, Graph):
+            if V is None and num_var is None:
+                V = E.get_names()
+            E = E.to_pairlist()
         self.seed = seed
         self.E = E
         self.V = V
@@ -445,10 +1313,29 @@ class Model:
 
 
 class StructuralEquationDagModel(Model):
+    """
+    A linear Gaussian structural equation model on a DAG.
+
+    data_rng chooses how the noise of generated data is drawn:
+    'sequential' (the default) draws it from self.rng, one variable
+    after another, so a row can only be had by generating everything
+    before it; 'philox' draws the noise of each variable in each block
+    of PHILOX_BLOCK rows from its own counter-based substream of the
+    seed, so any rows can be generated on their own, in any order and
+    on any number of workers, with the same result (see generate_rows).
+    The two modes give different data for the same seed.
+    """
+
     def __init__(self, num_var=None, V=None, E=None, seed=None, num_edges=None,
-                 make_model=True, beta=math.sqrt(0.1)):
+                 make_model=True, beta=math.sqrt(0.1), data_rng='sequential'):
         super().__init__(num_var=num_var, V=V, E=E,
                          seed=seed, num_edges=num_edges)
+        if data_rng not in ['sequential', 'philox']:
+            raise ValueError("data_rng only takes values {sequential, philox}")
+        self.data_rng = data_rng
+        self._topological_order = None
+        self._stream_cache = None
+        self._philox_key = None
         if self.E is None and self.V is not None:
             self.E = self.make_random_graph(self.V, rng=self.rng,
                                             num_edges=num_edges)
@@ -474,8 +1361,18 @@ class StructuralEquationDagModel(Model):
         s += self.get_model_str()
         return s
 
+    def get_graph(self):
+        """ returns the edges of the model as a Graph over self.V """
+        names = self.V
+        if names == ["x_{}".format(i) for i in range(1, len(names) + 1)]:
+            names = None
+        return Graph.from_pairlist(self.E, len(self.V), names)
+
     def set_E(self, new_E):
+        if isinstance(new_E, Graph):
+            new_E = new_E.to_pairlist()
         self.E = new_E
+        self._topological_order = None
         self.num_edges = len(new_E)
         self.make_sem_im()
 
@@ -488,14 +1385,315 @@ class StructuralEquationDagModel(Model):
             s += "({:1.3f})e\n".format(self.residual[var])
         return s
 
-    def generate_data(self, num_data_points=100):
-        df = pandas.DataFrame()
+    def get_weight_matrix(self):
+        """
+        returns the weighted adjacency matrix B of the model as a numpy
+        array, where B[i, j] is the coefficient of the edge V[i] --> V[j]
+        (zero if there is no edge).
+        Rows and columns follow the order of self.V.
+        """
+        index = {v: i for i, v in enumerate(self.V)}
+        B = numpy.zeros((len(self.V), len(self.V)))
+        for var, parents in self.model.items():
+            for parent, coef in parents.items():
+                B[index[parent], index[var]] = coef
+        return B
+
+    def generate_data(self, num_data_points=100, output='dataframe',
+                      dtype=numpy.float64):
+        """
+        draws num_data_points observations from the model.
+
+        All noise is drawn into a single preallocated (n x p) array, and
+        the structural equations are then applied in topological order,
+        each variable's column accumulating its weighted parent columns
+        in place.
+
+        Reproducibility: the noise for each variable is drawn from
+        self.rng as num_data_points standard normals, one variable at a time
+        in topological order (the order of self.residual), and scaled by the
+        square root of the variable's residual variance.  Parents are then
+        added in the order of self.model[var].  This consumes the generator,
+        and rounds, exactly as earlier versions of this method did, so a
+        given seed yields the same data.
+        With data_rng 'philox' the rows are those of generate_rows(0,
+        num_data_points), and self.rng is left alone.
+
+        parameters:
+        ----------
+            num_data_points: the number of rows to generate
+            output: 'dataframe' returns a pandas DataFrame with columns
+                self.V, 'array' returns the raw (n x p) numpy array,
+                with columns in the order of self.V
+            dtype: the dtype of the returned values.
+                Data are always computed in float64;
+                numpy.float32 returns that result rounded to single
+                precision, so it matches the float64 output for a given seed.
+
+        returns:
+        -------
+            the generated data, as a DataFrame or ndarray
+        """
+        if output not in ['dataframe', 'array']:
+            raise ValueError("output only takes values {dataframe, array}")
+
+        if self.data_rng == 'philox':
+            return self.generate_rows(0, num_data_points, output, dtype)
+        # the transpose of a Fortran-ordered (n x p) array is a C-ordered
+        # (p x n) array, so each variable's column is contiguous
+        data = numpy.empty((num_data_points, len(self.V)), order='F')
+        self._fill_rows(data, self._structural_equations(),
+                        itertools.repeat(self.rng))
+        return self._format_data(data, output, dtype)
+
+    def generate_rows(self, start, stop, output='array', dtype=numpy.float64,
+                      workers=1):
+        """
+        generates rows start to stop (exclusive) of the model's 'philox'
+        data on their own, without the rows before them.
+
+        Each block of PHILOX_BLOCK rows is filled from its variables'
+        substreams (see _PhiloxNoise) and then the structural equations,
+        independently of the others, so the rows are the same whatever
+        the range they are generated in and however many workers run.
+        Row i is also the same whatever the size of the dataset, so every
+        sample size is a prefix of the same data.
+
+        parameters:
+        ----------
+            start, stop: the range of rows
+            output, dtype: as in generate_data
+            workers: the number of threads filling blocks at once
+
+        returns:
+        -------
+            the rows, as a DataFrame (indexed by row number) or ndarray
+        """
+        if self.data_rng != 'philox':
+            raise ValueError("only data_rng 'philox' data can be generated from any row")
+        if output not in ['dataframe', 'array']:
+            raise ValueError("output only takes values {dataframe, array}")
+        if self._philox_key is None:
+            self._philox_key = numpy.random.SeedSequence(self.seed).generate_state(
+                2, numpy.uint64)
+        equations = self._structural_equations()
+        data = numpy.empty((stop - start, len(self.V)), order='F')
+
+        def fill(block):
+            begin = max(start, block * PHILOX_BLOCK)
+            end = min(stop, (block + 1) * PHILOX_BLOCK)
+            offset = begin - block * PHILOX_BLOCK
+            self._fill_rows(data[begin - start:end - start], equations,
+                            [_PhiloxNoise(self._philox_key, j, block, offset)
+                             for j, *_ in equations])
+
+        blocks = range(start // PHILOX_BLOCK, -(-stop // PHILOX_BLOCK)) if stop > start else []
+        if workers > 1 and len(blocks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                list(executor.map(fill, blocks))
+        else:
+            for block in blocks:
+                fill(block)
+        rows = self._format_data(data, output, dtype)
+        if output == 'dataframe':
+            rows.index = pandas.RangeIndex(start, stop)
+        return rows
+
+    def iter_data(self, num_data_points=100, chunk_size=10000, num_rows=None,
+                  output='dataframe', dtype=numpy.float64, workers=1):
+        """
+        yields the rows generate_data(num_data_points) would return if it
+        were called now, in blocks of at most chunk_size rows, so that only
+        one block is held in memory at a time.
+
+        Before the first block, one pass is made over the generator,
+        discarding draws, to find where each variable's noise begins in
+        self.rng's stream; each variable then continues from its own saved
+        position block by block.  The output is therefore the same whatever
+        the chunk size.  self.rng itself is not advanced, so repeated calls
+        yield the same rows.
+        With data_rng 'philox' each block comes from generate_rows, with no
+        such pass.
+
+        parameters:
+        ----------
+            num_data_points: the size of the dataset being generated
+            chunk_size: the largest number of rows in a block
+            num_rows: only the first num_rows rows are generated,
+                i.e. the prefix of the num_data_points dataset.
+                Defaults to all of them.
+            output, dtype: as in generate_data
+            workers: with data_rng 'philox', the threads generating
+                each block (see generate_rows)
+
+        yields:
+        ------
+            consecutive blocks of rows, as DataFrames or ndarrays
+        """
+        if output not in ['dataframe', 'array']:
+            raise ValueError("output only takes values {dataframe, array}")
+        if num_rows is None:
+            num_rows = num_data_points
+        if num_rows > num_data_points:
+            raise ValueError("num_rows cannot exceed num_data_points")
+
+        if self.data_rng == 'philox':
+            for start in range(0, num_rows, chunk_size):
+                yield self.generate_rows(start, min(start + chunk_size, num_rows),
+                                         output, dtype, workers)
+            return
+        equations = self._structural_equations()
+        generators = self._noise_streams(num_data_points)
+        for start in range(0, num_rows, chunk_size):
+            size = min(chunk_size, num_rows - start)
+            data = numpy.empty((size, len(self.V)), order='F')
+            self._fill_rows(data, equations, generators)
+            block = self._format_data(data, output, dtype)
+            if output == 'dataframe':
+                block.index = pandas.RangeIndex(start, start + size)
+            yield block
+
+    def write_data(self, fname, num_data_points=100, chunk_size=10000,
+                   num_rows=None, dtype=numpy.float64, workers=1):
+        """
+        streams the rows of iter_data() to a file, one block at a time.
+
+        The format follows the file extension:
+            .csv writes the same text as generate_data().to_csv(fname,
+                index=False), header included
+            .npy writes a numpy array file, of the given dtype,
+                readable with numpy.load (optionally memory-mapped)
+
+        parameters:
+        ----------
+            fname: the file to write
+            other parameters: as in iter_data
+        """
+        if num_rows is None:
+            num_rows = num_data_points
+        blocks = self.iter_data(num_data_points, chunk_size, num_rows,
+                                output='array', dtype=dtype, workers=workers)
+        if fname.endswith('.npy'):
+            out = numpy.lib.format.open_memmap(fname, mode='w+', dtype=dtype,
+                                               shape=(num_rows, len(self.V)))
+            start = 0
+            for block in blocks:
+                out[start:start + len(block)] = block
+                start += len(block)
+            out.flush()
+            del out
+        elif fname.endswith('.csv'):
+            with open(fname, 'w', newline='') as f:
+                f.write(",".join(self.V) + "\n")
+                for block in blocks:
+                    pandas.DataFrame(block, columns=self.V, copy=False).to_csv(
+                        f, index=False, header=False)
+        else:
+            raise ValueError("fname must end in .csv or .npy")
+
+    def iter_covariances(self, num_data_points, sample_sizes, chunk_size=10000,
+                         workers=1):
+        """
+        yields the sample covariance matrix of each of a nested series of
+        prefixes of the dataset iter_data(num_data_points) streams, updating
+        running sums as the prefix grows, so each row is generated and
+        reduced only once and no more than one block is held in memory.
+
+        parameters:
+        ----------
+            num_data_points: the size of the full dataset
+            sample_sizes: the prefix lengths, each at most num_data_points
+            chunk_size: the largest number of rows generated at a time
+            workers: as in iter_data
+
+        yields:
+        ------
+            (samples, covariance) for each sample size, in increasing order
+        """
+        sample_sizes = sorted(sample_sizes)
+        stats = RunningCovariance(len(self.V))
+        blocks = self.iter_data(num_data_points, chunk_size,
+                                num_rows=sample_sizes[-1], output='array',
+                                workers=workers)
+        pending = numpy.empty((0, len(self.V)))
+        for samples in sample_sizes:
+            while stats.n < samples:
+                if len(pending) == 0:
+                    pending = next(blocks)
+                take = min(len(pending), samples - stats.n)
+                stats.update(pending[:take])
+                pending = pending[take:]
+            yield samples, stats.covariance()
+
+    def _structural_equations(self):
+        """
+        lists (column, noise scale, parent columns, parent weights) for each
+        variable, in the order generate_data draws their noise
+        """
+        index = {v: i for i, v in enumerate(self.V)}
+        B = self.get_weight_matrix()
+        equations = []
         for var in self.residual:
-            df[var] = self.rng.normal(0, math.sqrt(self.residual[var]),
-                                      num_data_points)
-            for parent in self.model[var]:
-                df[var] += self.model[var][parent] * df[parent]
-        return df[self.V]
+            j = index[var]
+            parents = [index[p] for p in self.model[var]]
+            equations.append((j, math.sqrt(self.residual[var]), parents,
+                              B[parents, j]))
+        return equations
+
+    @staticmethod
+    def _fill_rows(data, equations, generators):
+        """
+        fills the Fortran-ordered array data with draws from the model,
+        drawing each variable's noise from the matching generator
+        """
+        columns = data.T
+        scratch = numpy.empty(len(data))
+        for (j, scale, parents, weights), rng in zip(equations, generators):
+            rng.standard_normal(out=columns[j])
+            columns[j] *= scale
+            # parents are added one at a time, elementwise, so every value
+            # is computed the same way whatever the number of rows
+            for k, weight in zip(parents, weights):
+                numpy.multiply(columns[k], weight, out=scratch)
+                columns[j] += scratch
+
+    def _format_data(self, data, output, dtype):
+        if dtype != numpy.float64:
+            data = data.astype(dtype, order='F')
+        if output == 'array':
+            return data
+        return pandas.DataFrame(data, columns=self.V, copy=False)
+
+    def _noise_streams(self, num_data_points, chunk_size=65536):
+        """
+        returns a Generator per variable, in self.residual order, positioned
+        where generate_data(num_data_points) would start drawing that
+        variable's noise from self.rng's current state.
+        The positions are found by drawing and discarding, and are cached
+        for the current state and num_data_points.
+        """
+        bit_generator_type = type(self.rng.bit_generator)
+        state = self.rng.bit_generator.state
+        key = (num_data_points, repr(state))
+        if self._stream_cache is None or self._stream_cache[0] != key:
+            bit_generator = bit_generator_type()
+            bit_generator.state = state
+            rng = numpy.random.Generator(bit_generator)
+            discard = numpy.empty(min(chunk_size, num_data_points))
+            states = []
+            for _ in self.residual:
+                states.append(bit_generator.state)
+                for start in range(0, num_data_points, chunk_size):
+                    size = min(chunk_size, num_data_points - start)
+                    rng.standard_normal(out=discard[:size])
+            self._stream_cache = (key, states)
+
+        generators = []
+        for state in self._stream_cache[1]:
+            bit_generator = bit_generator_type()
+            bit_generator.state = state
+            generators.append(numpy.random.Generator(bit_generator))
+        return generators
 
     def get_topological_order(self, model=None, as_string=False):
         """
@@ -503,31 +1701,28 @@ class StructuralEquationDagModel(Model):
         of the nodes.
         ((A Topolocial ordering is a (potentially nonunique) ordering where no
           later node can be a parent of an earlier node.))
+
+        The order of self.model is computed once and cached;
+        set_E() and make_sem_pm() clear the cache.
         """
-        if model is None:
-            model = self.model
-        var_order = []
-        remaining_vars = list(model.keys())
-        while len(remaining_vars) > 0:
-            for v in remaining_vars:
-                ready_flag = True
-                for parent in model[v].keys():
-                    ready_flag &= (parent in var_order)
-                if ready_flag:
-                    var_order.append(v)
-            for v in var_order:
-                if v in remaining_vars:
-                    remaining_vars.remove(v)
+        if model is None or model is self.model:
+            if self._topological_order is None:
+                self._topological_order = self._sort_model(self.model)
+            var_order = self._topological_order
+        else:
+            var_order = self._sort_model(model)
 
         if as_string:
-            s = ""
-            for v in var_order:
-                s += v
-                if var_order.index(v) < len(var_order) - 1:
-                    s += " < "
-            return s
+            return " < ".join(var_order)
         else:
-            return var_order
+            return list(var_order)
+
+    @staticmethod
+    def _sort_model(model):
+        variables = list(model.keys())
+        index = {v: i for i, v in enumerate(variables)}
+        parents = [[index[p] for p in model[v]] for v in variables]
+        return [variables[i] for i in topological_order_indices(parents)]
 
     def make_cov_matrix(self, verbose=False):
         variables = self.get_topological_order()
@@ -543,8 +1738,8 @@ class StructuralEquationDagModel(Model):
                     cov_sum = 0.0
                     for parent in parents_u:
                         cov_sum += self.model[u][parent] * cov_matrix[parent][prior_var]
-                    cov_matrix[prior_var][u] = cov_sum
-                    cov_matrix[u][prior_var] = cov_sum
+                    cov_matrix.at[u, prior_var] = cov_sum
+                    cov_matrix.at[prior_var, u] = cov_sum
         if verbose:
             print('Heres the implied covariance matrix:')
             print(cov_matrix)
@@ -552,10 +1747,56 @@ class StructuralEquationDagModel(Model):
 
         return cov_matrix
 
+    def make_cov_array(self, B=None):
+        """
+        computes the implied covariance matrix in closed form.
+
+        Writing the model as X = XB + e, with B the weighted adjacency matrix
+        from get_weight_matrix() and e ~ N(0, Omega), the implied covariance
+        is Sigma = (I - B)^-T Omega (I - B)^-1.  Each variable is scaled to
+        unit variance, so the diagonal of Omega solves the triangular system
+        (T * T)^T omega = 1, where T = (I - B)^-1.
+
+        Gives the same matrix as make_cov_matrix(), as a numpy array with
+        rows and columns in the order of self.V.
+        """
+        if B is None:
+            B = self.get_weight_matrix()
+        identity = numpy.identity(len(B))
+        T = numpy.linalg.solve(identity - B, identity)
+        omega = numpy.linalg.solve((T * T).T, numpy.ones(len(B)))
+        return (T.T * omega) @ T
+
+    def make_residual_array(self, M=None, B=None):
+        """
+        computes the residual variance 1 - b^T Sigma b of every variable,
+        where b is the variable's column of edge weights in B,
+        as a numpy array in the order of self.V.
+
+        parameters:
+        ----------
+            M: the implied covariance matrix, as returned by make_cov_array.
+                computed if not given.
+            B: the weighted adjacency matrix. computed if not given.
+        """
+        if B is None:
+            B = self.get_weight_matrix()
+        if M is None:
+            M = self.make_cov_array(B)
+        return 1 - ((M @ B) * B).sum(axis=0)
+
     def make_implied_model(self, beta):
         self.make_sem_im(beta=beta)
-        self.implied_cov_matrix = self.make_cov_matrix()
-        self.make_residuals(self.implied_cov_matrix)
+        B = self.get_weight_matrix()
+        cov = self.make_cov_array(B)
+        self.implied_cov_matrix = pandas.DataFrame(cov, index=self.V,
+                                                   columns=self.V)
+        residuals = self.make_residual_array(cov, B)
+        # self.residual is kept in topological order,
+        # which is the order generate_data() draws noise in
+        index = {v: i for i, v in enumerate(self.V)}
+        self.residual = {v: residuals[index[v]]
+                         for v in self.get_topological_order()}
 
     def make_residuals(self, M, verbose=True):
         """
@@ -563,7 +1804,7 @@ class StructuralEquationDagModel(Model):
         and their residual, or "leftover", or "free", variance
         """
         self.residual = {}
-        variable_order = self.get_topological_order(self.model)
+        variable_order = self.get_topological_order()
         for variable in variable_order:
             parents = list(self.model[variable].keys())
             parent_matrix = M.loc[parents, parents].copy()
@@ -578,6 +1819,7 @@ class StructuralEquationDagModel(Model):
             Does not assign edge weights
         """
         self.model = {v: {} for v in self.V}
+        self._topological_order = None
         for parent, node in self.E:
             self.model[node][parent] = None
 
@@ -592,33 +1834,34 @@ class StructuralEquationDagModel(Model):
                 self.model[node][parent] = beta
 
     def test_residual_overflow(self):
-        return min(self.residual.values()) < 0
+        return bool(self.make_residual_array().min() < 0)
 
-    def make_random_graph(self, V=None, avg_deg=2.0, num_edges=None, rng=None):
-        """ Given a list of vertices, return a list of pairs representing
-            a set of directed edges """
+    def make_random_graph(self, V=None, avg_deg=2.0, num_edges=None, rng=None,
+                          max_indegree=9):
+        """
+        Given a list of vertices, return a list of pairs representing
+        a set of directed edges, drawn with random_dag_edges() over a
+        random ordering of V, so that no vertex has more than
+        max_indegree parents.
+        The number of candidate edges drawn is kept in self.graph_attempts.
+
+        parameters:
+        ----------
+            V: the vertices; defaults to self.V
+            avg_deg: the number of edges per vertex, if num_edges is None
+            num_edges: the number of edges
+            rng: the numpy Generator to draw with; defaults to self.rng
+            max_indegree: the largest number of parents a vertex may have
+        """
         if V is None:
             V = self.V
         if rng is None:
-            rng = numpy.random.default_rng()
-        V_canonical = V.copy()
-        rng.shuffle(V_canonical)
-        indegrees = {v: 0 for v in V}
+            rng = self.rng
+        V_canonical = [V[i] for i in rng.permutation(len(V))]
         if num_edges is None:
             num_edges = int(len(V) * avg_deg)
 
-        graph_done = False
-        while not graph_done:
-            graph_done = True
-            indegrees = {v: 0 for v in V}
-            possibles = []
-            for i in range(0, len(V_canonical) - 1):
-                for j in range(i+1, len(V_canonical)):
-                    possibles.append((V_canonical[i], V_canonical[j]))
-            E = random.sample(possibles, num_edges)
-            for u, v in E:
-                indegrees[v] += 1
-                if indegrees[v] > 9:
-                    graph_done = False
-
-        return E
+        sources, targets, self.graph_attempts = random_dag_edges(
+            len(V), num_edges, rng, max_indegree)
+        return [(V_canonical[u], V_canonical[v])
+                for u, v in zip(sources.tolist(), targets.tolist())]
@@ -0,0 +1,212 @@
+"""
+powersearch:
+finds the smallest sample size at which a discovery algorithm reaches a
+target mean oriented (or adjacency) sensitivity or precision on a
+configuration, rather than running every size of the fixed grid.
+
+The metric at a sample size n is its mean over a set of replicate
+graphs, each discovered from the first n rows of its own dataset (the
+same rows at every n, so that the metric moves with n and not with the
+draw).  power_search() brackets the answer by growing n geometrically
+from min_samples until the target is met, then bisects on the log scale
+until the bracket is within the relative tolerance, evaluating each
+size at most once.
+
+Run as a script on a graph bank (see graphbank.py), e.g.
+
+    python powersearch.py bank.npz --nodes 20 --edges 30 --r 0.3 --replicates 20 \
+        --algorithm pc --meta 0.01 --metric oriented_sensitivity --target 0.8
+"""
+
+import argparse
+import discover
+import graphbank
+import math
+import os
+import pandas
+import picause
+import process_simdata
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+
+
+@dataclass
+class PowerSearchResult:
+    """ The outcome of a search: samples is the smallest size found to
+    meet the target (None if max_samples does not), lower the largest
+    size found not to (None if min_samples meets it), and evaluations
+    the (samples, value) pairs in the order they were run """
+    metric: str
+    target: float
+    samples: int
+    lower: int
+    evaluations: list = field(default_factory=list)
+
+
+def power_search(evaluate, target, metric='oriented_sensitivity', min_samples=50,
+                 max_samples=102400, tolerance=0.1, growth=4):
+    """
+    searches for the smallest sample size whose metric meets target,
+    assuming the metric grows with the sample size.
+
+    parameters:
+    ----------
+        evaluate: a function from a sample size to the metric there
+        target: the value the metric must reach
+        metric: the name of the metric, for the result
+        min_samples, max_samples: the sizes searched between
+        tolerance: the search stops once upper / lower <= 1 + tolerance
+        growth: the factor the size grows by while bracketing
+
+    returns:
+    -------
+        a PowerSearchResult
+    """
+    values = dict()
+    result = PowerSearchResult(metric, target, None, None)
+
+    def meets(samples):
+        if samples not in values:
+            values[samples] = evaluate(samples)
+            result.evaluations.append((samples, values[samples]))
+        return values[samples] >= target
+
+    # bracket: grow until the target is met or max_samples is not enough
+    samples = min_samples
+    while not meets(samples):
+        result.lower = samples
+        if samples >= max_samples:
+            return result
+        samples = min(int(samples * growth), max_samples)
+    result.samples = samples
+
+    # bisect on the log scale
+    while result.lower is not None and result.samples / result.lower > 1 + tolerance:
+        middle = int(round(math.sqrt(result.lower * result.samples)))
+        if middle <= result.lower or middle >= result.samples:
+            break
+        if meets(middle):
+            result.samples = middle
+        else:
+            result.lower = middle
+    return result
+
+
+class ReplicateEvaluator:
+    """
+    Evaluates a metric at a sample size over replicate graphs, with the
+    discover.py sweep's data files, discovery runs and scores.
+
+    parameters:
+    ----------
+        replicates: a list of discover.argsClass, one per graph, giving
+            its graph, seed, algorithm, meta, backend and data_type
+        metric: a column of process_simdata.add_metrics, such as
+            oriented_sensitivity or oriented_precision
+        dirname: the working directory; defaults to a temporary one,
+            removed by close()
+        max_samples: the size of each replicate's dataset, of which
+            every evaluated size is a prefix
+    """
+
+    def __init__(self, replicates, metric='oriented_sensitivity', dirname=None,
+                 max_samples=102400):
+        self.replicates = replicates
+        self.metric = metric
+        self.max_samples = max_samples
+        self.temporary = dirname is None
+        self.dirname = tempfile.mkdtemp() if dirname is None else dirname
+        self.sems = [picause.StructuralEquationDagModel(
+            num_var=args.nodes, E=picause.adjacencystr2pairlist(args.graph),
+            beta=args.r, make_model=True, seed=args.seed, data_rng=args.data_rng)
+            for args in replicates]
+        self.backends = dict()
+        self.results = []
+
+    def _backend(self, name):
+        if name not in self.backends:
+            self.backends[name] = discover.make_backend(name)
+        return self.backends[name]
+
+    def __call__(self, samples):
+        """ the mean metric over the replicates at samples; every run's
+        results row is kept in self.results """
+        rows = []
+        for i, (args, sem) in enumerate(zip(self.replicates, self.sems)):
+            jobdir = os.path.join(self.dirname, 'replicate{}'.format(i))
+            os.makedirs(jobdir, exist_ok=True)
+            for n, datafile in discover.sample_datafiles(sem, [samples], self.max_samples,
+                                                         jobdir, args.data_type):
+                task = (0, n, datafile, args.algorithm, args.meta)
+                rows.append(discover.discovery_task(args, task, jobdir,
+                                                    self._backend(args.backend)))
+                os.remove(datafile)
+        runs = process_simdata.add_metrics(pandas.concat(rows, ignore_index=True))
+        self.results.append(runs)
+        return float(runs[self.metric].astype(float).mean())
+
+    def close(self):
+        for backend in self.backends.values():
+            if hasattr(backend, 'close'):
+                backend.close()
+        if self.temporary:
+            shutil.rmtree(self.dirname, ignore_errors=True)
+
+
+def bank_replicates(bank, nodes, edges, r, replicates, algorithm='pc', meta=0.01,
+                    backend='causal-cmd', data_type='covariance', cache=None):
+    """ the argsClass of the first replicates graphs of a configuration
+    in a graphbank.GraphBank; cache is an optional discovery cache
+    directory (see discoverycache.py) """
+    replicate_args = []
+    for graphnum in range(1, replicates + 1):
+        graph, seed = bank.get(nodes, edges, r, graphnum)
+        replicate_args.append(discover.argsClass(
+            nodes, r, graphnum, graph.to_adjacencystr(), seed, graphnum,
+            algorithm=algorithm, meta=meta, backend=backend, data_type=data_type,
+            cache=cache))
+    return replicate_args
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="searches for the sample size "
+                                     "meeting a target metric")
+    parser.add_argument("bank")
+    parser.add_argument("--nodes", type=int, required=True)
+    parser.add_argument("--edges", type=int, required=True)
+    parser.add_argument("--r", type=float, required=True)
+    parser.add_argument("--replicates", type=int, default=20)
+    parser.add_argument("--algorithm", default='pc')
+    parser.add_argument("--meta", type=float, default=0.01)
+    parser.add_argument("--metric", default='oriented_sensitivity',
+                        choices=['oriented_sensitivity', 'oriented_precision',
+                                 'adjacency_sensitivity', 'adjacency_precision'])
+    parser.add_argument("--target", type=float, default=0.8)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--min-samples", type=int, default=50)
+    parser.add_argument("--max-samples", type=int, default=102400)
+    parser.add_argument("--backend", choices=['causal-cmd', 'numpy'],
+                        default='causal-cmd')
+    parser.add_argument("--data-type", choices=['covariance', 'continuous'],
+                        default='covariance')
+    parser.add_argument("--cache", default=None, help="a discovery cache directory, "
+                        "so that repeated searches rerun nothing (see discoverycache.py)")
+    parser.add_argument("--output", default=None, help="csv for every run's results")
+    args = parser.parse_args()
+    evaluator = ReplicateEvaluator(
+        bank_replicates(graphbank.GraphBank(args.bank), args.nodes, args.edges, args.r,
+                        args.replicates, args.algorithm, args.meta, args.backend,
+                        args.data_type, args.cache),
+        args.metric, max_samples=args.max_samples)
+    try:
+        result = power_search(evaluator, args.target, args.metric, args.min_samples,
+                              args.max_samples, args.tolerance)
+    finally:
+        evaluator.close()
+    for samples, value in result.evaluations:
+        print("{}\t{:.3f}".format(samples, value))
+    print("{} >= {}: samples {} (not met at {})".format(args.metric, args.target,
+                                                       result.samples, result.lower))
+    if args.output is not None:
+        pandas.concat(evaluator.results, ignore_index=True).to_csv(args.output, index=False)
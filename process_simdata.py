@@ -1,66 +1,322 @@
+"""
+process_simdata:
+summarizes discovery results by configuration.
+
+summarize() groups the runs by (nodes, edges, samples, r,
+metaparameter, algorithm) in one pass and gives, for every group, the
+number of runs, the mean runtime and, for each metric, its mean and the
+order statistics bounding the central level of its values (low and high).
+With bootstrap > 0 it adds a percentile bootstrap confidence interval
+for each mean, resampling the runs of every group at once.
+
+For results too large to load at once, PartialSummary keeps only
+per-group state, built a chunk at a time and mergeable across chunks,
+shards and worker processes: run counts, sums, and for each metric a
+histogram of its values at the 3 decimals the summary reports, from
+which the same low and high order statistics are exact.  Its memory
+depends on the number of groups (and distinct values), not of runs;
+summarize_files() streams csv files or results-store shards through it.
+
+Run as a script on a results csv or a results store directory, e.g.
+
+    python process_simdata.py ~/SimDec22Summary/results/ --bootstrap 1000 --output summary.csv
+    python process_simdata.py master_results.csv.gz --stream --workers 4
+"""
+
+import argparse
+import concurrent.futures
+import os
 import pandas
 import numpy
+import resultstore
+
+GROUP_COLUMNS = ['nodes', 'edges', 'samples', 'r', 'metaparameter', 'algorithm']
+
+METRICS = ['oriented_TP', 'oriented_FP', 'oriented_FN', 'oriented_precision',
+           'oriented_sensitivity', 'adjacency_TP', 'adjacency_FP',
+           'adjacency_FN', 'adjacency_TN', 'adjacency_precision',
+           'adjacency_sensitivity', 'adjacency_specificity']
+
+
+def add_metrics(df):
+    """ renames the skeletal counts to adjacency counts and adds the
+    precision, sensitivity and specificity columns, in a copy of df """
+    df = df.rename(columns={'skeletal_TP': 'adjacency_TP',
+                            'skeletal_FN': 'adjacency_FN',
+                            'skeletal_FP': 'adjacency_FP',
+                            'skeletal_TN': 'adjacency_TN'})
+    with numpy.errstate(all='ignore'):
+        df['oriented_precision'] = df.oriented_TP / (df.oriented_TP + df.oriented_FP)
+        df['oriented_sensitivity'] = df.oriented_TP / (df.oriented_TP + df.oriented_FN)
+        df['adjacency_precision'] = df.adjacency_TP / (df.adjacency_TP + df.adjacency_FP)
+        df['adjacency_sensitivity'] = df.adjacency_TP / (df.adjacency_TP + df.adjacency_FN)
+        df['adjacency_specificity'] = df.adjacency_TN / (df.adjacency_TN + df.adjacency_FP)
+    return df
+
+
+def bootstrap_means(values, starts, sizes, reps, level=0.95, seed=0,
+                    max_elements=2 ** 24):
+    """
+    percentile bootstrap intervals for the column means of each group of
+    rows, for every group and column at once.
+
+    parameters:
+    ----------
+        values: a (rows, columns) array, its rows sorted by group;
+            NaNs are left out of the means
+        starts, sizes: the first row and number of rows of each group
+        reps: the number of bootstrap resamples
+        level: the coverage of the intervals
+        seed: the seed of the resampling
+        max_elements: resampled values held in memory at a time
+
+    returns:
+    -------
+        low, high: (groups, columns) arrays of interval bounds
+    """
+    rng = numpy.random.default_rng(seed)
+    rows, columns = values.shape
+    group_of_row = numpy.repeat(numpy.arange(len(sizes)), sizes)
+    block = max(1, max_elements // max(1, rows * columns))
+    means = []
+    for begin in range(0, reps, block):
+        count = min(block, reps - begin)
+        # each resampled row is drawn from the rows of its own group
+        source = starts[group_of_row] + (rng.random((count, rows))
+                                         * sizes[group_of_row]).astype(numpy.int64)
+        sample = values[source]
+        present = ~numpy.isnan(sample)
+        sums = numpy.add.reduceat(numpy.where(present, sample, 0.0), starts, axis=1)
+        counts = numpy.add.reduceat(present, starts, axis=1)
+        with numpy.errstate(all='ignore'):
+            means.append(sums / counts)
+    means = numpy.concatenate(means)
+    tail = (1 - level) / 2
+    return (numpy.nanquantile(means, tail, axis=0),
+            numpy.nanquantile(means, 1 - tail, axis=0))
+
+
+def summarize(df, level=0.95, bootstrap=0, seed=0, metrics=None):
+    """
+    summarizes the runs of df, a results table as discover.py writes it,
+    by configuration.
+
+    parameters:
+    ----------
+        df: the results
+        level: the central share of each metric's values bounded by its
+            low and high columns, and the coverage of bootstrap intervals
+        bootstrap: the number of bootstrap resamples for the confidence
+            intervals of the means; 0 for none
+        seed: the seed of the bootstrap
+        metrics: the metric columns to summarize; defaults to METRICS
+
+    returns:
+    -------
+        a DataFrame with a row per configuration: its GROUP_COLUMNS,
+        nruns, mean_runtime, and low_, mean_ and high_ columns for every
+        metric (with mean_<metric>_ci_low and _ci_high for a bootstrap)
+    """
+    metrics = METRICS if metrics is None else metrics
+    if 'adjacency_TP' not in df:
+        df = add_metrics(df)
+    df = df.sort_values(GROUP_COLUMNS, kind='stable').reset_index(drop=True)
+    df[metrics] = df[metrics].astype(float)
+    tail = (1 - level) / 2
+    grouped = df.groupby(GROUP_COLUMNS, sort=False, dropna=False)
+
+    results = grouped.size().rename('nruns').to_frame()
+    results['mean_runtime'] = grouped['runtime'].mean().round(3)
+    low = grouped[metrics].quantile(tail, interpolation='lower')
+    mean = grouped[metrics].mean()
+    high = grouped[metrics].quantile(1 - tail, interpolation='higher')
+    for c in metrics:
+        results['low_{}'.format(c)] = low[c].round(3)
+        results['mean_{}'.format(c)] = mean[c].round(3)
+        results['high_{}'.format(c)] = high[c].round(3)
+
+    if bootstrap > 0:
+        sizes = results['nruns'].to_numpy()
+        starts = numpy.concatenate([[0], numpy.cumsum(sizes)[:-1]])
+        ci_low, ci_high = bootstrap_means(df[metrics].to_numpy(), starts, sizes,
+                                          bootstrap, level, seed)
+        for j, c in enumerate(metrics):
+            results['mean_{}_ci_low'.format(c)] = ci_low[:, j].round(3)
+            results['mean_{}_ci_high'.format(c)] = ci_high[:, j].round(3)
+    return results.reset_index()
+
+
+_VALUE_OFFSET = 2 ** 31
+
+
+class PartialSummary:
+    """
+    Mergeable per-group state for summarizing results a chunk at a time;
+    table() gives the summarize() table (without bootstrap intervals).
+
+    Groups are numbered as they are first seen.  Each group keeps its
+    run count and the sums and counts of runtime and of each metric, and
+    each metric keeps sorted (group, value) codes with their counts.
+
+    parameters:
+    ----------
+        metrics: the metric columns to summarize; defaults to METRICS
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = METRICS if metrics is None else metrics
+        self.keys = []
+        self.index = dict()
+        self.totals = numpy.zeros((0, 3 + 2 * len(self.metrics)))
+        self.histograms = {c: (numpy.zeros(0, numpy.int64), numpy.zeros(0, numpy.int64))
+                           for c in self.metrics}
+
+    def _group_ids(self, keys):
+        """ the numbers of the groups with the given key tuples, adding
+        any not seen before """
+        # missing key values compare equal as None, unlike NaN
+        keys = [tuple(None if isinstance(v, float) and numpy.isnan(v) else v for v in key)
+                for key in keys]
+        for key in keys:
+            if key not in self.index:
+                self.index[key] = len(self.keys)
+                self.keys.append(key)
+        if len(self.keys) > len(self.totals):
+            self.totals = numpy.vstack([self.totals, numpy.zeros(
+                (len(self.keys) - len(self.totals), self.totals.shape[1]))])
+        return numpy.array([self.index[key] for key in keys], dtype=numpy.int64)
+
+    def _add_counts(self, c, codes, counts):
+        """ adds counts of (group, value) codes to metric c's histogram """
+        old_codes, old_counts = self.histograms[c]
+        codes, inverse = numpy.unique(numpy.concatenate([old_codes, codes]),
+                                      return_inverse=True)
+        counts = numpy.bincount(inverse, numpy.concatenate([old_counts, counts]))
+        self.histograms[c] = codes, counts.astype(numpy.int64)
+
+    def add(self, df):
+        """ adds the runs of the results chunk df """
+        if 'adjacency_TP' not in df:
+            df = add_metrics(df)
+        grouped = df.groupby(GROUP_COLUMNS, sort=False, dropna=False)
+        groups = self._group_ids(list(grouped.size().index))[grouped.ngroup().to_numpy()]
+
+        values = df[self.metrics].to_numpy(float)
+        present = ~numpy.isnan(values)
+        runtime = df['runtime'].to_numpy(float)
+        columns = [numpy.ones(len(df)), numpy.nan_to_num(runtime), ~numpy.isnan(runtime)]
+        for j in range(len(self.metrics)):
+            columns += [numpy.where(present[:, j], values[:, j], 0.0), present[:, j]]
+        for k, column in enumerate(columns):
+            self.totals[:, k] += numpy.bincount(groups, column, minlength=len(self.keys))
+
+        for j, c in enumerate(self.metrics):
+            rows = present[:, j]
+            codes = (groups[rows] << 32) + (numpy.round(values[rows, j] * 1000)
+                                            .astype(numpy.int64) + _VALUE_OFFSET)
+            codes, counts = numpy.unique(codes, return_counts=True)
+            self._add_counts(c, codes, counts)
+        return self
+
+    def merge(self, other):
+        """ adds the state of another PartialSummary """
+        groups = self._group_ids(other.keys)
+        self.totals[groups] += other.totals
+        for c in self.metrics:
+            codes, counts = other.histograms[c]
+            self._add_counts(c, (groups[codes >> 32] << 32) + (codes & (2 ** 32 - 1)), counts)
+        return self
+
+    @staticmethod
+    def _order_statistics(codes, counts, num_groups, q, upper):
+        """ the lower (or upper) q quantile of each group's values from
+        its sorted histogram, as summarize() takes it """
+        groups = codes >> 32
+        values = ((codes & (2 ** 32 - 1)) - _VALUE_OFFSET) / 1000
+        totals = numpy.bincount(groups, counts, minlength=num_groups)
+        above = numpy.cumsum(counts) - numpy.concatenate([[0], numpy.cumsum(totals)])[groups]
+        position = (totals[groups] - 1) * q
+        k = numpy.ceil(position - 1e-9) if upper else numpy.floor(position + 1e-9)
+        chosen = (above > k) & (above - counts <= k)
+        result = numpy.full(num_groups, numpy.nan)
+        result[groups[chosen]] = values[chosen]
+        return result
+
+    def table(self, level=0.95):
+        """ the summary table, as summarize(df, level) gives it """
+        tail = (1 - level) / 2
+        results = pandas.DataFrame(self.keys, columns=GROUP_COLUMNS)
+        results['nruns'] = self.totals[:, 0].astype(int)
+        with numpy.errstate(all='ignore'):
+            results['mean_runtime'] = (self.totals[:, 1] / self.totals[:, 2]).round(3)
+            for j, c in enumerate(self.metrics):
+                codes, counts = self.histograms[c]
+                results['low_{}'.format(c)] = self._order_statistics(
+                    codes, counts, len(self.keys), tail, False)
+                results['mean_{}'.format(c)] = (self.totals[:, 3 + 2 * j]
+                                                / self.totals[:, 4 + 2 * j]).round(3)
+                results['high_{}'.format(c)] = self._order_statistics(
+                    codes, counts, len(self.keys), 1 - tail, True)
+        return results.sort_values(GROUP_COLUMNS).reset_index(drop=True)
+
+
+def _summarize_file(fname, chunksize, metrics):
+    """ the PartialSummary of one file; run in a worker process """
+    partial = PartialSummary(metrics)
+    for chunk in pandas.read_csv(fname, chunksize=chunksize):
+        partial.add(chunk)
+    return partial
+
+
+def summarize_files(fnames, chunksize=100000, workers=1, metrics=None):
+    """
+    summarizes results csv files, such as results-store shards, reading
+    each chunksize rows at a time, workers files at a time, and merging
+    their partial summaries.
+
+    returns:
+    -------
+        the merged PartialSummary; call table() for the summary
+    """
+    summary = PartialSummary(metrics)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for partial in executor.map(_summarize_file, fnames,
+                                        [chunksize] * len(fnames), [metrics] * len(fnames)):
+                summary.merge(partial)
+    else:
+        for fname in fnames:
+            summary.merge(_summarize_file(fname, chunksize, metrics))
+    return summary
+
+
+def read_results(path):
+    """ reads a results csv, or every shard of a results store directory
+    (see resultstore.py) """
+    if os.path.isdir(path):
+        return resultstore.ResultsStore(path).read()
+    return pandas.read_csv(path)
+
 
-rfile = '~/SimDec22Summary/master_results.csv.gz'
-df = pandas.read_csv(rfile, compression='gzip')
-df.rename(columns={'skeletal_TP': 'adjacency_TP',
-                   'skeletal_FN': 'adjacency_FN',
-                   'skeletal_FP': 'adjacency_FP',
-                   'skeletal_TN': 'adjacency_TN'}, inplace=True)
-
-df['oriented_precision'] = df.oriented_TP / (df.oriented_TP + df.oriented_FP)
-df['oriented_sensitivity'] = df.oriented_TP / (df.oriented_TP + df.oriented_FN)
-df['adjacency_precision'] = df.adjacency_TP / (df.adjacency_TP + df.adjacency_FP)
-df['adjacency_sensitivity'] = df.adjacency_TP / (df.adjacency_TP + df.adjacency_FN)
-df['adjacency_specificity'] = df.adjacency_TN / (df.adjacency_TN + df.adjacency_FP)
-
-result_cols = ['nodes', 'edges', 'metaparameter', 'r',
-               'samples', 'nruns', 'mean_runtime', 'algorithm']
-results = {x: [] for x in result_cols}
-
-for c in ['oriented_TP', 'oriented_FP', 'oriented_FN', 'oriented_precision',
-          'oriented_sensitivity', 'adjacency_TP', 'adjacency_FP',
-          'adjacency_FN', 'adjacency_TN', 'adjacency_precision',
-          'adjacency_sensitivity', 'adjacency_specificity']:
-    for m in ['low', 'mean', 'high']:
-        results["{}_{}".format(m, c)] = []
-
-vc = df[['nodes', 'edges', 'samples', 'r', 'metaparameter', 'algorithm']].value_counts()
-for t in vc.index:
-#   param_cols = ['nodes', 'edges', 'samples', 'r', 'metaparameter', 'algorithm']
-    nodes, edges, samples, r, meta, algorithm = t
-    results['nodes'].append(nodes)
-    results['edges'].append(edges)
-    results['samples'].append(samples)
-    results['r'].append(r)
-    results['metaparameter'].append(meta)
-    results['algorithm'].append(algorithm)
-    results['nruns'].append(500)
-
-    subdf = df.loc[(df.nodes == nodes) & (df.edges == edges) &
-                   (df.metaparameter == meta) & (df.r == r) &
-                   (df.samples == samples) & df.algorithm == algorithm]
-
-    results['mean_runtime'].append(round(subdf['runtime'].mean(), 3))
-    for c in ['oriented_TP', 'oriented_FP', 'oriented_FN',
-              'oriented_precision', 'oriented_sensitivity',
-              'adjacency_TP', 'adjacency_FP', 'adjacency_FN',
-              'adjacency_TN', 'adjacency_precision',
-              'adjacency_sensitivity', 'adjacency_specificity']:
-        alpha_idx = int(round(len(subdf) * 0.025, 0))
-        if subdf[c].count() > alpha_idx:
-            val_list = subdf[c].sort_values(na_position='first', ascending=True).round(3)
-            val_list.reset_index(inplace=True)
-
-            valname = 'low_{}'.format(c)
-            val = val_list[alpha_idx]
-            results[valname].append(val)
-
-            valname = 'high_{}'.format(c)
-            val = val_list[val_list.index.max() - alpha_idx]
-            results[valname].append(val)
-
-            valname = 'mean_{}'.format(c)
-            val = round(val_list.mean(), 3)
-            results[valname].append(val)
-resultsdf = pandas.DataFrame(results)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="summarizes discovery results")
+    parser.add_argument("results", nargs='?', default='~/SimDec22Summary/master_results.csv.gz',
+                        help="a results csv, or a results store directory")
+    parser.add_argument("--level", type=float, default=0.95)
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="bootstrap resamples for confidence intervals of the means")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true",
+                        help="summarize a chunk at a time, without bootstrap intervals")
+    parser.add_argument("--chunksize", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes streaming files (or store shards) at once")
+    parser.add_argument("--output", default='summary.csv')
+    args = parser.parse_args()
+    path = os.path.expanduser(args.results)
+    if args.stream:
+        fnames = resultstore.ResultsStore(path).shards() if os.path.isdir(path) else [path]
+        summary = summarize_files(fnames, args.chunksize, args.workers).table(args.level)
+    else:
+        summary = summarize(read_results(path), args.level, args.bootstrap, args.seed)
+    summary.to_csv(args.output, index=False)
@@ -0,0 +1,158 @@
+"""
+resourcemodel:
+predicts the walltime and memory of discovery work from the results of
+earlier jobs, so that submissions ask SLURM for what they need rather
+than for fixed limits.
+
+Runtime is fitted, per algorithm, as a log-linear model of nodes,
+edges and samples,
+
+    log(runtime) = b0 + b1 log(nodes) + b2 log(edges + 1) + b3 log(samples)
+
+on the 'runtime' of every successful run, and memory the same way, with
+nodes and edges only, on the per-job peak 'maxrss_mb' discover.py
+records.  A prediction is the fitted value scaled by the given quantile
+of the fit's residuals, then by a safety factor, so that most work
+finishes inside its request.  Until there are enough results, the
+fixed defaults the submitters used before are returned instead.
+
+pack() then bins work by predicted runtime into allocations of a given
+length, largest first, so an array task's time limit can be close to
+what its commands take.
+"""
+
+import heapq
+import math
+import numpy
+
+COLUMNS = ['nodes', 'edges', 'samples', 'algorithm', 'runtime', 'maxrss_mb', 'outcome']
+
+DEFAULT_RUNTIME = {'pc': 60, 'fges': 1200, 'grasp': 1200}
+DEFAULT_MEMORY = 4096
+
+
+def _fit(X, y, quantile):
+    """ least squares of log(y) on X, with the quantile of the residuals """
+    coefficients, *_ = numpy.linalg.lstsq(X, numpy.log(y), rcond=None)
+    residuals = numpy.log(y) - X @ coefficients
+    return coefficients, float(numpy.quantile(residuals, quantile))
+
+
+def _features(nodes, edges, samples=None):
+    nodes = numpy.atleast_1d(numpy.asarray(nodes, dtype=float))
+    columns = [numpy.ones_like(nodes), numpy.log(nodes),
+               numpy.log(numpy.asarray(edges, dtype=float) + 1) * numpy.ones_like(nodes)]
+    if samples is not None:
+        columns.append(numpy.log(numpy.asarray(samples, dtype=float)) * numpy.ones_like(nodes))
+    return numpy.column_stack(columns)
+
+
+class ResourceModel:
+    """
+    Runtime and memory predictions for discovery runs.
+
+    parameters:
+    ----------
+        quantile: the residual quantile predictions are raised to
+        safety: a further factor applied to every prediction
+        min_runs: the fewest results a model is fitted to
+        default_runtime: seconds per run of each algorithm without a fit
+        default_memory: MB per job without a fit
+    """
+
+    def __init__(self, quantile=0.95, safety=1.25, min_runs=20,
+                 default_runtime=None, default_memory=DEFAULT_MEMORY):
+        self.quantile = quantile
+        self.safety = safety
+        self.min_runs = min_runs
+        self.default_runtime = dict(DEFAULT_RUNTIME if default_runtime is None
+                                    else default_runtime)
+        self.default_memory = default_memory
+        self.runtime = dict()
+        self.memory = None
+
+    def fit(self, results):
+        """
+        fits the models to a results DataFrame with the columns in
+        COLUMNS, such as ResultsStore.read(columns=COLUMNS) gives;
+        runs that failed or timed out are left out.
+
+        returns:
+        -------
+            the model itself
+        """
+        if 'outcome' in results:
+            results = results[results.outcome.isna() | (results.outcome == 'ok')]
+        runs = results[results.runtime > 0]
+        for algorithm, rows in runs.groupby('algorithm'):
+            if len(rows) >= self.min_runs:
+                self.runtime[algorithm] = _fit(_features(rows.nodes, rows.edges, rows.samples),
+                                               rows.runtime.to_numpy(float), self.quantile)
+        if 'maxrss_mb' in results:
+            jobs = results[results.maxrss_mb > 0]
+            if len(jobs) >= self.min_runs:
+                self.memory = _fit(_features(jobs.nodes, jobs.edges),
+                                   jobs.maxrss_mb.to_numpy(float), self.quantile)
+        return self
+
+    def predict_runtime(self, nodes, edges, samples, algorithm):
+        """ the seconds to request for runs of algorithm, as an array
+        over the (broadcast) nodes, edges and samples """
+        if algorithm not in self.runtime:
+            default = self.default_runtime.get(algorithm, max(self.default_runtime.values()))
+            return numpy.full(len(_features(nodes, edges, samples)), float(default))
+        coefficients, margin = self.runtime[algorithm]
+        X = _features(nodes, edges, samples)
+        return numpy.exp(X @ coefficients + margin) * self.safety
+
+    def predict_memory(self, nodes, edges, default=None):
+        """ the MB to request for jobs on graphs of nodes and edges;
+        default, if given, replaces default_memory """
+        if self.memory is None:
+            default = self.default_memory if default is None else default
+            return numpy.full(len(_features(nodes, edges)), float(default))
+        coefficients, margin = self.memory
+        return numpy.exp(_features(nodes, edges) @ coefficients + margin) * self.safety
+
+    def job_runtime(self, nodes, edges, runs, workers=1):
+        """
+        the seconds to request for a job of the (samples, algorithm)
+        runs on one graph, workers of them running at once
+        """
+        total = sum(float(self.predict_runtime(nodes, edges, samples, algorithm)[0])
+                    for samples, algorithm in runs)
+        return total / max(1, workers)
+
+
+def pack(seconds, capacity):
+    """
+    bins items of the given predicted seconds into allocations of at
+    most capacity seconds, longest first, each into the least loaded bin
+    it fits in (a new one if none); an item longer than capacity gets a
+    bin of its own.  Bins end up close to even, in O(n log n).
+
+    returns:
+    -------
+        a list of bins, each a list of item indices
+    """
+    bins, loads = [], []
+    for i in sorted(range(len(seconds)), key=lambda i: -seconds[i]):
+        if loads and loads[0][0] + seconds[i] <= capacity:
+            load, b = heapq.heappop(loads)
+            bins[b].append(i)
+            heapq.heappush(loads, (load + seconds[i], b))
+        else:
+            heapq.heappush(loads, (seconds[i], len(bins)))
+            bins.append([i])
+    return bins
+
+
+def slurm_time(seconds, minimum=60):
+    """ seconds as a SLURM time limit, rounded up to whole minutes """
+    minutes = math.ceil(max(seconds, minimum) / 60)
+    return "{}:{:02d}:00".format(minutes // 60, minutes % 60)
+
+
+def slurm_mem(mb, minimum=256):
+    """ MB as a SLURM memory request, rounded up to 256 MB """
+    return "{}m".format(256 * math.ceil(max(mb, minimum) / 256))
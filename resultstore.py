@@ -0,0 +1,201 @@
+"""
+resultstore:
+an append-only store of discovery results, partitioned by the
+(nodes, edges, r) of the generating graph.
+
+Each job's rows are added as immutable gzipped csv shards, one per
+partition it touches, at
+
+    root/nodes=<nodes>/edges=<edges>/r=<r>/job-<job_id>.csv.gz
+
+so adding a job costs the same however many are already stored, and
+adding the same job again (before its partition is compacted) replaces
+its shards rather than duplicating them.  compact() merges each
+partition's shards into one; read() presents every shard as a single
+table.
+
+Shards are gzipped csv, the format discover.py already writes its
+results in, so no columnar-format library is needed.
+
+Run as a script, e.g.
+
+    python resultstore.py compact results/
+    python resultstore.py import results/ results7.csv.gz
+    python resultstore.py export results/ all_results.csv.gz
+"""
+
+import argparse
+import glob
+import os
+import pandas
+import time
+
+KEYS = ('nodes', 'edges', 'r')
+
+
+def _parse(value):
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _write_atomic(df, fname):
+    """ writes df to fname through a temporary file, so that readers
+    never see a partly written shard """
+    tmpname = fname + '.tmp'
+    df.to_csv(tmpname, index=False, compression='gzip')
+    os.replace(tmpname, fname)
+
+
+class ResultsStore:
+    """
+    A results store rooted at the directory root.
+
+    parameters:
+    ----------
+        root: the directory holding the partitions; created if missing
+        keys: the columns the rows are partitioned by
+    """
+
+    def __init__(self, root, keys=KEYS):
+        self.root = root
+        self.keys = tuple(keys)
+        os.makedirs(root, exist_ok=True)
+
+    def partition_dir(self, values):
+        """ the directory of the partition with the given key values """
+        return os.path.join(self.root, *("{}={}".format(k, v)
+                                         for k, v in zip(self.keys, values)))
+
+    def append(self, df, job_id):
+        """
+        adds the rows of df as the results of job job_id, one shard per
+        partition; a job added before has its shards replaced.
+
+        returns:
+        -------
+            the shard filenames written
+        """
+        written = []
+        for values, rows in df.groupby(list(self.keys), sort=True):
+            dirname = self.partition_dir(values)
+            os.makedirs(dirname, exist_ok=True)
+            fname = os.path.join(dirname, "job-{}.csv.gz".format(job_id))
+            _write_atomic(rows, fname)
+            written.append(fname)
+        return written
+
+    def append_file(self, fname, job_id):
+        """ adds the gzipped results csv fname, as written by
+        discover.py, as the results of job job_id """
+        return self.append(pandas.read_csv(fname, compression='gzip'), job_id)
+
+    def partitions(self, **where):
+        """
+        lists the partition directories, optionally only those whose key
+        values match where, e.g. partitions(nodes=10, r=0.3)
+        """
+        pattern = os.path.join(self.root, *("{}=*".format(k) for k in self.keys))
+        selected = []
+        for dirname in sorted(glob.glob(pattern)):
+            parts = os.path.relpath(dirname, self.root).split(os.sep)
+            values = {k: _parse(p.split('=', 1)[1]) for k, p in zip(self.keys, parts)}
+            if all(values[k] == v for k, v in where.items()):
+                selected.append(dirname)
+        return selected
+
+    def shards(self, **where):
+        """
+        lists the live shards of the partitions matching where.
+        Shards already merged by a compaction that was interrupted
+        before deleting them are left out.
+        """
+        live = []
+        for dirname in self.partitions(**where):
+            merged = set()
+            for sources in glob.glob(os.path.join(dirname, '*.sources')):
+                if os.path.exists(sources[:-len('.sources')]):
+                    with open(sources) as f:
+                        merged.update(f.read().split())
+            live += [fname for fname in sorted(glob.glob(os.path.join(dirname, '*.csv.gz')))
+                     if os.path.basename(fname) not in merged]
+        return live
+
+    def read(self, columns=None, **where):
+        """
+        reads the store as one DataFrame.
+
+        parameters:
+        ----------
+            columns: optional list of the columns to read; shards
+                written before a column existed give it as NaN
+            where: key values restricting the partitions read,
+                e.g. read(nodes=10)
+        """
+        usecols = None if columns is None else (lambda c: c in columns)
+        frames = [pandas.read_csv(fname, compression='gzip', usecols=usecols)
+                  for fname in self.shards(**where)]
+        if len(frames) == 0:
+            return pandas.DataFrame(columns=columns)
+        df = pandas.concat(frames, ignore_index=True)
+        return df if columns is None else df.reindex(columns=columns)
+
+    def compact(self, **where):
+        """
+        merges the shards of every partition matching where that has
+        more than one into a single shard.
+
+        The merged shard is written, with a sidecar listing the shards
+        it replaces, before any of them is deleted, so an interrupted
+        compaction never loses or doubles rows.
+
+        returns:
+        -------
+            the number of shards removed
+        """
+        removed = 0
+        for dirname in self.partitions(**where):
+            self._finish_compactions(dirname)
+            shards = sorted(glob.glob(os.path.join(dirname, '*.csv.gz')))
+            if len(shards) < 2:
+                continue
+            merged = pandas.concat([pandas.read_csv(fname, compression='gzip')
+                                    for fname in shards], ignore_index=True)
+            fname = os.path.join(dirname, "compacted-{}.csv.gz".format(time.time_ns()))
+            with open(fname + '.sources', 'w') as f:
+                f.write("\n".join(os.path.basename(s) for s in shards))
+            _write_atomic(merged, fname)
+            self._finish_compactions(dirname)
+            removed += len(shards) - 1
+        return removed
+
+    @staticmethod
+    def _finish_compactions(dirname):
+        """ deletes the shards listed by the sidecar of each merged shard
+        in dirname, then the sidecar; sidecars of merges that were never
+        written are just deleted """
+        for sources in glob.glob(os.path.join(dirname, '*.sources')):
+            if os.path.exists(sources[:-len('.sources')]):
+                with open(sources) as f:
+                    for shard in f.read().split():
+                        if os.path.exists(os.path.join(dirname, shard)):
+                            os.remove(os.path.join(dirname, shard))
+            os.remove(sources)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="manages a results store")
+    parser.add_argument("command", choices=['compact', 'import', 'export'])
+    parser.add_argument("root")
+    parser.add_argument("fname", nargs='?', help="the csv.gz to import or export")
+    args = parser.parse_args()
+    store = ResultsStore(args.root)
+    if args.command == 'compact':
+        print("removed {} shards".format(store.compact()))
+    elif args.command == 'import':
+        store.append_file(args.fname, job_id='import-' + os.path.basename(args.fname))
+    else:
+        store.read().to_csv(args.fname, index=False, compression='gzip')
@@ -0,0 +1,144 @@
+"""
+sequential:
+a sequential stopping rule for the graph replicates of each
+configuration, for jobrunner.py.
+
+Every (nodes, edges, r) configuration is run on up to 500 generating
+graphs, but for many the intervals process_simdata reports are tight
+long before that.  StoppingRule recomputes, after every batch of
+replicates, the confidence interval of the mean of each chosen metric
+in every group (samples, metaparameter, algorithm) of a configuration,
+
+    mean +/- z * sd / sqrt(n)
+
+and calls the configuration settled once, in each of its groups,
+every metric has at least min_replicates values and an interval
+narrower than width.  Runs that failed or timed out have no scores and
+count for nothing; a metric undefined in the runs that succeeded (a
+precision where nothing was found) has no interval to narrow, and only
+needs min_replicates successful runs.  jobrunner.py then stops the
+configuration's unstarted jobs (see jobqueue.JobQueue.stop) and claims
+jobs a replicate at a time across configurations, so that capacity goes
+to those still uncertain.
+
+Run as a script on a results store (or csv) to see where every
+configuration stands, e.g.
+
+    python sequential.py results/ --width 0.05
+"""
+
+import argparse
+import numpy
+import pandas
+import process_simdata
+import statistics
+
+CONFIG_COLUMNS = ['nodes', 'edges', 'r']
+
+# the results columns the rule reads (see resultstore.ResultsStore.read)
+COLUMNS = process_simdata.GROUP_COLUMNS + ['oriented_TP', 'oriented_FP', 'oriented_FN',
+                                           'skeletal_TP', 'skeletal_FP', 'skeletal_FN',
+                                           'skeletal_TN', 'outcome']
+
+DEFAULT_METRICS = ['oriented_sensitivity', 'oriented_precision']
+
+
+def interval_widths(results, metrics=None, level=0.95):
+    """
+    the width of the normal confidence interval of the mean of each
+    metric, in every group of the results.
+
+    parameters:
+    ----------
+        results: a results table, as discover.py writes it
+        metrics: columns of process_simdata.add_metrics; defaults to
+            DEFAULT_METRICS
+        level: the coverage of the intervals
+
+    returns:
+    -------
+        a DataFrame with a row per group: its GROUP_COLUMNS, nruns, nok
+        (the runs that succeeded; results without an outcome column
+        count as such), and n_<metric> (the values the metric has) and
+        width_<metric> (NaN where it has fewer than two) for every metric
+    """
+    metrics = DEFAULT_METRICS if metrics is None else metrics
+    df = results if 'adjacency_TP' in results else process_simdata.add_metrics(results)
+    ok = (df['outcome'].fillna('ok') == 'ok') if 'outcome' in df else True
+    df = df[process_simdata.GROUP_COLUMNS].join(df[metrics].astype(float))
+    df['nok'] = ok
+    grouped = df.groupby(process_simdata.GROUP_COLUMNS, dropna=False)
+    z = statistics.NormalDist().inv_cdf(0.5 + level / 2)
+    counts = grouped[metrics].count()
+    widths = 2 * z * grouped[metrics].std() / numpy.sqrt(counts)
+    table = grouped.size().rename('nruns').to_frame()
+    table['nok'] = grouped['nok'].sum().astype(int)
+    for c in metrics:
+        table['n_{}'.format(c)] = counts[c]
+        table['width_{}'.format(c)] = widths[c]
+    return table.reset_index()
+
+
+class StoppingRule:
+    """
+    Decides which configurations have enough replicates.
+
+    parameters:
+    ----------
+        metrics: the metrics whose intervals must be narrow
+        width: the widest interval a settled configuration may have
+        level: the coverage of the intervals
+        min_replicates: the fewest values of every metric in every group
+            of a settled configuration
+    """
+
+    def __init__(self, metrics=None, width=0.05, level=0.95, min_replicates=20):
+        self.metrics = DEFAULT_METRICS if metrics is None else list(metrics)
+        self.width = width
+        self.level = level
+        self.min_replicates = min_replicates
+
+    def status(self, results):
+        """
+        returns:
+        -------
+            a DataFrame with a row per (nodes, edges, r) configuration in
+            results: the fewest values of any metric in any of its groups
+            (min_values), its widest interval (max_width) and whether it
+            is settled
+        """
+        widths = interval_widths(results, self.metrics, self.level)
+        settled = pandas.Series(True, index=widths.index)
+        for c in self.metrics:
+            n, w = widths['n_{}'.format(c)], widths['width_{}'.format(c)]
+            # a metric undefined in every successful run has no interval
+            # to narrow; failed runs give it neither values nor a pass
+            settled &= (((n >= self.min_replicates) & (w <= self.width))
+                        | (w.isna() & (n < 2) & (widths.nok >= self.min_replicates)))
+        widths['settled'] = settled
+        widths['min_values'] = widths[['n_{}'.format(c) for c in self.metrics]].min(axis=1)
+        widths['max_width'] = widths[['width_{}'.format(c) for c in self.metrics]].max(axis=1)
+        grouped = widths.groupby(CONFIG_COLUMNS)
+        table = pandas.DataFrame({'min_values': grouped['min_values'].min(),
+                                  'max_width': grouped['max_width'].max(),
+                                  'settled': grouped['settled'].all()})
+        return table.reset_index()
+
+    def settled(self, results):
+        """ the (nodes, edges, r) of the settled configurations in results """
+        table = self.status(results)
+        return [(int(n), int(e), float(r)) for n, e, r
+                in table[table.settled][CONFIG_COLUMNS].itertuples(index=False)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="shows which configurations have "
+                                     "enough replicates")
+    parser.add_argument("results", help="a results csv, or a results store directory")
+    parser.add_argument("--metrics", nargs='+', default=DEFAULT_METRICS)
+    parser.add_argument("--width", type=float, default=0.05)
+    parser.add_argument("--level", type=float, default=0.95)
+    parser.add_argument("--min-replicates", type=int, default=20)
+    args = parser.parse_args()
+    rule = StoppingRule(args.metrics, args.width, args.level, args.min_replicates)
+    print(rule.status(process_simdata.read_results(args.results)).to_string(index=False))
@@ -0,0 +1,288 @@
+"""
+slurmarray:
+submits many small commands to SLURM as job arrays, packing several
+commands into each array task, rather than one sbatch call (and one
+allocation) per command.
+
+The commands of a submission go into a manifest, a file with one line
+of JSON per array task listing the shell commands it runs; each task
+runs
+
+    python3 slurmarray.py run <manifest> --workers <n>
+
+which looks up its own line by SLURM_ARRAY_TASK_ID and runs its
+commands (see asyncrunner), one at a time or, with --workers, several
+at once.  A submission with more tasks than SLURM allows in one array
+is split into several arrays, each with its own manifest.
+
+sbatch is whatever the SBATCH environment variable names, or sbatch.
+`python3 slurmarray.py fake <dirname>` writes a stand-in sbatch and
+srun into dirname, which record every submission in
+dirname/submissions.jsonl (put dirname first on PATH, or point SBATCH
+at its sbatch); with FAKE_SBATCH_RUN=1 the fake sbatch also runs each
+array task, one after another, as SLURM would.
+"""
+
+import argparse
+import asyncrunner
+import json
+import os
+import re
+import resourcemodel
+import stat
+import subprocess
+import sys
+
+MAX_ARRAY_SIZE = 1000
+
+
+def pack(commands, per_task):
+    """ splits commands into consecutive lists of at most per_task """
+    commands = list(commands)
+    per_task = max(1, per_task)
+    return [commands[i:i + per_task] for i in range(0, len(commands), per_task)]
+
+
+def write_manifest(fname, tasks):
+    """ writes the manifest fname, where tasks[i] is the list of
+    commands array task i runs """
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    tmpname = fname + '.tmp'
+    with open(tmpname, 'w') as f:
+        for commands in tasks:
+            f.write(json.dumps(commands) + '\n')
+    os.replace(tmpname, fname)
+
+
+def read_task(fname, task_id):
+    """ the list of commands of array task task_id in manifest fname """
+    with open(fname) as f:
+        for i, line in enumerate(f):
+            if i == task_id:
+                return json.loads(line)
+    raise IndexError("manifest {} has no task {}".format(fname, task_id))
+
+
+def array_script(manifest, num_tasks, job_name, time, mem, cpus_per_task=1,
+                 account=None, max_running=None, begin=None, output_dir='slurmoutput',
+                 launcher='', workers=1):
+    """
+    the sbatch script of a job array of num_tasks tasks running the
+    manifest.
+
+    parameters:
+    ----------
+        manifest: the manifest file
+        num_tasks: the number of array tasks
+        job_name, time, mem, account, begin: as the sbatch options
+        cpus_per_task: cpus per array task
+        max_running: the most array tasks to run at once, if limited
+        output_dir: where each task's output and error go, as
+            <job_name>-<array job id>_<task id>.txt/.err
+        launcher: a prefix for the task's command line, such as 'srun'
+        workers: how many of its commands a task runs at once; leave at 1
+            for commands that use every cpu of the task themselves
+    """
+    array = "0-{}".format(num_tasks - 1)
+    if max_running is not None:
+        array += "%{}".format(max_running)
+    s = "#!/bin/bash -l\n"
+    if account is not None:
+        s += "#SBATCH -A {}\n".format(account)
+    if begin is not None:
+        s += "#SBATCH --begin={}\n".format(begin)
+    s += "#SBATCH --array={}\n".format(array)
+    s += "#SBATCH --time={}\n".format(time)
+    s += "#SBATCH --mem={}\n".format(mem)
+    s += "#SBATCH --ntasks=1\n"
+    s += "#SBATCH --cpus-per-task={}\n".format(cpus_per_task)
+    s += "#SBATCH --mail-type=NONE\n"
+    s += "#SBATCH --job-name={}\n".format(job_name)
+    s += "#SBATCH --output={}/%x-%A_%a.txt\n".format(output_dir)
+    s += "#SBATCH --error={}/%x-%A_%a.err\n".format(output_dir)
+    s += "{} python3 {} run {} --workers {}\n".format(
+        launcher, os.path.abspath(__file__), os.path.abspath(manifest), workers).lstrip()
+    return s
+
+
+def submit(script, sbatch=None):
+    """
+    submits the sbatch script.
+
+    returns:
+    -------
+        the job id sbatch reports
+    """
+    if sbatch is None:
+        sbatch = os.environ.get('SBATCH', 'sbatch')
+    completed = subprocess.run([sbatch], input=script, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError("sbatch failed: {}".format(completed.stderr.strip()))
+    match = re.search(r"Submitted batch job (\d+)", completed.stdout)
+    return int(match.group(1)) if match else None
+
+
+def submit_array(manifest, commands, per_task, job_name, time, mem,
+                 max_array_size=MAX_ARRAY_SIZE, sbatch=None, **options):
+    """
+    packs commands per_task to an array task, writes the manifest and
+    submits the array; more than max_array_size tasks are split across
+    arrays, with manifests manifest-1, manifest-2, ...
+
+    parameters:
+    ----------
+        time: the time limit of one array task, which runs up to
+            per_task commands
+        options: further array_script options
+
+    returns:
+    -------
+        a list of (manifest, number of tasks, job id), one per array
+    """
+    return submit_tasks(manifest, pack(commands, per_task), job_name, time, mem,
+                        max_array_size, sbatch, **options)
+
+
+def submit_tasks(manifest, tasks, job_name, time, mem,
+                 max_array_size=MAX_ARRAY_SIZE, sbatch=None, **options):
+    """
+    as submit_array, for commands already packed into tasks, a list of
+    lists of commands (see resourcemodel.pack)
+    """
+    submitted = []
+    for part, begin in enumerate(range(0, len(tasks), max_array_size)):
+        chunk = tasks[begin:begin + max_array_size]
+        fname = manifest if len(tasks) <= max_array_size else "{}-{}".format(manifest, part + 1)
+        write_manifest(fname, chunk)
+        script = array_script(fname, len(chunk), job_name, time, mem, **options)
+        submitted.append((fname, len(chunk), submit(script, sbatch)))
+    return submitted
+
+
+def submit_sized(manifest, commands, seconds, memory, capacity, job_name,
+                 max_array_size=MAX_ARRAY_SIZE, sbatch=None, **options):
+    """
+    packs commands into array tasks of about capacity seconds by their
+    predicted seconds (see resourcemodel.pack), and submits them with
+    each array's time and memory limits those of its longest task and
+    largest command, rather than fixed ones.
+
+    parameters:
+    ----------
+        seconds, memory: the predicted seconds and MB of each command,
+            safety margins included
+        capacity: the seconds of work to pack into one array task
+
+    returns:
+    -------
+        a list of (manifest, number of tasks, job id), one per array
+    """
+    bins = resourcemodel.pack(seconds, capacity)
+    loads = [sum(seconds[i] for i in b) for b in bins]
+    # longest tasks first, so that each array holds tasks of similar length
+    order = sorted(range(len(bins)), key=lambda b: -loads[b])
+    submitted = []
+    for part, begin in enumerate(range(0, len(order), max_array_size)):
+        chunk = order[begin:begin + max_array_size]
+        fname = manifest if len(order) <= max_array_size else "{}-{}".format(manifest, part + 1)
+        time = resourcemodel.slurm_time(loads[chunk[0]])
+        mem = resourcemodel.slurm_mem(max(memory[i] for b in chunk for i in bins[b]))
+        submitted += submit_tasks(fname, [[commands[i] for i in bins[b]] for b in chunk],
+                                  job_name, time, mem, max_array_size, sbatch, **options)
+    return submitted
+
+
+def run_task(manifest, task_id=None, workers=None, timeout=None):
+    """
+    runs the commands of an array task, workers at a time.
+    task_id and workers default to SLURM_ARRAY_TASK_ID and
+    SLURM_CPUS_PER_TASK.
+
+    returns:
+    -------
+        a list of asyncrunner.CommandResults, one per command
+    """
+    if task_id is None:
+        task_id = int(os.environ['SLURM_ARRAY_TASK_ID'])
+    if workers is None:
+        workers = int(os.environ.get('SLURM_CPUS_PER_TASK', 1))
+    results = asyncrunner.run_commands(read_task(manifest, task_id), workers, timeout)
+    for result in results:
+        print("{}\t{:.1f}s\t{}".format(result.outcome, result.runtime, result.command))
+        sys.stdout.write(result.stdout)
+        sys.stderr.write(result.stderr)
+    return results
+
+
+_FAKE_SBATCH = '''#!{python}
+import json, os, re, subprocess, sys
+log = {log!r}
+script = sys.stdin.read()
+job_id = sum(1 for _ in open(log)) + 1 if os.path.exists(log) else 1
+with open(log, 'a') as f:
+    f.write(json.dumps({{'command': 'sbatch', 'job_id': job_id,
+                         'argv': sys.argv[1:], 'script': script}}) + '\\n')
+if os.environ.get('FAKE_SBATCH_RUN') == '1':
+    array = re.search(r'#SBATCH --array=(\\d+)-(\\d+)', script)
+    first, last = (int(array.group(1)), int(array.group(2))) if array else (0, 0)
+    for task in range(first, last + 1):
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID=str(task), SLURM_ARRAY_JOB_ID=str(job_id),
+                   SLURM_JOB_ID=str(job_id))
+        subprocess.run(['bash', '-c', script], env=env, stdout=sys.stderr)
+print('Submitted batch job {{}}'.format(job_id))
+'''
+
+_FAKE_SRUN = '''#!{python}
+import json, os, sys
+with open({log!r}, 'a') as f:
+    f.write(json.dumps({{'command': 'srun', 'argv': sys.argv[1:]}}) + '\\n')
+os.execvp(sys.argv[1], sys.argv[1:])
+'''
+
+
+def install_fake(dirname):
+    """
+    writes stand-in sbatch and srun executables into dirname, recording
+    their calls in dirname/submissions.jsonl.
+
+    returns:
+    -------
+        the path of the fake sbatch, to use as SBATCH
+    """
+    os.makedirs(dirname, exist_ok=True)
+    log = os.path.join(os.path.abspath(dirname), 'submissions.jsonl')
+    for name, template in [('sbatch', _FAKE_SBATCH), ('srun', _FAKE_SRUN)]:
+        fname = os.path.join(dirname, name)
+        with open(fname, 'w') as f:
+            f.write(template.format(python=sys.executable, log=log))
+        os.chmod(fname, os.stat(fname).st_mode | stat.S_IEXEC)
+    return os.path.join(os.path.abspath(dirname), 'sbatch')
+
+
+def read_submissions(dirname):
+    """ the calls recorded by the fake sbatch and srun in dirname """
+    fname = os.path.join(dirname, 'submissions.jsonl')
+    if not os.path.exists(fname):
+        return []
+    with open(fname) as f:
+        return [json.loads(line) for line in f]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="runs array tasks from a manifest")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run = subparsers.add_parser('run', help="runs this array task's commands")
+    run.add_argument("manifest")
+    run.add_argument("task_id", type=int, nargs='?', default=None,
+                     help="defaults to SLURM_ARRAY_TASK_ID")
+    run.add_argument("--workers", type=int, default=None,
+                     help="defaults to SLURM_CPUS_PER_TASK")
+    run.add_argument("--timeout", type=float, default=None)
+    fake = subparsers.add_parser('fake', help="writes a fake sbatch and srun")
+    fake.add_argument("dirname")
+    args = parser.parse_args()
+    if args.command == 'run':
+        results = run_task(args.manifest, args.task_id, args.workers, args.timeout)
+        sys.exit(0 if all(r.outcome == 'ok' for r in results) else 1)
+    else:
+        print(install_fake(args.dirname))
@@ -1,5 +1,11 @@
+import graphbank
+import numpy
 import os
+import resourcemodel
+import resultstore
+import slurmarray
 import sys
+import time
 from itertools import chain
 
 # +--------------------------------------+
@@ -16,6 +22,11 @@ resultsdir = basedir + simname + 'lowsamples/'
 #os.makedirs(resultsdir, exist_ok=True)
 
 
+# graphs come from the bank (see graphbank.py) when there is one,
+# and from individual graph files otherwise
+bankfile = basedir + simname + '/graphbank.npz'
+bank = graphbank.GraphBank(bankfile) if os.path.isfile(bankfile) else None
+
 gstr = "graph-{}-vars_{}-edges_{}-r_{}.txt"
 dstr = 'results_{}-vars_{}-edges_{}-r_{}-meta_{}-graphnum-{}_{}-samples.csv'
 
@@ -27,6 +38,18 @@ samples = [50, 100, 200, 400, 800, 1600, 3200, 6400]
 alphas = [0.001, 0.01, .05, 0.1]
 graphnums = range(1, 501)
 
+# configurations are packed into job arrays (see slurmarray.py), about
+# an hour of predicted work to each array task; runtimes and memory are
+# predicted from the results store, if there is one (see resourcemodel.py),
+# and otherwise taken as a minute and 1g for pc and 20 minutes and 4g
+# for the others
+task_seconds = 3600
+manifestdir = basedir + simname + '/manifests/'
+storedir = basedir + simname + '/results/'
+model = resourcemodel.ResourceModel()
+if os.path.isdir(storedir):
+    model.fit(resultstore.ResultsStore(storedir).read(columns=resourcemodel.COLUMNS))
+
 pcqueue = ((n, int(n * density), r, graph, 'pc', sample, alpha) for n in nodes \
         for density in densities \
         for r in rs \
@@ -42,6 +65,8 @@ othqueue = ((n, int(n * density), r, graph, algorithm, sample, 2) for n in nodes
         for sample in samples)
 
 jobnum = 0
+commands = {'pc': [], 'oth': []}
+configs = {'pc': [], 'oth': []}
 i = 0
 i_written = False
 start_index = 0
@@ -50,15 +75,20 @@ for num_v, num_edges, r, graph, algorithm, nsamples, alpha in chain(pcqueue, oth
     graphfname = gstr.format(num_v, num_edges, r, graph)
     outputfname = dstr.format(num_v, num_edges, r, alpha, algorithm, graph, nsamples)
 
-    # high density/ high-r graphs are hard to generate, so ignore for now
-    if r == 0.5 and (num_edges / num_v == 2):
-        print('High R and Density, SKIPPING:', outputfname)
-        continue
+    if bank is not None:
+        if (num_v, num_edges, r, graph) not in bank:
+            print('Graph not in bank:', graphfname)
+            continue
+    else:
+        # high density/ high-r graphs are hard to generate, so ignore for now
+        if r == 0.5 and (num_edges / num_v == 2):
+            print('High R and Density, SKIPPING:', outputfname)
+            continue
 
-    # don't bother if the generating graph doesn't exist
-    if not os.path.isfile(graphdir + graphfname):
-        print('Graph file does not exist:', graphfname)
-        continue
+        # don't bother if the generating graph doesn't exist
+        if not os.path.isfile(graphdir + graphfname):
+            print('Graph file does not exist:', graphfname)
+            continue
 
     # in case of restart, skip the first start_index combinations that have already been done
     if i  < start_index:
@@ -79,25 +109,28 @@ for num_v, num_edges, r, graph, algorithm, nsamples, alpha in chain(pcqueue, oth
             i_written = True
 
     print('RUNNING', outputfname)
-    s = "sbatch << EOF\n"
-    s += "#!/bin/bash -l\n"        
-
-    if algorithm == 'pc':
-        s += "#SBATCH --time=1\n"
-        s += "#SBATCH --mem=1g\n"
-    else:
-        s += "#SBATCH --time=20\n"
-        s += "#SBATCH --mem=4g\n"
-
-    s += "#SBATCH --ntasks=1\n"
-    s += "#SBATCH --mail-type=NONE\n"
-    s += "#SBATCH --error=slurmoutput/slurm-{}_{}_{}_{}_{}_{}_{}_{}.err\n".format(num_v, num_edges, r, graph, algorithm, nsamples, alpha, jobnum)
-    s += "#SBATCH --job-name={}\n".format(algorithm)
-    s += "#SBATCH --output=slurmoutput/joboutput.txt\n"
-    s += "srun python3 discover.py {} {} {} {} {} {} {} {}\n".format(num_v, num_edges, r, graph, algorithm, nsamples, alpha, jobnum)
-    s += "EOF\n"
-
-    _ = os.popen(s).read()
+    kind = 'pc' if algorithm == 'pc' else 'oth'
+    commands[kind].append("python3 discover.py {} {} {} {} {} {} {} {}".format(
+        num_v, num_edges, r, graph, algorithm, nsamples, alpha, jobnum))
+    configs[kind].append((num_v, num_edges, nsamples, algorithm))
     jobnum +=1
 #   break
 
+# submit every configuration as a few job arrays, rather than one job each
+stamp = int(time.time())
+for kind, default_mem in [('pc', 1024), ('oth', 4096)]:
+    if len(commands[kind]) == 0:
+        continue
+    num_v, num_edges, nsamples, algorithm = (numpy.array(c) for c in zip(*configs[kind]))
+    seconds = numpy.zeros(len(num_v))
+    for name in numpy.unique(algorithm):
+        selected = algorithm == name
+        seconds[selected] = model.predict_runtime(num_v[selected], num_edges[selected],
+                                                  nsamples[selected], name)
+    memory = model.predict_memory(num_v, num_edges, default=default_mem)
+    for manifest, num_tasks, job_id in slurmarray.submit_sized(
+            manifestdir + '{}-{}.jsonl'.format(kind, stamp), commands[kind],
+            seconds.tolist(), memory.tolist(), task_seconds, job_name=kind,
+            launcher='srun'):
+        print('SUBMITTED', len(commands[kind]), kind, 'runs as array', job_id,
+              'of', num_tasks, 'tasks, manifest', manifest)
@@ -0,0 +1,314 @@
+"""
+workerpool:
+a discovery backend that keeps long-lived discovery workers running,
+each taking one search at a time over a pipe.
+
+Only the worker command decides what a warm worker saves.  The stand-in
+worker below keeps a Python process (and, with the numpy engine, pcalg)
+loaded between searches, but its causal-cmd engine still starts a new
+JVM for every search, exactly as --backend causal-cmd does, so with
+causal-cmd the pool saves no JVM start or class loading.  That saving
+needs a worker command that keeps a JVM resident (a Java loop calling
+causal-cmd or the Tetrad API per request), speaking the protocol below;
+none is provided here, and so discover.py and powersearch.py do not
+offer the pool as a --backend until one is.
+
+Each worker is a process that reads requests from its stdin and writes
+one reply per request to its stdout, both as single lines of JSON:
+
+    {"op": "run", "dataset": ..., "algorithm": ..., "meta": ...,
+     "data_type": ..., "output_directory": ..., "output_prefix": ...}
+        runs discovery, leaving the graph in
+        output_directory/output_prefix.txt in causal-cmd's output layout
+    {"op": "ping"}
+        a health check
+    {"op": "quit"}
+        exits, without a reply
+
+A reply is {"ok": true} or {"ok": false, "error": message}.
+Every worker gets its own java.util.prefs directory, substituted for
+{prefs} in its command line, so that concurrent JVMs do not collide.
+
+Run as a script, this module is a stand-in worker speaking the protocol,
+e.g.
+
+    python workerpool.py --engine numpy --prefs dir1/prefs
+
+where the engine is 'numpy' (pcalg, in-process), 'causal-cmd' (one
+causal-cmd call, and so one JVM start, per request, using the worker's
+prefs directory) or 'fake' (an empty graph after --delay seconds), so
+that the pool can be tested and benchmarked without the jar.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import picause
+
+
+class WorkerError(RuntimeError):
+    """ raised when a worker dies, hangs or cannot be restarted """
+
+
+def worker_command(engine='causal-cmd', delay=0.0, fail_after=None):
+    """
+    the command line of a stand-in worker, with a {prefs} placeholder.
+
+    parameters:
+    ----------
+        engine: 'numpy', 'causal-cmd' or 'fake'
+        delay: seconds the fake engine waits before replying
+        fail_after: if given, the worker exits abruptly on receiving its
+            (fail_after + 1)th run request; used to test restarts
+    """
+    command = [sys.executable, os.path.abspath(__file__),
+               '--engine', engine, '--prefs', '{prefs}']
+    if delay:
+        command += ['--delay', str(delay)]
+    if fail_after is not None:
+        command += ['--fail-after', str(fail_after)]
+    return command
+
+
+class _Worker:
+    """ one worker process, with a thread collecting its replies """
+
+    def __init__(self, command, prefs):
+        os.makedirs(prefs, exist_ok=True)
+        self.prefs = prefs
+        self.process = subprocess.Popen([c.format(prefs=prefs) for c in command],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        text=True, bufsize=1)
+        self.replies = queue.Queue()
+        self.requests = 0
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.replies.put(line)
+        self.replies.put(None)
+
+    def request(self, message, timeout=None):
+        """ sends message and returns the decoded reply """
+        try:
+            self.process.stdin.write(json.dumps(message) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            raise WorkerError("worker {} is not accepting requests".format(self.process.pid))
+        try:
+            line = self.replies.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerError("worker {} timed out".format(self.process.pid))
+        if line is None:
+            raise WorkerError("worker {} exited with status {}".format(
+                self.process.pid, self.process.wait()))
+        self.requests += 1
+        return json.loads(line)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self, timeout=5):
+        if self.alive():
+            try:
+                self.process.stdin.write(json.dumps({'op': 'quit'}) + '\n')
+                self.process.stdin.close()
+                self.process.wait(timeout)
+            except (BrokenPipeError, OSError, ValueError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+class WorkerPoolBackend:
+    """
+    A discovery backend that hands each search to one of num_workers
+    long-lived workers, so the per-call cost is a round trip on a pipe
+    rather than a worker process start.  With the default stand-in
+    worker and causal-cmd, every search still starts its own JVM (see
+    the module docstring).
+
+    run() may be called from several threads at once; each call waits
+    for an idle worker.  A worker that exits, stops accepting requests,
+    or takes longer than timeout is killed and replaced, and the request
+    retried on the replacement, up to max_restarts times per request.
+
+    parameters:
+    ----------
+        command: the worker command line, as a list with {prefs} standing
+            for the worker's prefs directory.
+            Defaults to a stand-in worker with the causal-cmd engine.
+        num_workers: the number of workers to keep alive
+        prefs_root: the directory under which each worker gets a prefs
+            directory, prefs_root/worker<i>. Defaults to ./worker_prefs
+        timeout: seconds to wait for a reply; None waits forever
+        max_restarts: how often a single request may restart a worker
+    """
+
+    def __init__(self, command=None, num_workers=2, prefs_root=None,
+                 timeout=None, max_restarts=3):
+        if command is None:
+            command = worker_command()
+        if prefs_root is None:
+            prefs_root = os.path.join(os.getcwd(), 'worker_prefs')
+        self.command = command
+        self.prefs_root = prefs_root
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self._restarts_lock = threading.Lock()
+        self.workers = [self._start(i) for i in range(num_workers)]
+        self.idle = queue.Queue()
+        for i in range(num_workers):
+            self.idle.put(i)
+
+    def _start(self, i):
+        return _Worker(self.command, os.path.join(self.prefs_root, 'worker{}'.format(i)))
+
+    def _restart(self, i):
+        self.workers[i].close(timeout=0)
+        self.workers[i] = self._start(i)
+        with self._restarts_lock:
+            self.restarts += 1
+
+    def _request(self, message):
+        i = self.idle.get()
+        try:
+            for attempt in range(self.max_restarts + 1):
+                try:
+                    return self.workers[i].request(message, self.timeout)
+                except WorkerError:
+                    if attempt == self.max_restarts:
+                        self.workers[i].close(timeout=0)
+                        raise
+                    self._restart(i)
+        finally:
+            self.idle.put(i)
+
+    def run(self, datafile, algorithm='pc', meta=0.1, jdir=None,
+            output_directory=None, output_prefix='results',
+            data_type='continuous'):
+        """
+        runs the discovery algorithm on datafile, and returns the
+        discovered graph as a Graph. See picause.discover() for the
+        parameters; jdir is ignored, as each worker has its own.
+        """
+        if output_directory is None:
+            output_directory = os.getcwd()
+        reply = self._request({'op': 'run',
+                               'dataset': os.path.abspath(datafile),
+                               'algorithm': algorithm,
+                               'meta': meta,
+                               'data_type': data_type,
+                               'output_directory': os.path.abspath(output_directory),
+                               'output_prefix': output_prefix})
+        if not reply['ok']:
+            raise RuntimeError("discovery failed: {}".format(reply['error']))
+        return picause.read_causal_output("{}/{}.txt".format(output_directory,
+                                                             output_prefix))
+
+    def check_health(self):
+        """
+        pings every idle worker, replacing any that do not answer.
+
+        returns:
+        -------
+            the number of workers replaced
+        """
+        replaced = 0
+        for _ in range(len(self.workers)):
+            i = self.idle.get()
+            try:
+                self.workers[i].request({'op': 'ping'}, self.timeout)
+            except WorkerError:
+                self._restart(i)
+                replaced += 1
+            finally:
+                self.idle.put(i)
+        return replaced
+
+    def close(self):
+        """ asks every worker to quit """
+        for worker in self.workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_names(dataset, data_type):
+    with open(dataset) as f:
+        if data_type == 'covariance':
+            f.readline()
+            return f.readline().rstrip('\n').split('\t')
+        return f.readline().rstrip('\n').split(',')
+
+
+def serve(engine='causal-cmd', prefs=None, delay=0.0, fail_after=None,
+          stdin=None, stdout=None):
+    """
+    the stand-in worker: answers protocol requests from stdin on stdout
+    until it reads a quit request or end of file.
+    See the module docstring for the engines.
+    """
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    if engine == 'numpy':
+        import pcalg
+        backend = pcalg.NumpyPCBackend()
+    elif engine == 'causal-cmd':
+        backend = picause.CausalCmdBackend()
+    elif engine != 'fake':
+        raise ValueError("unknown worker engine: {}".format(engine))
+
+    handled = 0
+    for line in stdin:
+        request = json.loads(line)
+        if request['op'] == 'quit':
+            break
+        reply = {'ok': True}
+        if request['op'] == 'run':
+            if fail_after is not None and handled >= fail_after:
+                os._exit(1)
+            handled += 1
+            try:
+                if engine == 'fake':
+                    time.sleep(delay)
+                    names = _read_names(request['dataset'], request['data_type'])
+                    picause.write_causal_output(
+                        "{}/{}.txt".format(request['output_directory'],
+                                           request['output_prefix']),
+                        picause.Graph(len(names), names=names))
+                else:
+                    with contextlib.redirect_stdout(sys.stderr):
+                        backend.run(request['dataset'], algorithm=request['algorithm'],
+                                    meta=request['meta'], jdir=prefs,
+                                    output_directory=request['output_directory'],
+                                    output_prefix=request['output_prefix'],
+                                    data_type=request['data_type'])
+            except Exception as e:
+                reply = {'ok': False, 'error': repr(e)}
+        elif request['op'] != 'ping':
+            reply = {'ok': False, 'error': "unknown op: {}".format(request['op'])}
+        stdout.write(json.dumps(reply) + '\n')
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=['numpy', 'causal-cmd', 'fake'],
+                        default='causal-cmd')
+    parser.add_argument("--prefs", default=None)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--fail-after", type=int, default=None)
+    args = parser.parse_args()
+    serve(args.engine, args.prefs, args.delay, args.fail_after)